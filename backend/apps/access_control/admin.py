@@ -2,7 +2,7 @@
 Admin configuration for Access Control app
 """
 from django.contrib import admin
-from .models import AccessPoint, AccessCode
+from .models import AccessPoint, AccessCode, Credential
 
 
 @admin.register(AccessPoint)
@@ -55,3 +55,17 @@ class AccessCodeAdmin(admin.ModelAdmin):
             'fields': ('notes',)
         }),
     )
+
+
+@admin.register(Credential)
+class CredentialAdmin(admin.ModelAdmin):
+    """Admin for Credential lookup table"""
+    list_display = ['code', 'kind', 'resident', 'visitor', 'updated_at']
+    list_filter = ['kind']
+    search_fields = ['code']
+    ordering = ['code']
+    readonly_fields = ['code', 'kind', 'access_code', 'temporary_code', 'resident', 'visitor', 'updated_at']
+    
+    def has_add_permission(self, request):
+        # Credentials are maintained automatically from access and temporary codes
+        return False
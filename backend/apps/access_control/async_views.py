@@ -0,0 +1,54 @@
+"""
+Async-native views for Access Control app
+
+Served alongside the DRF viewsets for ASGI deployments. Django's async ORM
+still runs each query in a worker thread, so these views keep everything
+else (JWT validation, credential lookup, the decision) on the event loop;
+a resident scan found in the credential index only leaves it for the
+AccessLog insert.
+"""
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.http import JsonResponse
+
+from utils.async_api import authenticate, unauthorized, throttled, parse_request
+from utils.network import get_client_ip
+from .idempotency import aidempotent
+from .metrics import StageTimer
+from .serializers import ValidateAccessRequestSerializer
+from .throttling import athrottle_scans
+from .validation import avalidate_scan
+
+
+@csrf_exempt
+@require_POST
+async def validate(request):
+    """Validate access code and log access (async variant of AccessCodeViewSet.validate)"""
+    timer = StageTimer()
+    user = await authenticate(request)
+    timer.lap('auth')
+    if user is None:
+        return unauthorized()
+    
+    scan, error_response = parse_request(request, ValidateAccessRequestSerializer)
+    if error_response is not None:
+        return error_response
+    timer.lap('parse')
+    
+    wait = await athrottle_scans(user.id, [scan])
+    timer.lap('throttle')
+    if wait is not None:
+        return throttled(wait)
+    
+    async def decide():
+        result = await avalidate_scan(scan, user.id, get_client_ip(request), timer)
+        return JsonResponse(result.data, status=result.http_status)
+    
+    response = await aidempotent(request, user.id, 'validate', decide)
+    # Replayed responses never reached the pipeline
+    if 'access_point' in timer.labels:
+        timer.record()
+    if settings.DEBUG:
+        response['Server-Timing'] = timer.server_timing()
+    return response
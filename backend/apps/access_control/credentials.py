@@ -0,0 +1,561 @@
+"""
+In-process credential index for Access Control System
+
+Each worker keeps a hash map from code string to a compact CredentialRecord,
+so the validation decision for a known code needs no database reads. The
+index is kept current by model signals (see signals.py) and by applying the
+Credential rows whose version changed since the worker last synced.
+
+With a Redis cache, a generation counter tells every worker when to sync.
+With a per-process cache, workers cannot tell each other, so each checks for
+changed rows at most every CREDENTIAL_INDEX_SYNC_INTERVAL seconds: lookups
+in between are answered from memory, and a code issued or revoked by another
+worker is seen within that interval.
+
+A Bloom filter over every live credential code sits in front of the
+database fallback, so codes that were never issued are rejected without a
+query. Syncs add the codes issued elsewhere to it, so a new code may be
+reported unknown by other workers until their next sync.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from utils.bloom import BloomFilter
+
+
+GENERATION_CACHE_KEY = 'access_control:credentials:generation'
+
+NOT_AUTHORIZED = 'Access point not authorized'
+
+
+class CredentialRecord:
+    """
+    Compact snapshot of an AccessCode or TemporaryCode used for access decisions
+    """
+    RESIDENT = 'resident'
+    VISITOR = 'visitor'
+
+    __slots__ = (
+        'kind', 'pk', 'code', 'code_type', 'holder_id', 'person_name',
+        'person_document', 'unit', 'is_active', 'expiry_date', 'valid_from',
+        'valid_until', 'max_uses', 'times_used', 'access_points_bits',
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_access_code(cls, access_code):
+        """
+        Build a record from an AccessCode
+
+        Args:
+            access_code: AccessCode with resident, unit and building loaded
+
+        Returns:
+            CredentialRecord for the resident credential
+        """
+        resident = access_code.resident
+        return cls(
+            kind=cls.RESIDENT,
+            pk=access_code.pk,
+            code=access_code.code,
+            code_type=access_code.code_type,
+            holder_id=resident.pk,
+            person_name=resident.full_name,
+            person_document=resident.document_id,
+            unit=str(resident.unit),
+            is_active=access_code.is_active,
+            expiry_date=access_code.expiry_date,
+            access_points_bits=access_code.access_points_bits,
+        )
+
+    @classmethod
+    def from_temporary_code(cls, temp_code):
+        """
+        Build a record from a TemporaryCode
+
+        Args:
+            temp_code: TemporaryCode with visitor, unit and building loaded
+
+        Returns:
+            CredentialRecord for the visitor credential
+        """
+        visitor = temp_code.visitor
+        return cls(
+            kind=cls.VISITOR,
+            pk=temp_code.pk,
+            code=temp_code.code,
+            code_type=temp_code.code_type,
+            holder_id=visitor.pk,
+            person_name=visitor.full_name,
+            person_document=visitor.document_id,
+            unit=str(visitor.unit),
+            is_active=temp_code.is_active,
+            valid_from=temp_code.valid_from,
+            valid_until=temp_code.valid_until,
+            max_uses=temp_code.max_uses,
+            times_used=temp_code.times_used,
+        )
+
+    @classmethod
+    def from_credential(cls, credential):
+        """
+        Build a record from a unified Credential row
+
+        Args:
+            credential: Credential with its code and holder loaded
+
+        Returns:
+            CredentialRecord for the resident or visitor credential
+        """
+        if credential.access_code_id is not None:
+            return cls.from_access_code(credential.access_code)
+        return cls.from_temporary_code(credential.temporary_code)
+
+    @property
+    def is_resident(self):
+        return self.kind == self.RESIDENT
+
+    @property
+    def access_method(self):
+        """AccessLog.AccessMethod matching this credential's code type"""
+        from apps.access_control.models import AccessCode
+        from apps.access_logs.models import AccessLog
+        from apps.visitors.models import TemporaryCode
+
+        if self.is_resident:
+            if self.code_type == AccessCode.CodeType.RFID:
+                return AccessLog.AccessMethod.RFID
+            return AccessLog.AccessMethod.NUMERIC_CODE
+        if self.code_type == TemporaryCode.CodeType.QR:
+            return AccessLog.AccessMethod.QR_CODE
+        return AccessLog.AccessMethod.ALPHANUMERIC_CODE
+
+    def denial_reason(self, access_point_id, now=None):
+        """
+        Evaluate the credential for an access point
+
+        Args:
+            access_point_id: Access point being used
+            now: Current time (default: timezone.now())
+
+        Returns:
+            Denial reason string, or None if access is allowed
+        """
+        now = now or timezone.now()
+        if self.is_resident:
+            if self.expiry_date and self.expiry_date < now.date():
+                return 'Code has expired'
+            if not self.is_active:
+                return 'Code is not active'
+            if self.access_points_bits and not self.access_points_bits >> access_point_id & 1:
+                return NOT_AUTHORIZED
+            return None
+
+        if now > self.valid_until:
+            return 'Code has expired'
+        if not (self.is_active and self.valid_from <= now and self.times_used < self.max_uses):
+            return 'Code is not active or has been used'
+        return None
+
+    def log_fields(self):
+        """
+        AccessLog keyword arguments describing the credential holder
+
+        Returns:
+            Dictionary of AccessLog field values
+        """
+        fields = {
+            'person_name': self.person_name,
+            'person_document': self.person_document,
+            'access_method': self.access_method,
+            'code_used': self.code,
+        }
+        if self.is_resident:
+            fields.update(resident_id=self.holder_id, access_code_id=self.pk)
+        else:
+            fields.update(visitor_id=self.holder_id, temporary_code_id=self.pk)
+        return fields
+
+
+class CredentialIndex:
+    """
+    Per-worker hash map of code string -> CredentialRecord
+
+    Holds every AccessCode and every currently usable TemporaryCode, plus the
+    set of existing access point ids. Used or expired visitor codes are left
+    out and resolved from the database, which keeps the index bounded; the
+    known-codes filter tells which misses are worth that query.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records = {}
+        self._codes_by_instance = {}
+        self._access_point_ids = frozenset()
+        self._known_codes = None
+        self._built_at = None
+        self._synced_at = None
+        self._generation = None
+        self._version = None
+
+    def _shared_generation(self):
+        return cache.get(GENERATION_CACHE_KEY, 0)
+
+    def _is_fresh(self):
+        return (
+            self._built_at is not None and
+            time.monotonic() - self._built_at <= settings.CREDENTIAL_INDEX_TTL
+        )
+
+    def _is_synced(self):
+        return (
+            self._synced_at is not None and
+            time.monotonic() - self._synced_at < settings.CREDENTIAL_INDEX_SYNC_INTERVAL
+        )
+
+    def _is_current(self):
+        if not self._is_fresh():
+            return False
+        if generation_is_shared():
+            return self._generation == self._shared_generation()
+        return self._is_synced()
+
+    async def _ais_current(self):
+        if not self._is_fresh():
+            return False
+        if generation_is_shared():
+            return self._generation == await cache.aget(GENERATION_CACHE_KEY, 0)
+        return self._is_synced()
+
+    def ensure_current(self):
+        """Rebuild the index if it is missing or expired, or apply changes made elsewhere"""
+        if self._is_current():
+            return
+        with self._lock:
+            if not self._is_fresh():
+                self.rebuild()
+            elif not self._is_current():
+                self.sync()
+
+    def rebuild(self):
+        """Load every credential and access point from the database"""
+        from apps.access_control.models import AccessPoint, Credential
+
+        with self._lock:
+            generation = self._shared_generation()
+            version = self._sync_version()
+            records = {}
+
+            credentials = credential_queryset().filter(
+                Q(kind=Credential.Kind.RESIDENT) |
+                Q(temporary_code__is_active=True, temporary_code__valid_until__gt=timezone.now())
+            )
+            for credential in credentials.iterator(chunk_size=2000):
+                records[credential.code] = CredentialRecord.from_credential(credential)
+
+            known_codes = None
+            if settings.CREDENTIAL_NEGATIVE_FILTER:
+                codes = Credential.objects.filter(is_revoked=False).values_list('code', flat=True)
+                codes = list(codes.iterator(chunk_size=5000))
+                # Leave headroom for codes issued before the next rebuild
+                known_codes = BloomFilter(capacity=len(codes) * 2 + 1024)
+                for code in codes:
+                    known_codes.add(code)
+
+            self._records = records
+            self._codes_by_instance = {(record.kind, record.pk): code for code, record in records.items()}
+            self._known_codes = known_codes
+            self._access_point_ids = frozenset(AccessPoint.objects.values_list('id', flat=True))
+            self._built_at = self._synced_at = time.monotonic()
+            self._generation = generation
+            self._version = version
+
+    def sync(self):
+        """Apply the credentials and access points changed since the last rebuild or sync"""
+        from apps.access_control.models import AccessPoint
+
+        with self._lock:
+            generation = self._shared_generation()
+            version = self._sync_version()
+            changed = credential_queryset(include_revoked=True).filter(version__gt=self._version)
+            for credential in changed.iterator(chunk_size=2000):
+                self._absorb(credential)
+            self._access_point_ids = frozenset(AccessPoint.objects.values_list('id', flat=True))
+            self._synced_at = time.monotonic()
+            self._generation = generation
+            self._version = version
+
+    @staticmethod
+    def _sync_version():
+        # The overlap covers transactions still committing while we read;
+        # their rows are applied again by the next sync
+        from apps.access_control.models import next_credential_version
+
+        return next_credential_version() - settings.CREDENTIAL_SYNC_OVERLAP * 1_000_000
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def invalidate(self):
+        """Drop the index so it is rebuilt on next use"""
+        self._built_at = None
+
+    def mark_stale(self):
+        """Sync the index on next use, e.g. after credential rows were touched"""
+        self._synced_at = None
+        self._generation = None
+
+    def might_exist(self, code):
+        """
+        Check whether a code may have been issued
+
+        Returns:
+            False if the code is definitely not a live credential
+        """
+        known_codes = self._known_codes
+        return known_codes is None or known_codes.might_contain(code)
+
+    def add_known_code(self, code):
+        """Record a newly issued code in the known-codes filter"""
+        with self._lock:
+            if self._known_codes is None:
+                return
+            self._known_codes.add(code)
+            if self._known_codes.is_saturated:
+                # False positive rate is climbing; resize on next use
+                self.invalidate()
+
+    def get(self, code):
+        """
+        Look up a code
+
+        Args:
+            code: Scanned code string
+
+        Returns:
+            CredentialRecord, or None if the code is not indexed
+        """
+        self.ensure_current()
+        return self._records.get(code)
+
+    def resolve(self, code):
+        """
+        Look up a code in the index, falling back to the database on a miss
+
+        Args:
+            code: Scanned code string
+
+        Returns:
+            CredentialRecord, or None if the code does not exist
+        """
+        return self.resolve_many([code]).get(code)
+
+    def resolve_many(self, codes):
+        """
+        Look up several codes, reading what the index cannot answer in one query
+
+        The fallback probes the unified Credential table, so unknown codes
+        cost at most one indexed read whoever would have held them. Codes
+        created by another worker since our last sync are found this way
+        and added to the index.
+
+        Args:
+            codes: Iterable of scanned code strings
+
+        Returns:
+            Dictionary of code -> CredentialRecord for the codes that exist
+        """
+        self.ensure_current()
+        records = {code: self._records.get(code) for code in codes}
+        fallback = self._fallback_queryset(records)
+        if fallback is not None:
+            for credential in fallback:
+                records[credential.code] = self._absorb(credential)
+        return {code: record for code, record in records.items() if record is not None}
+
+    async def aresolve(self, code):
+        """
+        Async variant of resolve() for ASGI views
+
+        Index hits are answered on the event loop; only rebuilds, syncs and
+        misses touch the database.
+        """
+        if not await self._ais_current():
+            await sync_to_async(self.ensure_current)()
+        records = {code: self._records.get(code)}
+        fallback = self._fallback_queryset(records)
+        if fallback is not None:
+            async for credential in fallback:
+                records[credential.code] = self._absorb(credential)
+        return records[code]
+
+    def _fallback_queryset(self, records):
+        """
+        Credential rows to read for the codes the index does not hold
+
+        Args:
+            records: Dictionary of code -> indexed CredentialRecord or None
+
+        Returns:
+            Queryset of Credential rows, or None if the index answers alone
+        """
+        misses = [
+            code for code, record in records.items() if record is None and self.might_exist(code)
+        ]
+        if not misses:
+            return None
+        return credential_queryset().filter(code__in=misses)
+
+    def _absorb(self, credential):
+        """
+        Apply a Credential row read from the database to the index
+
+        Returns:
+            CredentialRecord, or None if the credential was revoked
+        """
+        if credential.is_revoked:
+            indexed = self._records.get(credential.code)
+            if indexed is not None:
+                self.discard(credential.code, indexed.kind, indexed.pk)
+            return None
+
+        record = CredentialRecord.from_credential(credential)
+        if record.is_resident or credential.temporary_code.is_valid:
+            self.put(record)
+        else:
+            self.discard(record.code, record.kind, record.pk)
+            self.add_known_code(record.code)
+        return record
+
+    async def ahas_access_point(self, access_point_id):
+        """Async variant of has_access_point()"""
+        from apps.access_control.models import AccessPoint
+
+        if not await self._ais_current():
+            await sync_to_async(self.ensure_current)()
+        if access_point_id in self._access_point_ids:
+            return True
+        return await AccessPoint.objects.filter(id=access_point_id).aexists()
+
+    def existing_access_points(self, access_point_ids):
+        """
+        Filter access point ids down to those that exist
+
+        Args:
+            access_point_ids: Iterable of access point ids
+
+        Returns:
+            Set of the ids that exist
+        """
+        from apps.access_control.models import AccessPoint
+
+        self.ensure_current()
+        access_point_ids = set(access_point_ids)
+        existing = access_point_ids & self._access_point_ids
+        missing = access_point_ids - existing
+        if missing:
+            existing.update(AccessPoint.objects.filter(id__in=missing).values_list('id', flat=True))
+        return existing
+
+    def has_access_point(self, access_point_id):
+        """Check whether an access point exists"""
+        return bool(self.existing_access_points([access_point_id]))
+
+    def put(self, record):
+        """Insert or replace a record, dropping any other code of its credential"""
+        key = (record.kind, record.pk)
+        with self._lock:
+            previous = self._codes_by_instance.get(key)
+            if previous is not None and previous != record.code:
+                self._records.pop(previous, None)
+            replaced = self._records.get(record.code)
+            if replaced is not None and (replaced.kind, replaced.pk) != key:
+                self._codes_by_instance.pop((replaced.kind, replaced.pk), None)
+            self._records[record.code] = record
+            self._codes_by_instance[key] = record.code
+        self.add_known_code(record.code)
+
+    def discard(self, code, kind=None, pk=None):
+        """
+        Remove a code from the index
+
+        Args:
+            code: Code string to remove
+            kind: Only remove if the record has this kind (optional)
+            pk: Only remove if the record has this primary key (optional)
+        """
+        with self._lock:
+            current = self._records.get(code)
+            if current is None:
+                return
+            if kind is not None and (current.kind != kind or current.pk != pk):
+                return
+            del self._records[code]
+            self._codes_by_instance.pop((current.kind, current.pk), None)
+
+    def discard_instance(self, kind, pk):
+        """Remove any record pointing at the given credential (e.g. after a code change)"""
+        with self._lock:
+            code = self._codes_by_instance.pop((kind, pk), None)
+            if code is not None:
+                self._records.pop(code, None)
+
+    def set_access_point(self, access_point_id, exists=True):
+        """Add or remove an access point id"""
+        with self._lock:
+            if exists:
+                self._access_point_ids = self._access_point_ids | {access_point_id}
+            else:
+                self._access_point_ids = self._access_point_ids - {access_point_id}
+
+
+def credential_queryset(include_revoked=False):
+    """Credential rows joined with everything a CredentialRecord needs"""
+    from apps.access_control.models import Credential
+
+    queryset = Credential.objects.select_related(
+        'access_code__resident__unit__building',
+        'temporary_code__visitor__unit__building',
+    )
+    if not include_revoked:
+        queryset = queryset.filter(is_revoked=False)
+    return queryset
+
+
+def generation_is_shared():
+    """Whether bump_generation() reaches every worker, i.e. the cache is Redis"""
+    from django.core.cache.backends.redis import RedisCache
+
+    return isinstance(caches['default'], RedisCache)
+
+
+def bump_generation():
+    """Tell other workers that their credential index is out of date"""
+    # Workers rebuilding before the change commits would not see it
+    transaction.on_commit(_increment_generation)
+
+
+def _increment_generation():
+    try:
+        generation = cache.incr(GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.add(GENERATION_CACHE_KEY, 0, timeout=None)
+        generation = cache.incr(GENERATION_CACHE_KEY)
+    # Our own index was updated in place by the caller; only skip the rebuild
+    # if no other worker changed anything since we last synced
+    if credential_index._generation == generation - 1:
+        credential_index._generation = generation
+
+
+credential_index = CredentialIndex()
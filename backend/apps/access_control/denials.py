@@ -0,0 +1,113 @@
+"""
+Coalescing of unknown-code denials for Access Control System
+
+A keypad being mashed or a misconfigured reader can send a stream of codes
+that were never issued. Rather than one AccessLog row per keypress, the
+first unknown code from a device is logged as usual and the rest arriving
+within UNKNOWN_CODE_WINDOW seconds are counted in memory, then written as a
+single summary row once the window has closed. Counted scans are still fed
+to the denial-rate anomaly detector as they arrive.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from apps.access_logs.anomalies import anomaly_detector
+from apps.access_logs.writer import write_logs
+
+
+class _Window:
+    __slots__ = ('opened_at', 'first_seen', 'count', 'last_log')
+
+    def __init__(self, log):
+        self.opened_at = time.monotonic()
+        self.first_seen = log.timestamp
+        self.count = 0
+        self.last_log = None
+
+
+class UnknownCodeDenials:
+    """
+    Per-worker counters of denied unknown codes, keyed by device
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    @staticmethod
+    def _device_key(log):
+        return (log.access_point_id, log.device_id or log.ip_address or '')
+
+    def record(self, log):
+        """
+        Register the AccessLog of a denied scan for an unknown code
+
+        Args:
+            log: Unsaved AccessLog for the scan
+
+        Returns:
+            True if the log should be written now, False if it was counted
+        """
+        if settings.UNKNOWN_CODE_WINDOW <= 0:
+            return True
+
+        key = self._device_key(log)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                self._windows[key] = _Window(log)
+                return True
+            window.count += 1
+            window.last_log = log
+        # The summary row counts once more when written, a negligible overlap
+        anomaly_detector.observe(key[0], key[1], denied=True)
+        return False
+
+    def drain(self, force=False):
+        """
+        Close expired windows
+
+        Args:
+            force: Close every window, expired or not
+
+        Returns:
+            List of unsaved summary AccessLog rows to write
+        """
+        if not self._windows:
+            return []
+
+        cutoff = time.monotonic() - settings.UNKNOWN_CODE_WINDOW
+        summaries = []
+        with self._lock:
+            for key, window in list(self._windows.items()):
+                if not force and window.opened_at > cutoff:
+                    continue
+                del self._windows[key]
+                if window.count:
+                    log = window.last_log
+                    log.notes = (
+                        f'{window.count} further scans of unknown codes from this device '
+                        f'since {window.first_seen.isoformat()}; last code shown'
+                    )
+                    summaries.append(log)
+        return summaries
+
+    def flush(self):
+        """Write all pending summaries"""
+        write_logs(self.drain(force=True))
+
+
+unknown_denials = UnknownCodeDenials()
+
+
+@atexit.register
+def _flush_on_exit():
+    # write_logs() journals the summaries if the database is already gone
+    try:
+        unknown_denials.flush()
+    except Exception:
+        logging.getLogger(__name__).exception('Could not write unknown-code denial summaries at exit')
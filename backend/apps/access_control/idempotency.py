@@ -0,0 +1,470 @@
+"""
+Idempotency keys and duplicate-scan collapsing for the validate endpoints
+
+Gate controllers retry requests that timed out, and readers fire twice while
+a card lingers. Replaying either must not consume a visitor code's use again
+nor write another AccessLog row, so both are answered from stored decisions:
+
+- A request carrying an Idempotency-Key header is answered once; repeats
+  with the same key (per user and endpoint) get the stored response, with
+  Idempotent-Replayed: true, for IDEMPOTENCY_KEY_TTL seconds. A repeat
+  arriving while the first is still running gets 409, one with a different
+  body gets 422.
+- A scan with the same (code, access point, access type) as one decided
+  less than SCAN_DEBOUNCE_WINDOW seconds before (by scan time) gets that
+  decision back without being logged.
+
+Decisions live in Redis when it is the configured cache (shared by every
+worker) and in a bounded LRU table in worker memory otherwise; see
+SCAN_DEDUP_STORE.
+"""
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import metrics
+
+IDEMPOTENCY_CACHE_KEY = 'access_control:idempotency:{}'
+SCAN_CACHE_KEY = 'access_control:scan:{}'
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+MAX_ENTRIES = 10000
+
+# Outcomes of IdempotencyKeys.begin()
+NEW = 'new'
+REPLAY = 'replay'
+IN_PROGRESS = 'in_progress'
+MISMATCH = 'mismatch'
+
+# Seconds a claimed key stays "in progress" if its request never finishes
+IN_PROGRESS_TTL = 60
+
+
+def _digest(*parts):
+    # Codes are credentials: keys never hold them in clear
+    return hashlib.blake2b('\0'.join(str(part) for part in parts).encode(), digest_size=16).hexdigest()
+
+
+class LocalDecisionStore:
+    """
+    Bounded LRU table with per-entry expiry, held in worker memory
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_many(self, keys):
+        """
+        Unexpired values of keys
+
+        Returns:
+            Dictionary of key -> value for the keys found
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._live(key, now)
+                if entry is not None:
+                    found[key] = entry[0]
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def _set_many(self, values, ttl):
+        expires_at = time.monotonic() + ttl
+        for key, value in values.items():
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def set_many(self, values, ttl):
+        """Store values (dictionary of key -> value) for ttl seconds"""
+        with self._lock:
+            self._set_many(values, ttl)
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def add(self, key, value, ttl):
+        """
+        Store a value unless the key holds one
+
+        Returns:
+            True if the value was stored
+        """
+        with self._lock:
+            if self._live(key, time.monotonic()) is not None:
+                return False
+            self._set_many({key: value}, ttl)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class CacheDecisionStore:
+    """
+    Decisions shared through the cache, with atomic add() for claims
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def get_many(self, keys):
+        """See LocalDecisionStore.get_many"""
+        return self._cache.get_many(keys)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set_many(self, values, ttl):
+        self._cache.set_many(values, ttl)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        """See LocalDecisionStore.add"""
+        return self._cache.add(key, value, ttl)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_decision_store():
+    """Decision store for this worker, chosen from SCAN_DEDUP_STORE"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                from django.core.cache.backends.redis import RedisCache
+
+                backend = caches['default']
+                if settings.SCAN_DEDUP_STORE == 'cache' and isinstance(backend, RedisCache):
+                    _store = CacheDecisionStore(backend)
+                else:
+                    _store = LocalDecisionStore()
+    return _store
+
+
+def _run(function, *args):
+    """Awaitable call of a store operation; only a shared store leaves the event loop"""
+    if isinstance(get_decision_store(), LocalDecisionStore):
+        async def local():
+            return function(*args)
+        return local()
+    return sync_to_async(function)(*args)
+
+
+class IdempotencyKeys:
+    """
+    Responses stored by Idempotency-Key
+    """
+
+    @staticmethod
+    def fingerprint(data):
+        """Digest of a request body, to tell a retry from a reused key"""
+        return _digest(json.dumps(data, sort_keys=True, default=str))
+
+    @staticmethod
+    def _cache_key(user_id, endpoint, key):
+        return IDEMPOTENCY_CACHE_KEY.format(_digest(user_id, endpoint, key))
+
+    def begin(self, user_id, endpoint, key, fingerprint):
+        """
+        Claim an idempotency key, or find its stored response
+
+        Args:
+            user_id: Authenticated user id
+            endpoint: Name of the endpoint, keys are scoped to it
+            key: Idempotency-Key header value
+            fingerprint: fingerprint() of the request body
+
+        Returns:
+            Tuple of (outcome, stored (data, status) or None); outcome is
+            NEW (the caller must finish() or abandon()), REPLAY,
+            IN_PROGRESS or MISMATCH
+        """
+        store = get_decision_store()
+        cache_key = self._cache_key(user_id, endpoint, key)
+        claim = {'fingerprint': fingerprint, 'response': None}
+        if store.add(cache_key, claim, IN_PROGRESS_TTL):
+            return NEW, None
+        stored = store.get(cache_key)
+        if stored is None:
+            # Expired in between: claim it again
+            return self.begin(user_id, endpoint, key, fingerprint)
+        if stored['fingerprint'] != fingerprint:
+            return MISMATCH, None
+        if stored['response'] is None:
+            return IN_PROGRESS, None
+        metrics.incr('idempotent_replays', endpoint=endpoint)
+        return REPLAY, stored['response']
+
+    def finish(self, user_id, endpoint, key, fingerprint, data, http_status):
+        """Store the response of a claimed key"""
+        get_decision_store().set(
+            self._cache_key(user_id, endpoint, key),
+            {'fingerprint': fingerprint, 'response': (data, http_status)},
+            settings.IDEMPOTENCY_KEY_TTL
+        )
+
+    def abandon(self, user_id, endpoint, key):
+        """Release a claimed key whose request failed, so a retry runs again"""
+        get_decision_store().delete(self._cache_key(user_id, endpoint, key))
+
+    async def abegin(self, *args):
+        """Async variant of begin()"""
+        return await _run(self.begin, *args)
+
+    async def afinish(self, *args):
+        """Async variant of finish()"""
+        return await _run(self.finish, *args)
+
+    async def aabandon(self, *args):
+        """Async variant of abandon()"""
+        return await _run(self.abandon, *args)
+
+
+idempotency_keys = IdempotencyKeys()
+
+
+def stored_response(outcome, stored):
+    """
+    Answer to a request whose key was claimed before
+
+    Args:
+        outcome, stored: Result of IdempotencyKeys.begin()
+
+    Returns:
+        Tuple of (data, status, headers), or None if the request must run
+    """
+    if outcome == REPLAY:
+        return stored[0], stored[1], {REPLAYED_HEADER: 'true'}
+    if outcome == IN_PROGRESS:
+        return (
+            {'error': f'A request with this {IDEMPOTENCY_HEADER} is still being processed'},
+            status.HTTP_409_CONFLICT, {'Retry-After': '1'}
+        )
+    if outcome == MISMATCH:
+        return (
+            {'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'},
+            status.HTTP_422_UNPROCESSABLE_ENTITY, {}
+        )
+    return None
+
+
+def invalid_key(key):
+    """Error body for an unusable Idempotency-Key, or None"""
+    if len(key) > MAX_KEY_LENGTH:
+        return {'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'}
+    return None
+
+
+def idempotent(view_method):
+    """
+    Answer repeats of a DRF action's requests carrying Idempotency-Key
+    with the first response
+
+    Responses are stored unless the action raised or answered with a 5xx.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        error = invalid_key(key)
+        if error is not None:
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
+        endpoint = view_method.__name__
+        fingerprint = idempotency_keys.fingerprint(request.data)
+        outcome, stored = idempotency_keys.begin(request.user.pk, endpoint, key, fingerprint)
+        answer = stored_response(outcome, stored)
+        if answer is not None:
+            data, http_status, headers = answer
+            return Response(data, status=http_status, headers=headers)
+
+        response = None
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        finally:
+            if response is None:
+                # Raised: let the client retry with the same key
+                idempotency_keys.abandon(request.user.pk, endpoint, key)
+        if response.status_code >= 500:
+            idempotency_keys.abandon(request.user.pk, endpoint, key)
+        else:
+            idempotency_keys.finish(
+                request.user.pk, endpoint, key, fingerprint, response.data, response.status_code
+            )
+        return response
+    return wrapper
+
+
+async def aidempotent(request, user_id, endpoint, view):
+    """
+    Async counterpart of @idempotent for plain async views
+
+    Args:
+        request: Django HttpRequest whose JSON body was already validated
+        user_id: Authenticated user id
+        endpoint: Name of the endpoint, keys are scoped to it
+        view: Coroutine function answering the request with a JsonResponse
+
+    Returns:
+        JsonResponse
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return await view()
+    error = invalid_key(key)
+    if error is not None:
+        return JsonResponse(error, status=status.HTTP_400_BAD_REQUEST)
+
+    fingerprint = idempotency_keys.fingerprint(json.loads(request.body))
+    outcome, stored = await idempotency_keys.abegin(user_id, endpoint, key, fingerprint)
+    answer = stored_response(outcome, stored)
+    if answer is not None:
+        data, http_status, headers = answer
+        return JsonResponse(data, status=http_status, headers=headers, safe=False)
+
+    response = None
+    try:
+        response = await view()
+    finally:
+        if response is None:
+            await idempotency_keys.aabandon(user_id, endpoint, key)
+    if response.status_code >= 500:
+        await idempotency_keys.aabandon(user_id, endpoint, key)
+    else:
+        await idempotency_keys.afinish(
+            user_id, endpoint, key, fingerprint, json.loads(response.content), response.status_code
+        )
+    return response
+
+
+class ReplayedScan:
+    """
+    Decision of an earlier identical scan, answered again
+    """
+    __slots__ = ('data', 'http_status')
+
+    def __init__(self, data, http_status):
+        self.data = data
+        self.http_status = http_status
+
+    @property
+    def valid(self):
+        return self.data['valid']
+
+
+class DebounceBatch:
+    """
+    Debouncing state of one request's scans
+    """
+
+    def __init__(self, recent):
+        self._recent = recent
+        self._decided = {}
+
+    def match(self, scan, timestamp):
+        """
+        Decision of an identical scan within the window of this one
+
+        Args:
+            scan: Scan dict
+            timestamp: When the scan happened
+
+        Returns:
+            ReplayedScan, or None if the scan must be decided
+        """
+        stored = self._recent.get(ScanDebouncer.cache_key(scan))
+        if stored is None:
+            return None
+        decided_at, data, http_status = stored
+        if abs(timestamp.timestamp() - decided_at) > settings.SCAN_DEBOUNCE_WINDOW:
+            return None
+        metrics.incr('scans_debounced', access_point=str(scan['access_point_id']))
+        return ReplayedScan(data, http_status)
+
+    def add(self, scan, timestamp, result):
+        """Record a decision, for later scans of this request and save()"""
+        if settings.SCAN_DEBOUNCE_WINDOW <= 0:
+            return
+        key = ScanDebouncer.cache_key(scan)
+        self._recent[key] = self._decided[key] = (timestamp.timestamp(), result.data, result.http_status)
+
+    def save(self):
+        """Store the request's decisions for later requests"""
+        if self._decided:
+            get_decision_store().set_many(self._decided, settings.SCAN_DEBOUNCE_WINDOW + 1)
+
+    async def asave(self):
+        """Async variant of save()"""
+        if self._decided:
+            await _run(self.save)
+
+
+class ScanDebouncer:
+    """
+    Recent decisions by (code, access point, access type)
+    """
+
+    @staticmethod
+    def cache_key(scan):
+        return SCAN_CACHE_KEY.format(_digest(scan['code'], scan['access_point_id'], scan['access_type']))
+
+    def batch(self, scans):
+        """
+        Start debouncing a request's scans
+
+        Args:
+            scans: Scan dicts
+
+        Returns:
+            DebounceBatch holding the stored decisions for these scans
+        """
+        if settings.SCAN_DEBOUNCE_WINDOW <= 0:
+            return DebounceBatch({})
+        return DebounceBatch(get_decision_store().get_many({self.cache_key(scan) for scan in scans}))
+
+    async def abatch(self, scans):
+        """Async variant of batch()"""
+        if settings.SCAN_DEBOUNCE_WINDOW <= 0:
+            return DebounceBatch({})
+        return await _run(self.batch, scans)
+
+
+scan_debouncer = ScanDebouncer()
@@ -0,0 +1,264 @@
+"""
+Operational metrics for Access Control System
+
+Each worker counts in memory, which costs a dict update per event, and a
+background thread publishes its totals to the shared cache every
+METRICS_FLUSH_INTERVAL seconds, so requests never wait on the cache.
+collect() merges the published totals of every live worker.
+
+Latencies go into fixed log-scale histograms, so merging workers is a sum
+and percentiles are read from the bucket counts.
+"""
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+WORKERS_CACHE_KEY = 'access_control:metrics:workers'
+WORKER_CACHE_KEY = 'access_control:metrics:worker:{}'
+
+# Histogram bucket upper bounds in milliseconds: 0.05 ms to about 12 s, 25% apart
+BUCKET_BOUNDS = tuple(0.05 * 1.25 ** i for i in range(57))
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# Shortest METRICS_FLUSH_INTERVAL honoured, in seconds; 0 would spin the publisher
+MIN_FLUSH_INTERVAL = 1
+
+logger = logging.getLogger(__name__)
+
+
+def flush_interval():
+    """Seconds between publications, METRICS_FLUSH_INTERVAL floored at MIN_FLUSH_INTERVAL"""
+    return max(settings.METRICS_FLUSH_INTERVAL, MIN_FLUSH_INTERVAL)
+
+
+def _labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _percentile(buckets, count, fraction):
+    """Estimate a percentile by interpolating within its bucket"""
+    rank = fraction * count
+    seen = 0
+    for index, bucket_count in enumerate(buckets):
+        if bucket_count and seen + bucket_count >= rank:
+            lower = BUCKET_BOUNDS[index - 1] if index else 0.0
+            upper = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else BUCKET_BOUNDS[-1]
+            return round(lower + (upper - lower) * (rank - seen) / bucket_count, 3)
+        seen += bucket_count
+    return None
+
+
+def summarize_histogram(name, labels, buckets, count, total):
+    """Public form of a histogram: count, mean and percentiles in ms"""
+    summary = {'name': name, 'labels': dict(labels), 'count': count}
+    summary['mean'] = round(total / count, 3) if count else None
+    for fraction in PERCENTILES:
+        summary[f'p{round(fraction * 100)}'] = _percentile(buckets, count, fraction)
+    return summary
+
+
+class MetricsRegistry:
+    """
+    Per-worker counters and histograms, published to the shared cache
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._thread = None
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+    def incr(self, name, amount=1, **labels):
+        """
+        Increment a counter
+
+        Args:
+            name: Counter name
+            amount: Value to add (default: 1)
+            **labels: Label values identifying the series
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._ensure_publishing()
+
+    def observe(self, name, value, **labels):
+        """
+        Record a latency
+
+        Args:
+            name: Histogram name
+            value: Observed value in milliseconds
+            **labels: Label values identifying the series
+        """
+        key = (name, _labels_key(labels))
+        index = bisect.bisect_left(BUCKET_BOUNDS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(BUCKET_BOUNDS) + 1), 0, 0.0]
+            histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+        self._ensure_publishing()
+
+    def snapshot(self):
+        """
+        This worker's totals
+
+        Returns:
+            Dictionary with a 'counters' list of {name, labels, value} and a
+            'histograms' list of {name, labels, buckets, count, sum}
+        """
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [
+                (key, list(buckets), count, total)
+                for key, (buckets, count, total) in self._histograms.items()
+            ]
+        return {
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in counters
+            ],
+            'histograms': [
+                {'name': name, 'labels': dict(labels), 'buckets': buckets, 'count': count, 'sum': total}
+                for (name, labels), buckets, count, total in histograms
+            ],
+        }
+
+    def _ensure_publishing(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-publisher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(flush_interval())
+            try:
+                self.flush()
+            except Exception:
+                # Published again on the next interval
+                logger.exception('Could not publish metrics to the cache')
+
+    def flush(self):
+        """Publish this worker's totals to the shared cache"""
+        ttl = flush_interval() * 10
+        cache.set(WORKER_CACHE_KEY.format(self.worker_id), self.snapshot(), ttl)
+        # Workers re-register on every flush, so a lost update heals itself
+        workers = cache.get(WORKERS_CACHE_KEY, [])
+        if self.worker_id not in workers:
+            cache.set(WORKERS_CACHE_KEY, workers[-63:] + [self.worker_id], None)
+
+    def collect(self):
+        """
+        Totals across every worker that published recently
+
+        Returns:
+            Dictionary with 'workers' (count), a merged 'counters' list and a
+            'histograms' list of {name, labels, count, mean, p50, p95, p99}
+        """
+        self.flush()
+        workers = cache.get(WORKERS_CACHE_KEY, [])
+        snapshots = cache.get_many([WORKER_CACHE_KEY.format(worker) for worker in workers])
+
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots.values():
+            for counter in snapshot['counters']:
+                key = (counter['name'], _labels_key(counter['labels']))
+                counters[key] = counters.get(key, 0) + counter['value']
+            for histogram in snapshot.get('histograms', []):
+                key = (histogram['name'], _labels_key(histogram['labels']))
+                merged = histograms.setdefault(key, [[0] * (len(BUCKET_BOUNDS) + 1), 0, 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], histogram['buckets'])]
+                merged[1] += histogram['count']
+                merged[2] += histogram['sum']
+        return {
+            'workers': len(snapshots),
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            'histograms': [
+                summarize_histogram(name, labels, buckets, count, total)
+                for (name, labels), (buckets, count, total) in sorted(histograms.items())
+            ],
+        }
+
+
+metrics = MetricsRegistry()
+
+
+class StageTimer:
+    """
+    Lap timer splitting one request into named stages
+
+    Each lap() charges the time since the previous lap to a stage, so the
+    stages add up to the request's time in the view. Laps with the same name
+    accumulate.
+    """
+    __slots__ = ('started_at', 'last', 'stages', 'labels')
+
+    def __init__(self, **labels):
+        self.started_at = self.last = time.perf_counter()
+        self.stages = {}
+        self.labels = labels
+
+    def label(self, access_point_ids, known_ids):
+        """
+        Label the request with the access point its scans named
+
+        Args:
+            access_point_ids: Access point ids sent by the client
+            known_ids: Those of them that exist
+
+        Ids that do not exist are labelled 'unknown', so clients cannot add
+        series; scans naming several access points are labelled 'mixed'.
+        """
+        labels = {str(pk) if pk in known_ids else 'unknown' for pk in access_point_ids}
+        self.labels['access_point'] = labels.pop() if len(labels) == 1 else 'mixed'
+
+    def lap(self, stage):
+        """Charge the time since the previous lap to a stage"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def record(self, name='validate_stage_ms'):
+        """Add the stages and their total to the histograms"""
+        total = 0.0
+        for stage, seconds in self.stages.items():
+            total += seconds
+            metrics.observe(name, seconds * 1000, stage=stage, **self.labels)
+        metrics.observe(name, total * 1000, stage='total', **self.labels)
+
+    def server_timing(self):
+        """Stages formatted for a Server-Timing response header"""
+        return ', '.join(
+            f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in self.stages.items()
+        )
+
+
+class NullTimer:
+    """Stand-in for StageTimer when a caller does not time its stages"""
+    __slots__ = ()
+
+    def label(self, access_point_ids, known_ids):
+        pass
+
+    def lap(self, stage):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_credentials(apps, schema_editor):
+    Credential = apps.get_model('access_control', 'Credential')
+    AccessCode = apps.get_model('access_control', 'AccessCode')
+    TemporaryCode = apps.get_model('visitors', 'TemporaryCode')
+
+    credentials = [
+        Credential(code=code, kind='RESIDENT', access_code_id=pk, resident_id=resident_id)
+        for pk, code, resident_id in AccessCode.objects.values_list('id', 'code', 'resident_id')
+    ]
+    seen = {credential.code for credential in credentials}
+    for pk, code, visitor_id in TemporaryCode.objects.values_list('id', 'code', 'visitor_id'):
+        if code not in seen:
+            credentials.append(
+                Credential(code=code, kind='VISITOR', temporary_code_id=pk, visitor_id=visitor_id)
+            )
+    Credential.objects.bulk_create(credentials, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_control', '0002_initial'),
+        ('residents', '0002_initial'),
+        ('visitors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Credential',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(help_text='The access code', max_length=100, unique=True)),
+                ('kind', models.CharField(choices=[('RESIDENT', 'Resident Access Code'), ('VISITOR', 'Visitor Temporary Code')], help_text='Type of credential holder', max_length=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('access_code', models.OneToOneField(blank=True, help_text='Permanent access code (for residents)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credential', to='access_control.accesscode')),
+                ('resident', models.ForeignKey(blank=True, help_text='Resident holding this code', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credentials', to='residents.resident')),
+                ('temporary_code', models.OneToOneField(blank=True, help_text='Temporary code (for visitors)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credential', to='visitors.temporarycode')),
+                ('visitor', models.ForeignKey(blank=True, help_text='Visitor holding this code', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credentials', to='visitors.visitor')),
+            ],
+            options={
+                'verbose_name': 'Credential',
+                'verbose_name_plural': 'Credentials',
+                'ordering': ['code'],
+            },
+        ),
+        migrations.RunPython(backfill_credentials, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:34
+
+from django.db import migrations, models
+
+
+def backfill_masks(apps, schema_editor):
+    AccessCode = apps.get_model('access_control', 'AccessCode')
+    through = AccessCode.access_points.through
+
+    bits_by_code = {}
+    for code_id, point_id in through.objects.values_list('accesscode_id', 'accesspoint_id'):
+        bits_by_code[code_id] = bits_by_code.get(code_id, 0) | 1 << point_id
+    for code_id, bits in bits_by_code.items():
+        AccessCode.objects.filter(pk=code_id).update(
+            access_points_mask=bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_control', '0003_credential'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesscode',
+            name='access_points_mask',
+            field=models.BinaryField(default=bytes, help_text='Bitset of allowed access point ids (empty means all points)'),
+        ),
+        migrations.RunPython(backfill_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:36
+
+import apps.access_control.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_control', '0004_accesscode_access_points_mask'),
+        ('residents', '0002_initial'),
+        ('visitors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='credential',
+            name='is_revoked',
+            field=models.BooleanField(default=False, help_text='Code was deleted or reassigned (kept for delta sync)'),
+        ),
+        migrations.AddField(
+            model_name='credential',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=apps.access_control.models.next_credential_version, help_text='Change stamp used by controller delta sync'),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='access_code',
+            field=models.OneToOneField(blank=True, help_text='Permanent access code (for residents)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='credential', to='access_control.accesscode'),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='resident',
+            field=models.ForeignKey(blank=True, help_text='Resident holding this code', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='credentials', to='residents.resident'),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='temporary_code',
+            field=models.OneToOneField(blank=True, help_text='Temporary code (for visitors)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='credential', to='visitors.temporarycode'),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='visitor',
+            field=models.ForeignKey(blank=True, help_text='Visitor holding this code', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='credentials', to='visitors.visitor'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 """
 Access Control models for Access Control System
 """
-from django.db import models
+import time
+
+from django.db import models, IntegrityError
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -141,6 +143,12 @@ class AccessCode(models.Model):
         help_text=_('Access points where this code is valid')
     )
     
+    access_points_mask = models.BinaryField(
+        default=bytes,
+        editable=False,
+        help_text=_('Bitset of allowed access point ids (empty means all points)')
+    )
+    
     is_active = models.BooleanField(
         default=True,
         help_text=_('Whether this code is active')
@@ -190,3 +198,174 @@ class AccessCode(models.Model):
         if self.expiry_date and self.expiry_date < timezone.now().date():
             return False
         return True
+    
+    @property
+    def access_points_bits(self):
+        """Allowed access points as an integer bitset (0 means all points)"""
+        return int.from_bytes(bytes(self.access_points_mask), 'little')
+    
+    def allows_access_point(self, access_point_id):
+        """Check if this code may be used at an access point"""
+        bits = self.access_points_bits
+        return bits == 0 or bool(bits >> access_point_id & 1)
+    
+    def refresh_access_points_mask(self):
+        """Recompute the access point bitset from the M2M and store it"""
+        self.access_points_mask = build_access_points_mask(
+            self.access_points.values_list('id', flat=True)
+        )
+        AccessCode.objects.filter(pk=self.pk).update(access_points_mask=self.access_points_mask)
+
+
+def build_access_points_mask(access_point_ids):
+    """
+    Build the bitset stored in AccessCode.access_points_mask
+    
+    Args:
+        access_point_ids: Iterable of allowed AccessPoint ids
+        
+    Returns:
+        Little-endian bytes with bit N set for access point id N
+    """
+    bits = 0
+    for access_point_id in access_point_ids:
+        bits |= 1 << access_point_id
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def next_credential_version():
+    """Change stamp for Credential rows (microseconds since the epoch)"""
+    return time.time_ns() // 1000
+
+
+class Credential(models.Model):
+    """
+    Unified lookup table of every scannable code
+
+    Denormalized from AccessCode and TemporaryCode on write, so resolving a
+    scanned code is a single indexed probe regardless of who holds it. Rows
+    outlive their code as revoked tombstones and carry a change stamp, so
+    door controllers can sync additions and revocations incrementally.
+    """
+    
+    class Kind(models.TextChoices):
+        RESIDENT = 'RESIDENT', _('Resident Access Code')
+        VISITOR = 'VISITOR', _('Visitor Temporary Code')
+    
+    code = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text=_('The access code')
+    )
+    
+    kind = models.CharField(
+        max_length=20,
+        choices=Kind.choices,
+        help_text=_('Type of credential holder')
+    )
+    
+    access_code = models.OneToOneField(
+        AccessCode,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='credential',
+        help_text=_('Permanent access code (for residents)')
+    )
+    
+    temporary_code = models.OneToOneField(
+        'visitors.TemporaryCode',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='credential',
+        help_text=_('Temporary code (for visitors)')
+    )
+    
+    resident = models.ForeignKey(
+        'residents.Resident',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='credentials',
+        help_text=_('Resident holding this code')
+    )
+    
+    visitor = models.ForeignKey(
+        'visitors.Visitor',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='credentials',
+        help_text=_('Visitor holding this code')
+    )
+    
+    is_revoked = models.BooleanField(
+        default=False,
+        help_text=_('Code was deleted or reassigned (kept for delta sync)')
+    )
+    
+    version = models.BigIntegerField(
+        default=next_credential_version,
+        db_index=True,
+        help_text=_('Change stamp used by controller delta sync')
+    )
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Credential')
+        verbose_name_plural = _('Credentials')
+        ordering = ['code']
+    
+    def __str__(self):
+        return f"{self.code} ({self.get_kind_display()})"
+    
+    @classmethod
+    def _claim(cls, code, kind, **holder):
+        """Point a code at its current holder, reusing any tombstone"""
+        existing = cls.objects.filter(code=code).first()
+        if existing is not None and not existing.is_revoked and existing.kind != kind:
+            raise IntegrityError(f'Code {code} is already held by another credential')
+        fields = {
+            'kind': kind,
+            'access_code': None,
+            'temporary_code': None,
+            'resident': None,
+            'visitor': None,
+            'is_revoked': False,
+            'version': next_credential_version(),
+        }
+        fields.update(holder)
+        cls.objects.update_or_create(code=code, defaults=fields)
+    
+    @classmethod
+    def sync_access_code(cls, access_code):
+        """Create or update the credential row of an AccessCode"""
+        cls.revoke(cls.objects.filter(access_code=access_code).exclude(code=access_code.code))
+        cls._claim(
+            access_code.code, cls.Kind.RESIDENT,
+            access_code=access_code, resident_id=access_code.resident_id
+        )
+    
+    @classmethod
+    def sync_temporary_code(cls, temp_code):
+        """Create or update the credential row of a TemporaryCode"""
+        cls.revoke(cls.objects.filter(temporary_code=temp_code).exclude(code=temp_code.code))
+        cls._claim(
+            temp_code.code, cls.Kind.VISITOR,
+            temporary_code=temp_code, visitor_id=temp_code.visitor_id
+        )
+    
+    @classmethod
+    def revoke(cls, queryset):
+        """Turn credential rows into tombstones"""
+        queryset.update(
+            access_code=None, temporary_code=None, resident=None, visitor=None,
+            is_revoked=True, version=next_credential_version()
+        )
+    
+    @classmethod
+    def touch(cls, queryset):
+        """Mark credential rows as changed for delta sync"""
+        queryset.update(version=next_credential_version())
@@ -2,7 +2,7 @@
 Serializers for Access Control app
 """
 from rest_framework import serializers
-from .models import AccessPoint, AccessCode
+from .models import AccessPoint, AccessCode, Credential
 
 
 class AccessPointSerializer(serializers.ModelSerializer):
@@ -33,6 +33,15 @@ class AccessCodeSerializer(serializers.ModelSerializer):
             'issued_by', 'notes', 'is_valid', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'issued_date', 'created_at', 'updated_at']
+    
+    def validate_code(self, value):
+        """Codes must be unique across residents and visitors"""
+        credentials = Credential.objects.filter(code=value)
+        if self.instance is not None:
+            credentials = credentials.exclude(access_code=self.instance)
+        if credentials.filter(kind=Credential.Kind.VISITOR).exists():
+            raise serializers.ValidationError('This code is already in use by a visitor.')
+        return value
 
 
 class ValidateAccessRequestSerializer(serializers.Serializer):
@@ -43,3 +52,20 @@ class ValidateAccessRequestSerializer(serializers.Serializer):
         choices=['ENTRY', 'EXIT'],
         default='ENTRY'
     )
+    device_id = serializers.CharField(max_length=100, required=False, allow_blank=True)
+
+
+class ValidateBatchItemSerializer(ValidateAccessRequestSerializer):
+    """Serializer for one scan of a batch validation request"""
+    client_ts = serializers.DateTimeField(required=False)
+
+
+class OfflineLogSerializer(serializers.Serializer):
+    """Serializer for a decision made offline by a door controller"""
+    event_id = serializers.UUIDField(help_text='Generated by the controller; repeats are ignored')
+    code = serializers.CharField(max_length=100)
+    access_type = serializers.ChoiceField(choices=['ENTRY', 'EXIT'], default='ENTRY')
+    status = serializers.ChoiceField(choices=['SUCCESS', 'DENIED'])
+    denial_reason = serializers.CharField(required=False, allow_blank=True)
+    client_ts = serializers.DateTimeField()
+    device_id = serializers.CharField(max_length=100, required=False, allow_blank=True)
@@ -0,0 +1,189 @@
+"""
+Signal handlers keeping the credential index current
+"""
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from apps.residents.models import Building, Unit, Resident
+from apps.visitors.models import Visitor, TemporaryCode
+from apps.visitors.signals import temporary_code_used
+from .credentials import CredentialRecord, credential_index, bump_generation
+from .models import AccessPoint, AccessCode, Credential
+
+# TemporaryCode saves that only record a use do not change who may enter
+USAGE_FIELDS = frozenset(TemporaryCode.USAGE_FIELDS)
+
+# Fields copied into CredentialRecords and the controller snapshot; saves
+# that change none of them are not propagated to other workers
+INDEXED_FIELDS = {
+    AccessCode: ('code', 'code_type', 'resident_id', 'is_active', 'expiry_date'),
+    TemporaryCode: (
+        'code', 'code_type', 'visitor_id', 'is_active', 'valid_from', 'valid_until',
+        'max_uses', 'times_used',
+    ),
+    Resident: ('first_name', 'last_name', 'document_id', 'unit_id'),
+    Visitor: ('first_name', 'last_name', 'document_id', 'unit_id'),
+    Unit: ('number', 'building_id'),
+    Building: ('code',),
+}
+
+# Credentials showing a holder's names and unit label
+HOLDER_CREDENTIALS = {
+    Resident: lambda holder: Q(resident=holder),
+    Visitor: lambda holder: Q(visitor=holder),
+    Unit: lambda holder: Q(resident__unit=holder) | Q(visitor__unit=holder),
+    Building: lambda holder: Q(resident__unit__building=holder) | Q(visitor__unit__building=holder),
+}
+
+
+def indexed_values(sender, instance):
+    return tuple(getattr(instance, field) for field in INDEXED_FIELDS[sender])
+
+
+def indexed_fields_changed(sender, instance, created):
+    """Whether a save changed any field copied into the credential index"""
+    previous = instance.__dict__.pop('_indexed_values', None)
+    return created or (previous is not None and previous != indexed_values(sender, instance))
+
+
+def refresh_access_point_masks(access_code_ids):
+    """Recompute the bitsets of the given AccessCodes"""
+    if not access_code_ids:
+        return
+    for access_code in AccessCode.objects.filter(pk__in=access_code_ids):
+        access_code.refresh_access_points_mask()
+    Credential.touch(Credential.objects.filter(access_code_id__in=access_code_ids))
+    credential_index.mark_stale()
+    bump_generation()
+
+
+@receiver(pre_save, sender=AccessCode)
+@receiver(pre_save, sender=TemporaryCode)
+@receiver(pre_save, sender=Resident)
+@receiver(pre_save, sender=Visitor)
+@receiver(pre_save, sender=Unit)
+@receiver(pre_save, sender=Building)
+def indexed_instance_saving(sender, instance, update_fields=None, raw=False, **kwargs):
+    fields = INDEXED_FIELDS[sender]
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None:
+        if set(fields).isdisjoint(update_fields):
+            return
+        if sender is TemporaryCode and USAGE_FIELDS.issuperset(update_fields):
+            return
+    instance._indexed_values = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+
+
+@receiver(post_save, sender=AccessPoint)
+def access_point_saved(sender, instance, created, **kwargs):
+    if created:
+        credential_index.set_access_point(instance.pk)
+        bump_generation()
+
+
+@receiver(pre_delete, sender=AccessPoint)
+def access_point_deleting(sender, instance, **kwargs):
+    # The M2M rows are cascaded without m2m_changed, so remember the codes
+    instance._allowed_code_ids = list(instance.allowed_codes.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=AccessPoint)
+def access_point_deleted(sender, instance, **kwargs):
+    credential_index.set_access_point(instance.pk, exists=False)
+    refresh_access_point_masks(instance.__dict__.pop('_allowed_code_ids', []))
+    bump_generation()
+
+
+@receiver(post_save, sender=AccessCode)
+def access_code_saved(sender, instance, created, **kwargs):
+    if not indexed_fields_changed(sender, instance, created):
+        return
+    Credential.sync_access_code(instance)
+    if credential_index.is_built:
+        credential_index.discard_instance(CredentialRecord.RESIDENT, instance.pk)
+        credential_index.put(CredentialRecord.from_access_code(instance))
+    bump_generation()
+
+
+@receiver(post_delete, sender=AccessCode)
+def access_code_deleted(sender, instance, **kwargs):
+    Credential.revoke(Credential.objects.filter(
+        code=instance.code, kind=Credential.Kind.RESIDENT, access_code__isnull=True
+    ))
+    credential_index.discard(instance.code, CredentialRecord.RESIDENT, instance.pk)
+    bump_generation()
+
+
+@receiver(m2m_changed, sender=AccessCode.access_points.through)
+def access_code_points_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # Changed from the AccessPoint side: pk_set holds AccessCode ids
+        if action == 'pre_clear':
+            instance._cleared_code_ids = list(instance.allowed_codes.values_list('id', flat=True))
+            return
+        if action == 'post_clear':
+            pk_set = instance.__dict__.pop('_cleared_code_ids', [])
+        elif action not in ('post_add', 'post_remove'):
+            return
+        refresh_access_point_masks(pk_set)
+        return
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    instance.refresh_access_points_mask()
+    Credential.touch(Credential.objects.filter(access_code=instance))
+    if credential_index.is_built:
+        credential_index.put(CredentialRecord.from_access_code(instance))
+    bump_generation()
+
+
+def reindex_temporary_code(instance):
+    if credential_index.is_built:
+        credential_index.discard_instance(CredentialRecord.VISITOR, instance.pk)
+        if instance.is_valid:
+            credential_index.put(CredentialRecord.from_temporary_code(instance))
+
+
+@receiver(post_save, sender=TemporaryCode)
+def temporary_code_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and USAGE_FIELDS.issuperset(update_fields):
+        temporary_code_consumed(sender, instance)
+        return
+    if not indexed_fields_changed(sender, instance, created):
+        return
+    Credential.sync_temporary_code(instance)
+    credential_index.add_known_code(instance.code)
+    reindex_temporary_code(instance)
+    bump_generation()
+
+
+@receiver(temporary_code_used, sender=TemporaryCode)
+def temporary_code_consumed(sender, instance, **kwargs):
+    if not instance.is_active:
+        # Used up: controllers holding this code must drop it
+        Credential.touch(Credential.objects.filter(temporary_code=instance))
+    reindex_temporary_code(instance)
+
+
+@receiver(post_delete, sender=TemporaryCode)
+def temporary_code_deleted(sender, instance, **kwargs):
+    Credential.revoke(Credential.objects.filter(
+        code=instance.code, kind=Credential.Kind.VISITOR, temporary_code__isnull=True
+    ))
+    credential_index.discard(instance.code, CredentialRecord.VISITOR, instance.pk)
+    bump_generation()
+
+
+@receiver(post_save, sender=Resident)
+@receiver(post_save, sender=Visitor)
+@receiver(post_save, sender=Unit)
+@receiver(post_save, sender=Building)
+def holder_saved(sender, instance, created, **kwargs):
+    if created or not indexed_fields_changed(sender, instance, created):
+        return
+    # Display data (names, unit labels) is denormalized into the records
+    Credential.touch(Credential.objects.filter(HOLDER_CREDENTIALS[sender](instance)))
+    credential_index.mark_stale()
+    bump_generation()
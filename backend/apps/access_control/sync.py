@@ -0,0 +1,216 @@
+"""
+Offline credential sync for door controllers
+
+Controllers download a compressed snapshot of the credentials valid at their
+access point, keep it current with ?since=<version> deltas, decide locally,
+and upload their decisions afterwards. Each uploaded decision carries the
+controller's event_id, so an upload retried after a lost response is
+stored, and counted against visitor codes, only once.
+
+Payload (zlib-compressed, little-endian):
+
+    header  magic 'RCS1' | format u8 | version i64 | access point id i64 | count u32
+    entry   op u8 | kind u8 | valid_from i64 | valid_until i64 | uses_left u32
+            | code (u16 length + UTF-8) | name (u8 length + UTF-8) | unit (u8 length + UTF-8)
+
+op is 1 (upsert) or 0 (revoke); kind is 0 (resident) or 1 (visitor). Times
+are Unix seconds, 0 meaning unbounded, and uses_left 0xFFFFFFFF means
+unlimited. Revoke entries carry only the code.
+"""
+import struct
+import zlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from apps.access_logs.models import AccessLog
+from apps.access_logs.writer import insert_logs
+from apps.visitors.models import TemporaryCode
+from .credentials import CredentialRecord, credential_index
+from .models import AccessPoint, Credential, next_credential_version
+
+CONTENT_TYPE = 'application/octet-stream'
+MAGIC = b'RCS1'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<4sBqqI')
+ENTRY = struct.Struct('<BBqqI')
+
+OP_REVOKE = 0
+OP_UPSERT = 1
+KIND_RESIDENT = 0
+KIND_VISITOR = 1
+UNLIMITED_USES = 0xFFFFFFFF
+
+
+def _pack_text(value, length_format='B'):
+    limit = 0xFF if length_format == 'B' else 0xFFFF
+    data = value.encode('utf-8')
+    if len(data) > limit:
+        data = data[:limit].decode('utf-8', 'ignore').encode('utf-8')
+    return struct.pack('<' + length_format, len(data)) + data
+
+
+def _epoch(value):
+    return int(value.timestamp()) if value else 0
+
+
+def _entry(credential, access_point_id, now):
+    """
+    Encode one credential as seen from an access point
+
+    Returns:
+        Packed entry bytes, or None if the code must not open this point
+    """
+    if credential.is_revoked:
+        return None
+
+    if credential.kind == Credential.Kind.RESIDENT:
+        access_code = credential.access_code
+        if not access_code.is_valid or not access_code.allows_access_point(access_point_id):
+            return None
+        valid_until = None
+        if access_code.expiry_date:
+            # AccessCode.is_valid compares against the UTC date
+            valid_until = datetime.combine(
+                access_code.expiry_date + timedelta(days=1), time.min, tzinfo=dt_timezone.utc
+            )
+        kind, valid_from, uses_left = KIND_RESIDENT, None, UNLIMITED_USES
+    else:
+        temp_code = credential.temporary_code
+        if not temp_code.is_active or temp_code.is_expired or temp_code.times_used >= temp_code.max_uses:
+            return None
+        kind, valid_from, valid_until = KIND_VISITOR, temp_code.valid_from, temp_code.valid_until
+        uses_left = min(temp_code.max_uses - temp_code.times_used, UNLIMITED_USES - 1)
+
+    record = CredentialRecord.from_credential(credential)
+    return b''.join([
+        ENTRY.pack(OP_UPSERT, kind, _epoch(valid_from), _epoch(valid_until), uses_left),
+        _pack_text(credential.code, 'H'),
+        _pack_text(record.person_name),
+        _pack_text(record.unit),
+    ])
+
+
+def _revocation(code):
+    return ENTRY.pack(OP_REVOKE, 0, 0, 0, 0) + _pack_text(code, 'H') + b'\x00\x00'
+
+
+def build_snapshot(access_point, since=None):
+    """
+    Build the credential snapshot or delta for an access point
+
+    Args:
+        access_point: AccessPoint the controller guards
+        since: Version from a previous sync (None for a full snapshot)
+
+    Returns:
+        Tuple of (version, compressed payload bytes)
+    """
+    # Stamp before reading, minus an overlap for transactions still in flight;
+    # controllers apply entries idempotently, so re-sent rows are harmless
+    version = next_credential_version() - settings.CREDENTIAL_SYNC_OVERLAP * 1_000_000
+    now = timezone.now()
+
+    credentials = Credential.objects.select_related(
+        'access_code__resident__unit__building',
+        'temporary_code__visitor__unit__building',
+    )
+    if since is None:
+        credentials = credentials.filter(
+            Q(kind=Credential.Kind.RESIDENT, access_code__is_active=True) |
+            Q(temporary_code__is_active=True, temporary_code__valid_until__gt=now),
+            is_revoked=False,
+        )
+    else:
+        credentials = credentials.filter(version__gt=since)
+
+    entries = []
+    for credential in credentials.iterator(chunk_size=2000):
+        entry = _entry(credential, access_point.pk, now)
+        if entry is not None:
+            entries.append(entry)
+        elif since is not None:
+            entries.append(_revocation(credential.code))
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, version, access_point.pk, len(entries))
+    return version, zlib.compress(header + b''.join(entries), 6)
+
+
+def ingest_offline_logs(access_point, entries, user):
+    """
+    Store decisions made offline by a controller
+
+    Visitor uses granted offline are applied to the usage counters. Entries
+    whose event_id is already stored (a retried upload) are skipped, uses
+    included.
+
+    Args:
+        access_point: AccessPoint the decisions were made at
+        entries: Validated OfflineLogSerializer data
+        user: User recorded as authorized_by on the logs
+
+    Returns:
+        Tuple of (logs stored, entries skipped as already stored)
+    """
+    received = len(entries)
+    unique = {}
+    for entry in entries:
+        unique.setdefault(entry['event_id'], entry)
+
+    with transaction.atomic():
+        # One upload per controller at a time, so a retry racing the
+        # original request cannot apply the same uses twice
+        AccessPoint.objects.select_for_update().filter(pk=access_point.pk).exists()
+        stored = set(AccessLog.objects.filter(event_id__in=list(unique)).values_list('event_id', flat=True))
+        entries = [entry for event_id, entry in unique.items() if event_id not in stored]
+        records = credential_index.resolve_many({entry['code'] for entry in entries})
+
+        logs = []
+        uses = {}
+        for entry in entries:
+            record = records.get(entry['code'])
+            log = AccessLog(
+                event_id=entry['event_id'],
+                access_point=access_point,
+                access_type=entry['access_type'],
+                status=entry['status'],
+                denial_reason=entry.get('denial_reason', ''),
+                timestamp=min(entry['client_ts'], timezone.now()),
+                device_id=entry.get('device_id', ''),
+                authorized_by=user,
+                notes='Offline decision'
+            )
+            if record is None:
+                log.person_name = 'Unknown'
+                log.access_method = AccessLog.AccessMethod.OTHER
+                log.code_used = entry['code']
+            else:
+                for name, value in record.log_fields().items():
+                    setattr(log, name, value)
+                if not record.is_resident and entry['status'] == AccessLog.Status.SUCCESS:
+                    count, last_used = uses.get(record.pk, (0, log.timestamp))
+                    uses[record.pk] = (count + 1, max(last_used, log.timestamp))
+                    credential_index.discard(record.code, CredentialRecord.VISITOR, record.pk)
+            logs.append(log)
+
+        # Written now rather than behind, so the event_ids are visible to a retry
+        insert_logs(logs, ignore_conflicts=True)
+
+        for temp_code_id, (count, last_used) in uses.items():
+            TemporaryCode.objects.filter(pk=temp_code_id).update(
+                times_used=F('times_used') + count,
+                last_used_at=last_used,
+                is_active=Case(
+                    When(max_uses__lte=F('times_used') + count, then=Value(False)),
+                    default=F('is_active')
+                ),
+                updated_at=timezone.now()
+            )
+        if uses:
+            Credential.touch(Credential.objects.filter(temporary_code_id__in=uses))
+
+    return len(logs), received - len(logs)
@@ -1,3 +1,630 @@
-from django.test import TestCase
+import struct
+import uuid
+import zlib
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import AsyncClient, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.access_logs.models import AccessLog
+from apps.residents.models import Building, Unit, Resident
+from apps.users.models import CustomUser
+from apps.visitors.models import Visitor, TemporaryCode
+from utils.bloom import BloomFilter
+from . import credentials, idempotency, sync, throttling
+from .metrics import MIN_FLUSH_INTERVAL, WORKER_CACHE_KEY, flush_interval, metrics
+from .credentials import CredentialIndex, credential_index
+from .denials import unknown_denials
+from .models import AccessPoint, AccessCode, Credential
+
+VALIDATE_URL = '/api/access/codes/validate/'
+VALIDATE_BATCH_URL = '/api/access/codes/validate_batch/'
+ASYNC_VALIDATE_URL = '/api/access/async/validate/'
+
+
+@override_settings(SCAN_DEBOUNCE_WINDOW=0)
+class ScanTestCase(TestCase):
+    """
+    Resident Ana Gómez and approved visitor Juan Pérez of Torre A 101, the
+    main gate, and a guard's API client
+
+    Per-worker state is reset for each test, so nothing rolled back by an
+    earlier test is still indexed, throttled or debounced.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        building = Building.objects.create(name='Torre A', code='A')
+        cls.unit = Unit.objects.create(building=building, number='101', floor=1)
+        cls.resident = Resident.objects.create(
+            unit=cls.unit, first_name='Ana', last_name='Gómez', document_id='123', phone='+573001234567'
+        )
+        cls.visitor = Visitor.objects.create(
+            first_name='Juan', last_name='Pérez', unit=cls.unit,
+            expected_date=date.today(), status=Visitor.Status.APPROVED
+        )
+        cls.point = AccessPoint.objects.create(name='Puerta Principal', code='MAIN')
+        cls.guard = CustomUser.objects.create_user(username='guardia', password='x')
+
+    def setUp(self):
+        credential_index.invalidate()
+        throttling._buckets = None
+        idempotency._store = None
+        # Summaries of unknown codes would outlive the rolled-back rows
+        self.addCleanup(unknown_denials.drain, force=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.guard)
+
+    def create_temp_code(self, code, **fields):
+        fields.setdefault('valid_until', timezone.now() + timedelta(hours=1))
+        return TemporaryCode.objects.create(visitor=self.visitor, code=code, **fields)
+
+
+class CredentialTableTests(ScanTestCase):
+    """Credential rows follow the codes they mirror"""
+
+    def test_codes_are_mirrored_and_tombstoned(self):
+        access_code = AccessCode.objects.create(resident=self.resident, code='RFID0001')
+        temp_code = self.create_temp_code('VISIT001')
+        self.assertEqual(
+            set(Credential.objects.values_list('code', 'kind', 'resident_id', 'visitor_id', 'is_revoked')),
+            {
+                ('RFID0001', Credential.Kind.RESIDENT, self.resident.pk, None, False),
+                ('VISIT001', Credential.Kind.VISITOR, None, self.visitor.pk, False),
+            }
+        )
+
+        version = Credential.objects.get(code='RFID0001').version
+        access_code.code = 'RFID0002'
+        access_code.save()
+        old = Credential.objects.get(code='RFID0001')
+        self.assertTrue(old.is_revoked)
+        self.assertGreater(old.version, version)
+        self.assertEqual(Credential.objects.get(code='RFID0002').access_code, access_code)
+
+        temp_code.delete()
+        self.assertTrue(Credential.objects.get(code='VISIT001').is_revoked)
+
+        # A tombstone can be claimed again; a live code cannot
+        reissued = AccessCode.objects.create(resident=self.resident, code='VISIT001')
+        self.assertEqual(Credential.objects.get(code='VISIT001').access_code, reissued)
+        with self.assertRaises(IntegrityError):
+            self.create_temp_code('RFID0002')
+
+    def test_resolved_with_one_query(self):
+        AccessCode.objects.create(resident=self.resident, code='RFID0001')
+        self.create_temp_code('VISIT001')
+        index = CredentialIndex()
+        index.rebuild()
+        # Bypass the index: its miss path is the single probe
+        index._records.clear()
+        with self.assertNumQueries(1):
+            records = index.resolve_many({'RFID0001', 'VISIT001', 'NEVER001'})
+        self.assertEqual(
+            {code: (record.kind, record.person_name) for code, record in records.items()},
+            {'RFID0001': ('resident', 'Ana Gómez'), 'VISIT001': ('visitor', 'Juan Pérez')}
+        )
+
+
+class AccessPointMaskTests(ScanTestCase):
+    """The access point bitset follows the M2M from either side"""
+
+    def setUp(self):
+        super().setUp()
+        self.access_code = AccessCode.objects.create(resident=self.resident, code='RFID0001')
+        self.main = self.point
+        self.garage, self.pool = (
+            AccessPoint.objects.create(name=name, code=name.upper()) for name in ('Garage', 'Pool')
+        )
+        self.point_ids = [self.main.pk, self.garage.pk, self.pool.pk]
+
+    def allowed(self):
+        self.access_code.refresh_from_db()
+        return {pk for pk in self.point_ids if self.access_code.allows_access_point(pk)}
+
+    def scan_status(self, point):
+        return self.client.post(
+            VALIDATE_URL, {'code': 'RFID0001', 'access_point_id': point.pk, 'access_type': 'ENTRY'}, format='json'
+        ).status_code
+
+    def test_mask_follows_m2m_changes(self):
+        all_points = {self.main.pk, self.garage.pk, self.pool.pk}
+        # No restriction means every point
+        self.assertEqual(self.allowed(), all_points)
+
+        self.access_code.access_points.add(self.main, self.garage)
+        self.assertEqual(self.allowed(), {self.main.pk, self.garage.pk})
+        self.access_code.access_points.remove(self.garage)
+        self.assertEqual(self.allowed(), {self.main.pk})
+
+        # From the access point side
+        self.pool.allowed_codes.add(self.access_code)
+        self.assertEqual(self.allowed(), {self.main.pk, self.pool.pk})
+        self.garage.allowed_codes.add(self.access_code)
+        self.pool.allowed_codes.clear()
+        self.assertEqual(self.allowed(), {self.main.pk, self.garage.pk})
+
+        # Deleting a point cascades the M2M rows without m2m_changed
+        self.main.delete()
+        self.access_code.refresh_from_db()
+        self.assertEqual(self.access_code.access_points_bits, 1 << self.garage.pk)
+
+    def test_validation_uses_mask(self):
+        self.access_code.access_points.set([self.garage])
+        self.assertEqual(self.scan_status(self.garage), 200)
+        self.assertEqual(self.scan_status(self.main), 403)
+
+        self.access_code.access_points.add(self.main)
+        self.assertEqual(self.scan_status(self.main), 200)
+
+
+class BatchValidationTests(ScanTestCase):
+    """validate_batch decides scans in order and reports each one"""
+
+    def setUp(self):
+        super().setUp()
+        AccessCode.objects.create(resident=self.resident, code='RFID0001')
+        self.temp_code = self.create_temp_code('ONCE0001', max_uses=1)
+
+    def scan(self, code, access_point_id=None, **fields):
+        return dict(code=code, access_point_id=access_point_id or self.point.id, access_type='ENTRY', **fields)
+
+    def test_results_follow_scan_order(self):
+        now = timezone.now()
+        response = self.client.post(VALIDATE_BATCH_URL, [
+            self.scan('ONCE0001', client_ts=(now - timedelta(seconds=20)).isoformat()),
+            self.scan('NEVER001'),
+            self.scan('RFID0001', access_point_id=987654),
+            self.scan('ONCE0001', client_ts=(now - timedelta(seconds=10)).isoformat()),
+            self.scan('RFID0001'),
+        ], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(result['status'], result['valid']) for result in response.data],
+            [(200, True), (404, False), (404, False), (400, False), (200, True)]
+        )
+        self.assertEqual(response.data[0]['person_type'], 'visitor')
+        self.assertEqual(response.data[2]['error'], 'Invalid access point')
+        self.assertEqual(response.data[3]['error'], 'Code is not active or has been used')
+        self.temp_code.refresh_from_db()
+        self.assertEqual(self.temp_code.times_used, 1)
+        # Invalid access points are not logged; the rest are, in one write
+        self.assertEqual(
+            list(AccessLog.objects.order_by('timestamp', 'id').values_list('code_used', 'status')),
+            [('ONCE0001', 'SUCCESS'), ('ONCE0001', 'DENIED'), ('NEVER001', 'DENIED'), ('RFID0001', 'SUCCESS')]
+        )
+
+    def test_malformed_item_rejects_batch(self):
+        response = self.client.post(
+            VALIDATE_BATCH_URL, [self.scan('RFID0001'), {'code': 'RFID0001'}], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AccessLog.objects.exists())
+
+        with override_settings(VALIDATE_BATCH_MAX_SIZE=2):
+            response = self.client.post(VALIDATE_BATCH_URL, [self.scan('RFID0001')] * 3, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+def read_snapshot(payload):
+    """Decode a sync payload as a controller would: (header, {code: entry})"""
+    data = zlib.decompress(payload)
+    magic, format_version, version, access_point_id, count = sync.HEADER.unpack_from(data)
+    offset = sync.HEADER.size
+    entries = {}
+    for _ in range(count):
+        op, kind, valid_from, valid_until, uses_left = sync.ENTRY.unpack_from(data, offset)
+        offset += sync.ENTRY.size
+        fields = []
+        for length_format in ('<H', '<B', '<B'):
+            (length,) = struct.unpack_from(length_format, data, offset)
+            offset += struct.calcsize(length_format)
+            fields.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        code, name, unit = fields
+        entries[code] = (op, kind, valid_from, valid_until, uses_left, name, unit)
+    assert offset == len(data)
+    return (magic, format_version, version, access_point_id), entries
+
+
+@override_settings(CREDENTIAL_SYNC_OVERLAP=0)
+class SnapshotSyncTests(ScanTestCase):
+    """A snapshot plus its deltas equals a fresh snapshot"""
+
+    def setUp(self):
+        super().setUp()
+        self.garage = AccessPoint.objects.create(name='Garaje', code='GAR')
+        self.url = f'/api/access/points/{self.point.id}/snapshot/'
+        self.keep = AccessCode.objects.create(resident=self.resident, code='RFID0001')
+        self.moved = AccessCode.objects.create(resident=self.resident, code='RFID0002')
+        self.temp_code = self.create_temp_code('VISIT001', max_uses=2)
+
+    def fetch(self, since=None):
+        response = self.client.get(self.url, {} if since is None else {'since': since})
+        self.assertEqual(response.status_code, 200)
+        header, entries = read_snapshot(response.content)
+        self.assertEqual(header[:2], (sync.MAGIC, sync.FORMAT_VERSION))
+        self.assertEqual((header[2], header[3]), (int(response['X-Credential-Version']), self.point.id))
+        return header[2], entries
+
+    def apply(self, entries, delta):
+        for code, entry in delta.items():
+            if entry[0] == sync.OP_REVOKE:
+                entries.pop(code, None)
+            else:
+                entries[code] = entry
+
+    def test_delta_round_trip(self):
+        version, entries = self.fetch()
+        self.assertEqual(set(entries), {'RFID0001', 'RFID0002', 'VISIT001'})
+        self.assertEqual(entries['RFID0001'][:2], (sync.OP_UPSERT, sync.KIND_RESIDENT))
+        self.assertEqual(entries['RFID0001'][4:], (sync.UNLIMITED_USES, 'Ana Gómez', 'A-101'))
+        self.assertEqual(entries['VISIT001'][1], sync.KIND_VISITOR)
+        self.assertEqual(entries['VISIT001'][4], 2)
+
+        # Unchanged credentials are not sent again
+        _, delta = self.fetch(version)
+        self.assertEqual(delta, {})
+
+        self.moved.access_points.set([self.garage])
+        self.keep.code = 'RFID0003'
+        self.keep.save()
+        self.temp_code.consume()
+        self.temp_code.consume()
+        AccessCode.objects.create(resident=self.resident, code='PIN00001')
+        self.resident.first_name = 'Ana María'
+        self.resident.save()
+
+        version, delta = self.fetch(version)
+        self.assertEqual(
+            {code for code, entry in delta.items() if entry[0] == sync.OP_REVOKE},
+            {'RFID0001', 'RFID0002', 'VISIT001'}
+        )
+        self.apply(entries, delta)
+        self.assertEqual(entries, self.fetch()[1])
+        self.assertEqual(entries['PIN00001'][5], 'Ana María Gómez')
+
+    def test_since_must_be_a_version(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncValidationTests(ScanTestCase):
+    """The ASGI validate view answers like the DRF one"""
+
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.guard)}'}
+        AccessCode.objects.create(resident=self.resident, code='RFID0001')
+        self.temp_code = self.create_temp_code('ONCE0001', max_uses=1)
+
+    def scan(self, code, access_point_id=None):
+        return {'code': code, 'access_point_id': access_point_id or self.point.id, 'access_type': 'ENTRY'}
+
+    async def post(self, scan):
+        return await self.async_client.post(ASYNC_VALIDATE_URL, scan, content_type='application/json', headers=self.auth)
+
+    async def test_matches_sync_view(self):
+        for scan in (self.scan('RFID0001'), self.scan('NEVER001'), self.scan('RFID0001', 987654)):
+            response = await self.post(scan)
+            expected = await sync_to_async(self.client.post)(VALIDATE_URL, scan, format='json')
+            with self.subTest(scan=scan):
+                self.assertEqual((response.status_code, response.json()), (expected.status_code, expected.json()))
+
+    async def test_visitor_code_used_once(self):
+        first = await self.post(self.scan('ONCE0001'))
+        second = await self.post(self.scan('ONCE0001'))
+
+        self.assertEqual((first.status_code, first.json()['person_type']), (200, 'visitor'))
+        self.assertEqual(second.status_code, 400)
+        await self.temp_code.arefresh_from_db()
+        self.assertEqual(self.temp_code.times_used, 1)
+        self.assertEqual(await AccessLog.objects.filter(code_used='ONCE0001').acount(), 2)
+
+    async def test_requires_token(self):
+        response = await AsyncClient().post(ASYNC_VALIDATE_URL, self.scan('RFID0001'), content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(await AccessLog.objects.aexists())
+
+
+class BloomFilterTests(ScanTestCase):
+    """Unknown codes are rejected cheaply, and never a known one"""
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        bloom = BloomFilter(5000, error_rate=0.01)
+        for n in range(5000):
+            bloom.add(f'CODE{n:06d}')
+
+        self.assertTrue(all(bloom.might_contain(f'CODE{n:06d}') for n in range(5000)))
+        false_positives = sum(bloom.might_contain(f'MISS{n:06d}') for n in range(20000))
+        self.assertLess(false_positives / 20000, 0.02)
+        self.assertFalse(bloom.is_saturated)
+        bloom.add('ONE-TOO-MANY')
+        self.assertTrue(bloom.is_saturated)
+
+    @override_settings(UNKNOWN_CODE_WINDOW=60)
+    def test_unknown_code_denials_are_coalesced_per_device(self):
+        for n in range(5):
+            for device in ('reader-1', 'reader-2'):
+                response = self.client.post(VALIDATE_URL, {
+                    'code': f'NEVER{n:03d}', 'access_point_id': self.point.id, 'access_type': 'ENTRY',
+                    'device_id': device
+                }, format='json')
+                self.assertEqual(response.status_code, 404)
+        # One row per device until the windows close
+        self.assertEqual(AccessLog.objects.count(), 2)
+
+        unknown_denials.flush()
+        summaries = AccessLog.objects.exclude(notes='').order_by('device_id')
+        self.assertEqual(
+            [(log.device_id, log.code_used) for log in summaries], [('reader-1', 'NEVER004'), ('reader-2', 'NEVER004')]
+        )
+        self.assertTrue(summaries[0].notes.startswith('4 further scans'))
+
+
+@override_settings(SCAN_DEBOUNCE_WINDOW=3)
+class RepeatedScanTests(ScanTestCase):
+    """Retries and double reads do not consume visitor codes again"""
+
+    def setUp(self):
+        super().setUp()
+        self.code = self.create_temp_code('ONCE0001', max_uses=1)
+        self.scan = {'code': 'ONCE0001', 'access_point_id': self.point.id, 'access_type': 'ENTRY'}
+
+    def assert_used_once(self):
+        self.code.refresh_from_db()
+        self.assertEqual(self.code.times_used, 1)
+        self.assertEqual(AccessLog.objects.count(), 1)
+
+    def test_idempotency_key_replays_response(self):
+        first = self.client.post(VALIDATE_URL, self.scan, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        with override_settings(SCAN_DEBOUNCE_WINDOW=0):
+            retry = self.client.post(VALIDATE_URL, self.scan, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((retry.status_code, retry.data), (first.status_code, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assert_used_once()
+
+        reused = self.client.post(
+            VALIDATE_URL, dict(self.scan, access_type='EXIT'), format='json', HTTP_IDEMPOTENCY_KEY='retry-1'
+        )
+        self.assertEqual(reused.status_code, 422)
+
+    def test_repeated_scan_gets_first_decision(self):
+        first = self.client.post(VALIDATE_URL, self.scan, format='json')
+        repeat = self.client.post(VALIDATE_URL, self.scan, format='json')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(repeat.data, first.data)
+        self.assert_used_once()
+
+    def test_batch_debounces_by_scan_time(self):
+        now = timezone.now()
+        scans = [
+            dict(self.scan, client_ts=(now - timedelta(seconds=10)).isoformat()),
+            dict(self.scan, client_ts=(now - timedelta(seconds=9)).isoformat()),
+            dict(self.scan, client_ts=now.isoformat()),
+        ]
+        response = self.client.post(VALIDATE_BATCH_URL, scans, format='json')
+
+        self.assertEqual([result['status'] for result in response.data], [200, 200, 400])
+        self.code.refresh_from_db()
+        self.assertEqual(self.code.times_used, 1)
+        self.assertEqual(AccessLog.objects.count(), 2)
+
+
+class CredentialIndexTests(ScanTestCase):
+    """Changes made through one worker's index reach the others"""
+
+    def setUp(self):
+        super().setUp()
+        self.access_code = AccessCode.objects.create(resident=self.resident, code='RFID0001')
+        # Another gunicorn worker: built before the changes below, and not
+        # updated by this process's signal handlers
+        self.other = CredentialIndex()
+        self.other.rebuild()
+
+    @override_settings(CREDENTIAL_INDEX_SYNC_INTERVAL=0)
+    def test_code_issued_elsewhere_is_found(self):
+        self.create_temp_code('NEW00001')
+
+        self.assertFalse(self.other.might_exist('NEW00001'))
+        record = self.other.resolve('NEW00001')
+        self.assertIsNotNone(record)
+        self.assertIsNone(record.denial_reason(self.point.id))
+        self.assertTrue(self.other.might_exist('NEW00001'))
+        self.assertIsNone(self.other.resolve('NEVER001'))
+
+    @override_settings(CREDENTIAL_INDEX_SYNC_INTERVAL=60)
+    def test_unknown_codes_need_no_queries(self):
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.other.resolve('NEVER001'))
+            self.assertEqual(self.other.resolve_many({'NEVER002', 'NEVER003'}), {})
+
+    @override_settings(CREDENTIAL_INDEX_SYNC_INTERVAL=60)
+    def test_hits_need_no_queries(self):
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(self.other.resolve('RFID0001'))
+            self.assertIsNotNone(self.other.resolve('RFID0001'))
+
+    @override_settings(CREDENTIAL_INDEX_SYNC_INTERVAL=0)
+    def test_revocation_seen_by_other_worker(self):
+        self.assertIsNone(self.other.resolve('RFID0001').denial_reason(self.point.id))
+
+        self.access_code.is_active = False
+        self.access_code.save()
+        self.assertEqual(self.other.resolve('RFID0001').denial_reason(self.point.id), 'Code is not active')
+
+        self.access_code.delete()
+        self.assertIsNone(self.other.resolve('RFID0001'))
+        self.assertIsNone(self.other.get('RFID0001'))
+
+    @override_settings(CREDENTIAL_INDEX_SYNC_INTERVAL=0)
+    def test_changes_are_applied_without_rebuild(self):
+        self.resident.first_name = 'Ana María'
+        self.resident.save()
+
+        with mock.patch.object(CredentialIndex, 'rebuild') as rebuild:
+            # The changed credentials, then the access point ids
+            with self.assertNumQueries(2):
+                self.assertEqual(self.other.get('RFID0001').person_name, 'Ana María Gómez')
+        rebuild.assert_not_called()
+
+    def test_code_change_replaces_indexed_code(self):
+        credential_index.rebuild()
+        self.access_code.code = 'RFID0002'
+        self.access_code.save()
+
+        self.assertIsNone(credential_index.get('RFID0001'))
+        self.assertEqual(credential_index.get('RFID0002').pk, self.access_code.pk)
+
+    def test_shared_generation_trusts_index(self):
+        with mock.patch.object(credentials, 'generation_is_shared', return_value=True):
+            with self.assertNumQueries(0):
+                self.assertIsNotNone(self.other.resolve('RFID0001'))
+                self.assertIsNone(self.other.resolve('NEVER001'))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.access_code.is_active = False
+                self.access_code.save()
+            # The bumped generation makes the other worker sync
+            self.assertEqual(self.other.resolve('RFID0001').denial_reason(self.point.id), 'Code is not active')
+
+    def test_unindexed_changes_keep_generation(self):
+        generation = cache.get(credentials.GENERATION_CACHE_KEY, 0)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.resident.phone = '555-0101'
+            self.resident.save()
+            self.access_code.notes = 'Spare card'
+            self.access_code.save()
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(cache.get(credentials.GENERATION_CACHE_KEY, 0), generation)
+
+
+class OfflineLogTests(ScanTestCase):
+    """Controller uploads can be retried without applying decisions twice"""
+
+    def setUp(self):
+        super().setUp()
+        self.code = self.create_temp_code('TWICE001', max_uses=2)
+        self.url = f'/api/access/points/{self.point.id}/offline_logs/'
+
+    def test_retried_upload_is_stored_once(self):
+        entries = [
+            {'event_id': str(uuid.uuid4()), 'code': 'TWICE001', 'status': 'SUCCESS', 'client_ts': timezone.now().isoformat()}
+        ]
+        first = self.client.post(self.url, entries, format='json')
+        retry = self.client.post(self.url, entries * 2, format='json')
+
+        self.assertEqual(first.data, {'stored': 1, 'duplicates': 0})
+        self.assertEqual(retry.data, {'stored': 0, 'duplicates': 2})
+        self.code.refresh_from_db()
+        self.assertEqual(self.code.times_used, 1)
+        self.assertTrue(self.code.is_active)
+        self.assertEqual(AccessLog.objects.count(), 1)
+
+    def test_event_id_is_required(self):
+        response = self.client.post(
+            self.url, [{'code': 'TWICE001', 'status': 'SUCCESS', 'client_ts': timezone.now().isoformat()}], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ScanThrottleTests(ScanTestCase):
+    """A noisy reader is throttled without starving the other gates"""
+
+    def setUp(self):
+        super().setUp()
+        rates = mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'scan_device': '2/m'})
+        rates.start()
+        self.addCleanup(rates.stop)
+
+    def scan(self, device_id, point=None):
+        return self.client.post(VALIDATE_URL, self.payload(device_id, point), format='json')
+
+    def payload(self, device_id, point=None):
+        return {
+            'code': 'NEVER001', 'access_point_id': (point or self.point).id, 'access_type': 'ENTRY',
+            'device_id': device_id,
+        }
+
+    def throttled_count(self, **labels):
+        return metrics._counters.get(('scans_throttled', tuple(sorted(labels.items()))), 0)
+
+    def test_device_limit_returns_429(self):
+        throttled = self.throttled_count(scope='scan_device')
+        self.assertEqual([self.scan('reader-1').status_code for _ in range(3)], [404, 404, 429])
+        response = self.scan('reader-1')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.scan('reader-2').status_code, 404)
+
+        # One series per limit scope, whatever the device ids sent
+        self.assertEqual(self.throttled_count(scope='scan_device'), throttled + 2)
+        self.assertFalse(any(
+            name == 'scans_throttled' and dict(labels).keys() != {'scope'} for name, labels in metrics._counters
+        ))
+
+
+    def test_limit_must_name_its_buckets(self):
+        class NamelessLimit(throttling.ScanLimit):
+            scope = 'scan_device'
+
+        with self.assertRaises(TypeError):
+            NamelessLimit()
+
+    def test_batch_costs_one_token_per_scan(self):
+        response = self.client.post(VALIDATE_BATCH_URL, [self.payload('reader-1')] * 2, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.scan('reader-1').status_code, 429)
+
+    def test_rejected_request_keeps_no_tokens(self):
+        garage = AccessPoint.objects.create(name='Garaje', code='GAR')
+        with mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'scan_access_point': '1/m'}):
+            self.assertEqual(self.scan('reader-1').status_code, 404)
+            # Stopped by the access point limit: the device token is given back
+            self.assertEqual(self.scan('reader-1').status_code, 429)
+            self.assertEqual(self.scan('reader-1', garage).status_code, 404)
+            self.assertEqual(self.scan('reader-1', garage).status_code, 429)
+
+class StageMetricsTests(ScanTestCase):
+    """Validation timings are labelled by known access points only"""
+
+    def access_point_labels(self):
+        return {
+            dict(labels).get('access_point')
+            for name, labels in metrics._histograms if name == 'validate_stage_ms'
+        }
+
+    def test_unknown_access_point_is_not_a_label(self):
+        scan = {'code': 'NEVER001', 'access_type': 'ENTRY'}
+        with mock.patch.object(metrics, 'flush') as flush:
+            self.client.post(VALIDATE_URL, dict(scan, access_point_id=self.point.id), format='json')
+            self.client.post(VALIDATE_URL, dict(scan, access_point_id=987654), format='json')
+            self.client.post(VALIDATE_BATCH_URL, [
+                dict(scan, access_point_id=self.point.id), dict(scan, access_point_id=987655)
+            ], format='json')
+        # Published by the background thread, not by the requests
+        flush.assert_not_called()
+
+        labels = self.access_point_labels()
+        self.assertTrue({str(self.point.id), 'unknown', 'mixed'} <= labels)
+        self.assertFalse({'987654', '987655'} & labels)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    def test_zero_flush_interval_is_floored(self):
+        self.assertEqual(flush_interval(), MIN_FLUSH_INTERVAL)
+        metrics.flush()
+        # Published with a TTL, not expired on arrival
+        self.assertIsNotNone(cache.get(WORKER_CACHE_KEY.format(metrics.worker_id)))
@@ -0,0 +1,290 @@
+"""
+Token-bucket throttling for the scan validation endpoints
+
+Scans are limited per access point, per reader device and per user, so a
+faulty reader cannot starve the other gates. Buckets live in Redis when it
+is the configured cache (limits then hold across gunicorn workers) and in
+worker memory otherwise.
+
+Rates use DRF's format in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']: '20/s'
+refills 20 tokens per second and lets up to 20 scans through in a burst. A
+batch request costs each key one token per scan it carries; one larger than
+the burst goes through only on a full bucket and leaves it in debt. Tokens
+taken for a request that another bucket then rejects are given back.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import metrics
+
+BUCKET_CACHE_KEY = 'access_control:throttle:{}:{}'
+
+# KEYS[1] bucket; ARGV capacity, refill per second, cost (negative refunds).
+# Returns {allowed, seconds until enough tokens}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local needed = math.min(cost, capacity)
+local allowed = 0
+if cost <= 0 or tokens >= needed then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill) + 1)
+return {allowed, tostring(math.max(0, needed - tokens) / refill)}
+"""
+
+
+class LocalTokenBuckets:
+    """
+    Token buckets held in worker memory
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def consume(self, key, capacity, refill, cost=1):
+        """
+        Take tokens from a bucket
+
+        A cost above the capacity is taken from a full bucket, leaving it
+        below zero until the debt is refilled.
+
+        Args:
+            key: Bucket key
+            capacity: Maximum tokens (burst size)
+            refill: Tokens added per second
+            cost: Tokens to take (default: 1); negative gives tokens back
+
+        Returns:
+            Tuple of (allowed, seconds until enough tokens are available)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill)
+            needed = min(cost, capacity)
+            allowed = cost <= 0 or tokens >= needed
+            if allowed:
+                tokens = min(capacity, tokens - cost)
+            self._buckets[key] = (tokens, now)
+
+            # Full buckets carry no state worth keeping
+            if len(self._buckets) > 10000:
+                self._buckets = {
+                    bucket_key: state for bucket_key, state in self._buckets.items()
+                    if state[0] + (now - state[1]) * refill < capacity
+                }
+        return allowed, max(0.0, needed - tokens) / refill
+
+
+class RedisTokenBuckets:
+    """
+    Token buckets shared through the Redis cache, updated atomically by a script
+    """
+
+    def __init__(self, redis_cache):
+        self._cache = redis_cache
+        self._script = None
+
+    def consume(self, key, capacity, refill, cost=1):
+        """See LocalTokenBuckets.consume"""
+        key = self._cache.make_and_validate_key(key)
+        if self._script is None:
+            client = self._cache._cache.get_client(key, write=True)
+            self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        allowed, wait = self._script(keys=[key], args=[capacity, refill, cost])
+        return bool(allowed), float(wait)
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def get_bucket_store():
+    """Bucket store for this worker, chosen from SCAN_THROTTLE_STORE"""
+    global _buckets
+    if _buckets is None:
+        with _buckets_lock:
+            if _buckets is None:
+                from django.core.cache.backends.redis import RedisCache
+
+                backend = caches['default']
+                if settings.SCAN_THROTTLE_STORE == 'cache' and isinstance(backend, RedisCache):
+                    _buckets = RedisTokenBuckets(backend)
+                else:
+                    _buckets = LocalTokenBuckets()
+    return _buckets
+
+
+def scan_payloads(data):
+    """
+    Scans carried by a validate request body
+
+    Args:
+        data: Parsed request body (one scan or a list of scans)
+
+    Returns:
+        List of scan dicts; malformed entries are left to the serializers
+    """
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list):
+        return [scan for scan in data if isinstance(scan, dict)]
+    return []
+
+
+class ScanLimit(ABC):
+    """
+    One token-bucket limit applied to scans
+
+    Subclasses set scope (a key of DEFAULT_THROTTLE_RATES) and get_idents().
+    """
+    scope = None
+
+    def __init__(self):
+        self.wait_time = None
+        self.taken = []
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            self.capacity = None
+            return
+        count, period = rate.split('/')
+        seconds = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+        self.capacity = int(count)
+        self.refill = self.capacity / seconds
+
+    @abstractmethod
+    def get_idents(self, user_id, scans):
+        """
+        Buckets a request draws from, and how many scans each is charged
+
+        Args:
+            user_id: Authenticated user id
+            scans: Scan dicts from the request body
+
+        Returns:
+            Counter of bucket identifier -> number of scans
+        """
+
+    def allow(self, user_id, scans):
+        """
+        Take one token per scan from each of the request's buckets
+
+        Returns:
+            True if every bucket had enough tokens; otherwise none are kept
+        """
+        if self.capacity is None:
+            return True
+        store = get_bucket_store()
+        for ident, cost in self.get_idents(user_id, scans).items():
+            key = BUCKET_CACHE_KEY.format(self.scope, ident)
+            allowed, wait = store.consume(key, self.capacity, self.refill, cost)
+            if not allowed:
+                self.refund()
+                self.wait_time = wait
+                metrics.incr('scans_throttled', scope=self.scope)
+                return False
+            self.taken.append((key, cost))
+        return True
+
+    def refund(self):
+        """Give back the tokens taken by allow()"""
+        store = get_bucket_store()
+        for key, cost in self.taken:
+            store.consume(key, self.capacity, self.refill, -cost)
+        self.taken = []
+
+
+class DeviceScanLimit(ScanLimit):
+    """Limit scans per reader device (scans without device_id are not limited here)"""
+    scope = 'scan_device'
+
+    def get_idents(self, user_id, scans):
+        # Runs before validation: keys are normalized, not trusted
+        return Counter(str(scan['device_id'])[:100] for scan in scans if scan.get('device_id'))
+
+
+class AccessPointScanLimit(ScanLimit):
+    """Limit scans per access point"""
+    scope = 'scan_access_point'
+
+    def get_idents(self, user_id, scans):
+        return Counter(
+            str(scan['access_point_id'])[:20] for scan in scans if scan.get('access_point_id') is not None
+        )
+
+
+class UserScanLimit(ScanLimit):
+    """Limit scans per authenticated user"""
+    scope = 'scan_user'
+
+    def get_idents(self, user_id, scans):
+        return Counter({user_id: max(len(scans), 1)})
+
+
+# Narrowest first. A request stopped by one limit keeps no tokens from the
+# others, so a noisy reader cannot drain its access point's or user's bucket
+SCAN_LIMITS = [DeviceScanLimit, AccessPointScanLimit, UserScanLimit]
+
+
+def throttle_scans(user_id, scans):
+    """
+    Apply SCAN_LIMITS to a request
+
+    Args:
+        user_id: Authenticated user id
+        scans: Scan dicts from the request body
+
+    Returns:
+        Seconds to wait if the request is throttled, otherwise None
+    """
+    granted = []
+    for limit_class in SCAN_LIMITS:
+        limit = limit_class()
+        if not limit.allow(user_id, scans):
+            for earlier in granted:
+                earlier.refund()
+            return limit.wait_time
+        granted.append(limit)
+    return None
+
+
+async def athrottle_scans(user_id, scans):
+    """Async variant of throttle_scans(); only the Redis store leaves the event loop"""
+    if isinstance(get_bucket_store(), LocalTokenBuckets):
+        return throttle_scans(user_id, scans)
+    return await sync_to_async(throttle_scans)(user_id, scans)
+
+
+class ScanRateThrottle(BaseThrottle):
+    """
+    DRF throttle applying SCAN_LIMITS to validate requests
+    """
+
+    def __init__(self):
+        self.wait_time = None
+
+    def allow_request(self, request, view):
+        self.wait_time = throttle_scans(request.user.pk, scan_payloads(request.data))
+        return self.wait_time is None
+
+    def wait(self):
+        return self.wait_time
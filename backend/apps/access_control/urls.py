@@ -3,7 +3,8 @@ URL configuration for Access Control app
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AccessPointViewSet, AccessCodeViewSet
+from .views import AccessPointViewSet, AccessCodeViewSet, MetricsView
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'points', AccessPointViewSet, basename='accesspoint')
@@ -12,5 +13,7 @@ router.register(r'codes', AccessCodeViewSet, basename='accesscode')
 app_name = 'access_control'
 
 urlpatterns = [
+    path('async/validate/', async_views.validate, name='async-validate'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
 ]
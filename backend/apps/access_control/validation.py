@@ -0,0 +1,292 @@
+"""
+Access validation pipeline for Access Control System
+
+Shared by the single and batch validate endpoints. Codes and access points
+are resolved with set-based lookups, visitor uses are claimed in scan order
+with TemporaryCode.consume(), and all AccessLog rows are handed to the log
+writer at once. Denials for unknown codes are coalesced per device (see
+denials.py). A scan repeating one decided within SCAN_DEBOUNCE_WINDOW gets
+that decision back, without a database read or log (see idempotency.py).
+"""
+from django.utils import timezone
+from rest_framework import status
+
+from apps.access_logs.models import AccessLog
+from apps.access_logs.writer import write_logs, awrite_logs
+from apps.visitors.models import Visitor, TemporaryCode
+from .credentials import CredentialRecord, credential_index, NOT_AUTHORIZED
+from .denials import unknown_denials
+from .idempotency import scan_debouncer
+from .metrics import NULL_TIMER
+
+
+class ScanResult:
+    """
+    Outcome of validating one scan
+    """
+    __slots__ = ('valid', 'error', 'http_status', 'record')
+
+    def __init__(self, valid, error=None, http_status=status.HTTP_200_OK, record=None):
+        self.valid = valid
+        self.error = error
+        self.http_status = http_status
+        self.record = record
+
+    @property
+    def data(self):
+        """Response body, as returned by the validate endpoint"""
+        if not self.valid:
+            return {'valid': False, 'error': self.error}
+        return {
+            'valid': True,
+            'person_type': self.record.kind,
+            'person_name': self.record.person_name,
+            'unit': self.record.unit
+        }
+
+
+def _denial_status(error):
+    if error == NOT_AUTHORIZED:
+        return status.HTTP_403_FORBIDDEN
+    return status.HTTP_400_BAD_REQUEST
+
+
+def _log_timestamp(scan, now):
+    # Gate controllers report when the scan happened; never trust future times
+    client_ts = scan.get('client_ts')
+    if client_ts is None or client_ts > now:
+        return now
+    return client_ts
+
+
+def _temporary_code_error(temp_code):
+    """Denial reason for a TemporaryCode that could not be consumed"""
+    if temp_code is not None and temp_code.is_expired:
+        return 'Code has expired'
+    return 'Code is not active or has been used'
+
+
+def _move_visitor(visitor, access_type, now):
+    """
+    Check a visitor in or out after a granted scan
+
+    Returns:
+        True if the visitor's status changed
+    """
+    if access_type == 'ENTRY' and visitor.status != Visitor.Status.CHECKED_IN:
+        visitor.status = Visitor.Status.CHECKED_IN
+        visitor.check_in_time = now
+        return True
+    if access_type == 'EXIT' and visitor.status == Visitor.Status.CHECKED_IN:
+        visitor.status = Visitor.Status.CHECKED_OUT
+        visitor.check_out_time = now
+        return True
+    return False
+
+
+def _decide(log, scan, record, error):
+    """
+    Fill in the outcome of a scan on its AccessLog
+
+    Args:
+        log: Unsaved AccessLog for the scan
+        scan: The scan being validated
+        record: CredentialRecord for the code, or None if it is unknown
+        error: Denial reason, or None if access is granted
+
+    Returns:
+        ScanResult for the scan
+    """
+    if record is None:
+        # Code not found
+        log.person_name = 'Unknown'
+        log.access_method = AccessLog.AccessMethod.OTHER
+        log.code_used = scan['code']
+        log.status = AccessLog.Status.DENIED
+        log.denial_reason = 'Invalid code'
+        return ScanResult(False, 'Invalid code', status.HTTP_404_NOT_FOUND)
+
+    for name, value in record.log_fields().items():
+        setattr(log, name, value)
+    if error is not None:
+        log.status = AccessLog.Status.DENIED
+        log.denial_reason = error
+        return ScanResult(False, error, _denial_status(error), record)
+    log.status = AccessLog.Status.SUCCESS
+    return ScanResult(True, record=record)
+
+
+def validate_scans(scans, user, ip_address=None, timer=NULL_TIMER):
+    """
+    Decide and log a sequence of scans
+
+    Args:
+        scans: List of dicts with code, access_point_id, access_type and
+            optionally client_ts and device_id
+        user: User recorded as authorized_by on the logs
+        ip_address: Address of the device that sent the scans (optional)
+        timer: StageTimer charged with each pipeline stage and labelled
+            with the access point once it is known to exist (optional)
+
+    Returns:
+        List of ScanResult (or ReplayedScan for debounced repeats), in the
+        same order as scans
+    """
+    now = timezone.now()
+    debounce = scan_debouncer.batch(scans)
+    timer.lap('debounce')
+    records = credential_index.resolve_many({scan['code'] for scan in scans})
+    timer.lap('credential_lookup')
+    requested_points = {scan['access_point_id'] for scan in scans}
+    access_point_ids = credential_index.existing_access_points(requested_points)
+    timer.label(requested_points, access_point_ids)
+    timer.lap('access_point_lookup')
+
+    # Visitor usage counters are authoritative in the database
+    temp_code_ids = {record.pk for record in records.values() if not record.is_resident}
+    temp_codes = {}
+    if temp_code_ids:
+        temp_codes = TemporaryCode.objects.select_related(
+            'visitor__unit__building'
+        ).in_bulk(temp_code_ids)
+        timer.lap('visitor_lookup')
+
+    results = []
+    logs = []
+    visitors = {}
+    for scan in scans:
+        access_point_id = scan['access_point_id']
+        if access_point_id not in access_point_ids:
+            results.append(ScanResult(False, 'Invalid access point', status.HTTP_404_NOT_FOUND))
+            continue
+
+        timestamp = _log_timestamp(scan, now)
+        replayed = debounce.match(scan, timestamp)
+        if replayed is not None:
+            results.append(replayed)
+            continue
+
+        log = AccessLog(
+            access_point_id=access_point_id,
+            access_type=scan['access_type'],
+            timestamp=timestamp,
+            device_id=scan.get('device_id', ''),
+            ip_address=ip_address,
+            authorized_by=user
+        )
+
+        record = records.get(scan['code'])
+        if record is None:
+            result = _decide(log, scan, None, None)
+            results.append(result)
+            debounce.add(scan, timestamp, result)
+            if unknown_denials.record(log):
+                logs.append(log)
+            continue
+        logs.append(log)
+
+        error = record.denial_reason(access_point_id, now)
+        if error is None and not record.is_resident:
+            temp_code = temp_codes.get(record.pk)
+            timer.lap('decision')
+            consumed = temp_code is not None and temp_code.consume(now)
+            timer.lap('consume')
+            if not consumed:
+                error = _temporary_code_error(temp_code)
+            else:
+                if _move_visitor(temp_code.visitor, scan['access_type'], now):
+                    visitors[temp_code.visitor.pk] = temp_code.visitor
+                record = CredentialRecord.from_temporary_code(temp_code)
+
+        result = _decide(log, scan, record, error)
+        results.append(result)
+        debounce.add(scan, timestamp, result)
+    timer.lap('decision')
+
+    if visitors:
+        for visitor in visitors.values():
+            visitor.updated_at = now
+        Visitor.objects.bulk_update(
+            visitors.values(), ['status', 'check_in_time', 'check_out_time', 'updated_at']
+        )
+        timer.lap('visitor_save')
+    write_logs(logs + unknown_denials.drain())
+    timer.lap('log_write')
+    debounce.save()
+    timer.lap('debounce')
+
+    return results
+
+
+async def avalidate_scan(scan, user_id, ip_address=None, timer=NULL_TIMER):
+    """
+    Async variant of validate_scans() for a single scan
+
+    Resident codes found in the credential index are decided on the event
+    loop; the database is only used for the AccessLog insert, visitor usage
+    and index misses.
+
+    Args:
+        scan: Dict with code, access_point_id, access_type and optionally
+            device_id
+        user_id: Id of the user recorded as authorized_by on the log
+        ip_address: Address of the device that sent the scan (optional)
+        timer: StageTimer charged with each pipeline stage (optional)
+
+    Returns:
+        ScanResult for the scan, or ReplayedScan for a debounced repeat
+    """
+    now = timezone.now()
+    access_point_id = scan['access_point_id']
+    found = await credential_index.ahas_access_point(access_point_id)
+    timer.label({access_point_id}, {access_point_id} if found else set())
+    timer.lap('access_point_lookup')
+    if not found:
+        return ScanResult(False, 'Invalid access point', status.HTTP_404_NOT_FOUND)
+
+    debounce = await scan_debouncer.abatch([scan])
+    replayed = debounce.match(scan, now)
+    timer.lap('debounce')
+    if replayed is not None:
+        return replayed
+
+    log = AccessLog(
+        access_point_id=access_point_id,
+        access_type=scan['access_type'],
+        timestamp=now,
+        device_id=scan.get('device_id', ''),
+        ip_address=ip_address,
+        authorized_by_id=user_id
+    )
+    record = await credential_index.aresolve(scan['code'])
+    timer.lap('credential_lookup')
+    error = None
+    if record is not None:
+        error = record.denial_reason(access_point_id, now)
+        if error is None and not record.is_resident:
+            temp_code = await TemporaryCode.objects.select_related(
+                'visitor__unit__building'
+            ).filter(pk=record.pk).afirst()
+            timer.lap('visitor_lookup')
+            consumed = temp_code is not None and await temp_code.aconsume(now)
+            timer.lap('consume')
+            if not consumed:
+                error = _temporary_code_error(temp_code)
+            else:
+                visitor = temp_code.visitor
+                if _move_visitor(visitor, scan['access_type'], now):
+                    await visitor.asave(update_fields=['status', 'check_in_time', 'check_out_time', 'updated_at'])
+                    timer.lap('visitor_save')
+                record = CredentialRecord.from_temporary_code(temp_code)
+
+    result = _decide(log, scan, record, error)
+    timer.lap('decision')
+    logs = unknown_denials.drain()
+    if record is not None or unknown_denials.record(log):
+        logs.append(log)
+    await awrite_logs(logs)
+    timer.lap('log_write')
+    debounce.add(scan, now, result)
+    await debounce.asave()
+    timer.lap('debounce')
+    return result
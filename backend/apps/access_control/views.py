@@ -4,14 +4,60 @@ Views for Access Control app
 from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.utils import timezone
+from rest_framework.views import APIView
+from django.conf import settings
+from django.http import HttpResponse
 
 from .models import AccessPoint, AccessCode
 from .serializers import (
-    AccessPointSerializer, AccessCodeSerializer, ValidateAccessRequestSerializer
+    AccessPointSerializer, AccessCodeSerializer, ValidateAccessRequestSerializer,
+    ValidateBatchItemSerializer, OfflineLogSerializer
 )
-from apps.visitors.models import TemporaryCode
-from apps.access_logs.models import AccessLog
+from .idempotency import idempotent
+from .metrics import metrics, StageTimer
+from .throttling import ScanRateThrottle
+from .sync import build_snapshot, ingest_offline_logs, CONTENT_TYPE as SNAPSHOT_CONTENT_TYPE
+from .validation import validate_scans
+from utils.network import get_client_ip
+
+
+class StageTimingMixin:
+    """
+    Time the stages of selected actions
+
+    A StageTimer is attached to the request as stage_timer and passed down
+    the pipeline, which labels it with the access point once validated. Timed requests
+    are added to the validate_stage_ms histograms and, with DEBUG on, get a
+    Server-Timing header.
+    """
+    timed_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        if self.action in self.timed_actions:
+            request.stage_timer = StageTimer()
+        super().initial(request, *args, **kwargs)
+
+    def perform_authentication(self, request):
+        super().perform_authentication(request)
+        timer = getattr(request, 'stage_timer', None)
+        if timer is not None:
+            timer.lap('auth')
+
+    def check_throttles(self, request):
+        super().check_throttles(request)
+        timer = getattr(request, 'stage_timer', None)
+        if timer is not None:
+            timer.lap('throttle')
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timer = getattr(request, 'stage_timer', None)
+        # Only requests that reached the pipeline carry an access point
+        if timer is not None and 'access_point' in timer.labels:
+            timer.record()
+            if settings.DEBUG:
+                response['Server-Timing'] = timer.server_timing()
+        return response
 
 
 class AccessPointViewSet(viewsets.ModelViewSet):
@@ -35,9 +81,42 @@ class AccessPointViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(access_type=access_type)
         
         return queryset
+    
+    @action(detail=True, methods=['get'])
+    def snapshot(self, request, pk=None):
+        """Compressed credential snapshot, or delta with ?since=<version>, for offline controllers"""
+        access_point = self.get_object()
+        since = request.query_params.get('since', None)
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response(
+                    {'error': 'since must be a version number'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        version, payload = build_snapshot(access_point, since)
+        response = HttpResponse(payload, content_type=SNAPSHOT_CONTENT_TYPE)
+        response['X-Credential-Version'] = str(version)
+        return response
+    
+    @action(detail=True, methods=['post'])
+    def offline_logs(self, request, pk=None):
+        """Upload access decisions made offline by a controller"""
+        access_point = self.get_object()
+        serializer = OfflineLogSerializer(
+            data=request.data,
+            many=True,
+            max_length=settings.VALIDATE_BATCH_MAX_SIZE
+        )
+        serializer.is_valid(raise_exception=True)
+        
+        stored, duplicates = ingest_offline_logs(access_point, serializer.validated_data, request.user)
+        return Response({'stored': stored, 'duplicates': duplicates}, status=status.HTTP_202_ACCEPTED)
 
 
-class AccessCodeViewSet(viewsets.ModelViewSet):
+class AccessCodeViewSet(StageTimingMixin, viewsets.ModelViewSet):
     """ViewSet for managing access codes"""
     queryset = AccessCode.objects.select_related('resident', 'issued_by').prefetch_related('access_points').all()
     serializer_class = AccessCodeSerializer
@@ -46,6 +125,7 @@ class AccessCodeViewSet(viewsets.ModelViewSet):
     search_fields = ['code', 'resident__first_name', 'resident__last_name']
     ordering_fields = ['issued_date', 'expiry_date', 'created_at']
     ordering = ['-created_at']
+    timed_actions = ('validate', 'validate_batch')
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -60,173 +140,44 @@ class AccessCodeViewSet(viewsets.ModelViewSet):
         
         return queryset
     
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_classes=[ScanRateThrottle])
+    @idempotent
     def validate(self, request):
         """Validate access code and log access"""
+        timer = request.stage_timer
         serializer = ValidateAccessRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        timer.lap('parse')
         
-        code = serializer.validated_data['code']
-        access_point_id = serializer.validated_data['access_point_id']
-        access_type = serializer.validated_data['access_type']
-        
-        # Get access point
-        try:
-            access_point = AccessPoint.objects.get(id=access_point_id)
-        except AccessPoint.DoesNotExist:
-            return Response(
-                {'valid': False, 'error': 'Invalid access point'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        result = validate_scans(
+            [serializer.validated_data], request.user, get_client_ip(request), timer
+        )[0]
+        return Response(result.data, status=result.http_status)
+    
+    @action(detail=False, methods=['post'], throttle_classes=[ScanRateThrottle])
+    @idempotent
+    def validate_batch(self, request):
+        """Validate a buffered batch of scans and log them in one write"""
+        serializer = ValidateBatchItemSerializer(
+            data=request.data,
+            many=True,
+            max_length=settings.VALIDATE_BATCH_MAX_SIZE
+        )
+        serializer.is_valid(raise_exception=True)
+        timer = request.stage_timer
+        timer.lap('parse')
         
-        # Try to find code in permanent codes
-        try:
-            access_code = AccessCode.objects.select_related('resident').get(code=code)
-            
-            # Validate code
-            if not access_code.is_valid:
-                error = 'Code has expired' if access_code.expiry_date and access_code.expiry_date < timezone.now().date() else 'Code is not active'
-                
-                # Log denied access
-                AccessLog.objects.create(
-                    resident=access_code.resident,
-                    person_name=access_code.resident.full_name,
-                    person_document=access_code.resident.document_id,
-                    access_point=access_point,
-                    access_type=access_type,
-                    access_method=AccessLog.AccessMethod.RFID if access_code.code_type == AccessCode.CodeType.RFID else AccessLog.AccessMethod.NUMERIC_CODE,
-                    code_used=code,
-                    access_code=access_code,
-                    status=AccessLog.Status.DENIED,
-                    denial_reason=error,
-                    authorized_by=request.user
-                )
-                
-                return Response(
-                    {'valid': False, 'error': error},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Check if code has access to this point
-            if access_code.access_points.exists() and access_point not in access_code.access_points.all():
-                # Log denied access
-                AccessLog.objects.create(
-                    resident=access_code.resident,
-                    person_name=access_code.resident.full_name,
-                    person_document=access_code.resident.document_id,
-                    access_point=access_point,
-                    access_type=access_type,
-                    access_method=AccessLog.AccessMethod.RFID if access_code.code_type == AccessCode.CodeType.RFID else AccessLog.AccessMethod.NUMERIC_CODE,
-                    code_used=code,
-                    access_code=access_code,
-                    status=AccessLog.Status.DENIED,
-                    denial_reason='Access point not authorized',
-                    authorized_by=request.user
-                )
-                
-                return Response(
-                    {'valid': False, 'error': 'Access point not authorized'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            # Log successful access
-            AccessLog.objects.create(
-                resident=access_code.resident,
-                person_name=access_code.resident.full_name,
-                person_document=access_code.resident.document_id,
-                access_point=access_point,
-                access_type=access_type,
-                access_method=AccessLog.AccessMethod.RFID if access_code.code_type == AccessCode.CodeType.RFID else AccessLog.AccessMethod.NUMERIC_CODE,
-                code_used=code,
-                access_code=access_code,
-                status=AccessLog.Status.SUCCESS,
-                authorized_by=request.user
-            )
-            
-            return Response({
-                'valid': True,
-                'person_type': 'resident',
-                'person_name': access_code.resident.full_name,
-                'unit': str(access_code.resident.unit)
-            })
-            
-        except AccessCode.DoesNotExist:
-            # Try temporary codes
-            try:
-                temp_code = TemporaryCode.objects.select_related('visitor').get(code=code)
-                
-                if not temp_code.is_valid:
-                    error = 'Code has expired' if temp_code.is_expired else 'Code is not active or has been used'
-                    
-                    # Log denied access
-                    AccessLog.objects.create(
-                        visitor=temp_code.visitor,
-                        person_name=temp_code.visitor.full_name,
-                        person_document=temp_code.visitor.document_id,
-                        access_point=access_point,
-                        access_type=access_type,
-                        access_method=AccessLog.AccessMethod.QR_CODE if temp_code.code_type == TemporaryCode.CodeType.QR else AccessLog.AccessMethod.ALPHANUMERIC_CODE,
-                        code_used=code,
-                        temporary_code=temp_code,
-                        status=AccessLog.Status.DENIED,
-                        denial_reason=error,
-                        authorized_by=request.user
-                    )
-                    
-                    return Response(
-                        {'valid': False, 'error': error},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Increment usage
-                temp_code.increment_usage()
-                
-                # Update visitor status
-                visitor = temp_code.visitor
-                if access_type == 'ENTRY' and visitor.status != visitor.Status.CHECKED_IN:
-                    visitor.status = visitor.Status.CHECKED_IN
-                    visitor.check_in_time = timezone.now()
-                    visitor.save()
-                elif access_type == 'EXIT' and visitor.status == visitor.Status.CHECKED_IN:
-                    visitor.status = visitor.Status.CHECKED_OUT
-                    visitor.check_out_time = timezone.now()
-                    visitor.save()
-                
-                # Log successful access
-                AccessLog.objects.create(
-                    visitor=visitor,
-                    person_name=visitor.full_name,
-                    person_document=visitor.document_id,
-                    access_point=access_point,
-                    access_type=access_type,
-                    access_method=AccessLog.AccessMethod.QR_CODE if temp_code.code_type == TemporaryCode.CodeType.QR else AccessLog.AccessMethod.ALPHANUMERIC_CODE,
-                    code_used=code,
-                    temporary_code=temp_code,
-                    status=AccessLog.Status.SUCCESS,
-                    authorized_by=request.user
-                )
-                
-                return Response({
-                    'valid': True,
-                    'person_type': 'visitor',
-                    'person_name': visitor.full_name,
-                    'unit': str(visitor.unit)
-                })
-                
-            except TemporaryCode.DoesNotExist:
-                # Log denied access - code not found
-                AccessLog.objects.create(
-                    person_name='Unknown',
-                    access_point=access_point,
-                    access_type=access_type,
-                    access_method=AccessLog.AccessMethod.OTHER,
-                    code_used=code,
-                    status=AccessLog.Status.DENIED,
-                    denial_reason='Invalid code',
-                    authorized_by=request.user
-                )
-                
-                return Response(
-                    {'valid': False, 'error': 'Invalid code'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
+        results = validate_scans(
+            serializer.validated_data, request.user, get_client_ip(request), timer
+        )
+        return Response([
+            dict(result.data, status=result.http_status) for result in results
+        ])
+
+
+class MetricsView(APIView):
+    """Validation latency histograms and throttling counters, merged across workers"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(metrics.collect())
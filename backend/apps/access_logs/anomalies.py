@@ -0,0 +1,212 @@
+"""
+Denial-rate anomaly detection for Access Control System
+
+Every written AccessLog (and every unknown-code denial the coalescer counts
+without writing) is fed to the detector. Per access point and per device it
+keeps, in constant memory:
+
+- a ring of ANOMALY_WINDOW / BUCKET_SECONDS buckets of scan and denial
+  counts, with running sums over the window;
+- an exponentially weighted baseline of the denial rate, updated as buckets
+  close (half-life BASELINE_HALF_LIFE).
+
+A series is flagged when its window holds at least ANOMALY_MIN_DENIALS
+denials and the count is ANOMALY_Z_THRESHOLD standard deviations above what
+the baseline rate predicts (binomial z-score). Flags are published to the
+shared cache, at most once per bucket per series, and listed by active_alerts().
+
+Like the metrics registry, each worker sees the scans it handles; alerts
+from every worker are merged when read.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+ALERTS_CACHE_KEY = 'access_logs:alerts'
+ALERT_CACHE_KEY = 'access_logs:alert:{}'
+
+BUCKET_SECONDS = 30
+BASELINE_HALF_LIFE = 3600
+# Denial rate assumed for series with less than a window of history, and the
+# floor of every baseline, so a quiet reader's first denials are not alarming
+PRIOR_DENIAL_RATE = 0.1
+MAX_SERIES = 10000
+ALERT_TTL = 900
+
+DENIED = 'DENIED'
+
+
+class _Series:
+    __slots__ = (
+        'totals', 'denials', 'bucket', 'window_total', 'window_denied',
+        'baseline_total', 'baseline_denied', 'alerted_bucket', 'first_alerted_at',
+    )
+
+    def __init__(self, size, bucket):
+        self.totals = [0] * size
+        self.denials = [0] * size
+        self.bucket = bucket
+        self.window_total = 0
+        self.window_denied = 0
+        self.baseline_total = 0.0
+        self.baseline_denied = 0.0
+        self.alerted_bucket = None
+        self.first_alerted_at = None
+
+    def advance(self, bucket, decay):
+        """Close the buckets up to bucket, folding them into the baseline"""
+        size = len(self.totals)
+        elapsed = bucket - self.bucket
+        if elapsed <= 0:
+            return
+        for step in range(1, min(elapsed, size) + 1):
+            slot = (self.bucket + step) % size
+            closing_total, closing_denied = self.totals[slot], self.denials[slot]
+            self.baseline_total = self.baseline_total * decay + closing_total
+            self.baseline_denied = self.baseline_denied * decay + closing_denied
+            self.window_total -= closing_total
+            self.window_denied -= closing_denied
+            self.totals[slot] = self.denials[slot] = 0
+        if elapsed > size:
+            # Buckets older than the ring were all empty: decay only
+            factor = decay ** (elapsed - size)
+            self.baseline_total *= factor
+            self.baseline_denied *= factor
+        self.bucket = bucket
+
+    def add(self, denied, count):
+        slot = self.bucket % len(self.totals)
+        self.totals[slot] += count
+        self.window_total += count
+        if denied:
+            self.denials[slot] += count
+            self.window_denied += count
+
+    def z_score(self):
+        """Binomial z-score of the window's denials against the baseline rate"""
+        # Trust the baseline once it has seen at least a window's worth of scans
+        if self.baseline_total >= self.window_total:
+            rate = max(self.baseline_denied / self.baseline_total, PRIOR_DENIAL_RATE)
+        else:
+            rate = PRIOR_DENIAL_RATE
+        rate = min(rate, 0.99)
+        expected = self.window_total * rate
+        spread = math.sqrt(self.window_total * rate * (1 - rate))
+        return (self.window_denied - expected) / spread, rate
+
+
+class DenialAnomalyDetector:
+    """
+    Per-worker sliding-window denial counters with EWMA baselines
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = OrderedDict()
+
+    def observe(self, access_point_id, device, denied, count=1, now=None):
+        """
+        Count scans at an access point and device
+
+        Args:
+            access_point_id: Access point of the scans (None to skip)
+            device: Device identifier, e.g. device_id or IP ('' to skip)
+            denied: Whether the scans were denied
+            count: Number of scans (default: 1)
+            now: Unix time of the scans (default: now)
+        """
+        now = time.time() if now is None else now
+        bucket = int(now // BUCKET_SECONDS)
+        size = max(settings.ANOMALY_WINDOW // BUCKET_SECONDS, 1)
+        decay = 0.5 ** (BUCKET_SECONDS / BASELINE_HALF_LIFE)
+
+        flagged = []
+        with self._lock:
+            for key in (('access_point', access_point_id), ('device', device)):
+                if not key[1]:
+                    continue
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = _Series(size, bucket)
+                    if len(self._series) > MAX_SERIES:
+                        self._series.popitem(last=False)
+                else:
+                    self._series.move_to_end(key)
+                series.advance(bucket, decay)
+                series.add(denied, count)
+                if denied and series.window_denied >= settings.ANOMALY_MIN_DENIALS:
+                    z_score, rate = series.z_score()
+                    if z_score >= settings.ANOMALY_Z_THRESHOLD and series.alerted_bucket != bucket:
+                        # A flag not renewed for a whole window starts a new alert
+                        if series.alerted_bucket is None or bucket - series.alerted_bucket > size:
+                            series.first_alerted_at = now
+                        series.alerted_bucket = bucket
+                        flagged.append(self._alert(key, series, z_score, rate, access_point_id, now))
+        for alert in flagged:
+            self._publish(alert)
+
+    @staticmethod
+    def _alert(key, series, z_score, rate, access_point_id, now):
+        scope, ident = key
+        return {
+            'scope': scope,
+            'key': str(ident),
+            'access_point_id': access_point_id,
+            'window_seconds': len(series.totals) * BUCKET_SECONDS,
+            'denied': series.window_denied,
+            'total': series.window_total,
+            'denial_rate': round(series.window_denied / series.window_total, 3),
+            'baseline_rate': round(rate, 3),
+            'z_score': round(z_score, 2),
+            'first_flagged_at': datetime.fromtimestamp(series.first_alerted_at, dt_timezone.utc).isoformat(),
+            'last_flagged_at': datetime.fromtimestamp(now, dt_timezone.utc).isoformat(),
+        }
+
+    @staticmethod
+    def _publish(alert):
+        digest = hashlib.blake2b(f"{alert['scope']}:{alert['key']}".encode(), digest_size=8).hexdigest()
+        cache_key = ALERT_CACHE_KEY.format(digest)
+        previous = cache.get(cache_key)
+        if previous and previous['first_flagged_at'] < alert['first_flagged_at']:
+            alert['first_flagged_at'] = previous['first_flagged_at']
+        cache.set(cache_key, alert, ALERT_TTL)
+        # Re-registered on every publication, so a lost update heals itself
+        keys = cache.get(ALERTS_CACHE_KEY, [])
+        if cache_key not in keys:
+            cache.set(ALERTS_CACHE_KEY, keys[-255:] + [cache_key], None)
+
+    def logs_written(self, logs):
+        """Feed written AccessLog rows; rows older than the window are skipped"""
+        cutoff = timezone.now() - timedelta(seconds=settings.ANOMALY_WINDOW)
+        now = time.time()
+        for log in logs:
+            if log.timestamp < cutoff:
+                continue
+            self.observe(
+                log.access_point_id, log.device_id or log.ip_address or '',
+                log.status == DENIED, now=now
+            )
+
+
+anomaly_detector = DenialAnomalyDetector()
+
+
+def active_alerts():
+    """
+    Denial-rate alerts raised in the last ALERT_TTL seconds by any worker
+
+    Returns:
+        List of alert dicts, most recently flagged first
+    """
+    keys = cache.get(ALERTS_CACHE_KEY, [])
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        cache.set(ALERTS_CACHE_KEY, [key for key in keys if key in found], None)
+    return sorted(found.values(), key=lambda alert: alert['last_flagged_at'], reverse=True)
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class AccessLogsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.access_logs'
+
+    def ready(self):
+        from utils.search import repair_search_indexes
+        from . import signals  # noqa: F401
+        from .writer import durable_journal_root
+
+        # Refuse to start rather than journal logs where a deploy erases them
+        durable_journal_root()
+
+        post_migrate.connect(repair_search_indexes, sender=self)
@@ -0,0 +1,549 @@
+"""
+Columnar archive of old AccessLog rows
+
+`manage.py archive_access_logs` moves whole months older than the retention
+horizon (ACCESS_LOG_RETENTION_MONTHS) out of the database into
+ACCESS_LOG_ARCHIVE_DIR, one directory per month (YYYY-MM) holding:
+
+- one .npy file per column, rows sorted by (timestamp, id);
+- id and timestamps (microseconds since the epoch, UTC) as int64, foreign
+  keys as int64 with -1 for NULL, temperature as float32 with NaN for NULL,
+  event_id as 16 raw bytes (empty for NULL);
+- every text column and access_point dictionary-encoded: the file holds
+  uint8/uint16/uint32 codes into dictionaries.json.gz;
+- meta.json with the row count and the access point names at archive time.
+
+Columns are plain arrays so they can be memory-mapped, which a general
+purpose codec would prevent; dictionary codes are what keeps them small (a
+status or access method is one byte). Reading a month maps its files and
+answers a query with binary searches on timestamp and vectorized
+comparisons of codes, without loading the month in memory.
+
+On PostgreSQL a month with its own partition is detached and dropped;
+other months are deleted. Rows are deleted only if their count matches what
+was written, so logs arriving meanwhile wait for the next run. Hourly
+rollups are kept, so stats and heatmaps still cover archived months.
+
+The archive is the only copy of those logs, so ACCESS_LOG_ARCHIVE_DIR must
+be set explicitly to persistent storage outside the application directory.
+A month is written to a hidden staging directory and only takes its place
+once the delete has committed; a run interrupted in between is finished or
+undone by the next one, depending on whether the rows are still in the
+database.
+"""
+import gzip
+import json
+import re
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Min
+
+from apps.access_control.models import AccessPoint
+from utils.paths import inside_base_dir
+from .models import AccessLog
+from .partitions import TABLE, add_months, is_partitioned, list_partitions, month_start
+
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+DICTIONARY_FILE = 'dictionaries.json.gz'
+MONTH_PATTERN = re.compile(r'^(\d{4})-(\d{2})$')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+NULL_ID = -1
+# Rows compared at a time when filtering; a page stops at the first blocks
+SCAN_BLOCK = 1 << 20
+
+TIME_COLUMNS = ('timestamp', 'created_at')
+ID_COLUMNS = ('id', 'resident_id', 'visitor_id', 'temporary_code_id', 'access_code_id', 'authorized_by_id')
+DICTIONARY_COLUMNS = (
+    'person_name', 'person_document', 'access_point_id', 'access_type', 'access_method', 'code_used',
+    'status', 'denial_reason', 'vehicle_plate', 'photo', 'notes', 'ip_address', 'device_id',
+)
+FLOAT_COLUMNS = ('temperature',)
+UUID_COLUMNS = ('event_id',)
+COLUMNS = TIME_COLUMNS + ID_COLUMNS + DICTIONARY_COLUMNS + FLOAT_COLUMNS + UUID_COLUMNS
+
+# Lookups search() answers, besides timestamp__gt/gte/lt/lte
+EQUALITY_LOOKUPS = (
+    'access_point_id', 'access_type', 'access_method', 'status', 'resident_id', 'visitor_id',
+)
+
+
+class ArchiveError(Exception):
+    """A month could not be archived"""
+
+
+def archive_root():
+    """ACCESS_LOG_ARCHIVE_DIR, or None if no archive is configured"""
+    if not settings.ACCESS_LOG_ARCHIVE_DIR:
+        return None
+    return Path(settings.ACCESS_LOG_ARCHIVE_DIR)
+
+
+def durable_archive_root():
+    """
+    ACCESS_LOG_ARCHIVE_DIR, checked before rows are deleted on its strength
+
+    Raises:
+        ArchiveError: if it is not set, or lies inside BASE_DIR, which is
+            replaced on every deploy
+    """
+    root = archive_root()
+    if root is None:
+        raise ArchiveError(
+            'ACCESS_LOG_ARCHIVE_DIR is not set; point it at persistent storage '
+            'before archiving, archived logs are deleted from the database'
+        )
+    root = root.resolve()
+    if inside_base_dir(root):
+        raise ArchiveError(
+            f'ACCESS_LOG_ARCHIVE_DIR ({root}) is inside the application directory, '
+            'which does not survive a deploy; use a persistent disk'
+        )
+    return root
+
+
+def _micros(value):
+    return (value - EPOCH) // MICROSECOND
+
+
+def _datetime(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def _uuid_bytes(value):
+    # Rewritten months hand back the stored bytes
+    if value is None or isinstance(value, bytes):
+        return value or b''
+    return value.bytes
+
+
+def _uuid(raw):
+    # numpy drops trailing NUL bytes of fixed-width byte strings
+    return uuid.UUID(bytes=raw.ljust(16, b'\0')) if raw else None
+
+
+def _code_dtype(size):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+class ArchivedMonth:
+    """
+    Read access to one archived month; columns are memory-mapped on first use
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / META_FILE).read_text())
+        if meta['version'] != FORMAT_VERSION:
+            raise ArchiveError(f'{self.path}: unsupported archive version {meta["version"]}')
+        self.month = datetime.strptime(meta['month'], '%Y-%m').replace(tzinfo=dt_timezone.utc)
+        self.rows = meta['rows']
+        self.access_point_names = {int(key): name for key, name in meta['access_point_names'].items()}
+        with gzip.open(self.path / DICTIONARY_FILE, 'rt', encoding='utf-8') as file:
+            self.dictionaries = json.load(file)
+        self._codes = {}
+        self._columns = {}
+
+    def column(self, name):
+        array = self._columns.get(name)
+        if array is None:
+            array = self._columns[name] = np.load(self.path / f'{name}.npy', mmap_mode='r')
+        return array
+
+    def code(self, column, value):
+        """Dictionary code of a value, or None if the month never saw it"""
+        codes = self._codes.get(column)
+        if codes is None:
+            codes = self._codes[column] = {value: code for code, value in enumerate(self.dictionaries[column])}
+        if column == 'access_point_id':
+            value = int(value)
+        return codes.get(value if value is None or isinstance(value, int) else str(value))
+
+    def _position(self, timestamp, log_id, side):
+        # Index where (timestamp, id) sorts, ties on timestamp broken by id
+        timestamps = self.column('timestamp')
+        micros = _micros(timestamp)
+        start = int(np.searchsorted(timestamps, micros, 'left'))
+        stop = int(np.searchsorted(timestamps, micros, 'right'))
+        return start + int(np.searchsorted(self.column('id')[start:stop], log_id, side))
+
+    def select(self, lookups, limit, cursor=None, reverse=False):
+        """
+        Positions of the rows matching lookups
+
+        Args:
+            lookups: Equality lookups from EQUALITY_LOOKUPS and
+                timestamp__gt/gte/lt/lte, as given to QuerySet.filter()
+            limit: Maximum number of positions
+            cursor: (timestamp, id) the rows must come after, in the order
+                requested (default: from the start)
+            reverse: Oldest first instead of newest first
+
+        Returns:
+            Array of row positions, in the order requested
+        """
+        timestamps = self.column('timestamp')
+        start, stop = 0, self.rows
+        for lookup, value in lookups.items():
+            if lookup.startswith('timestamp__'):
+                operator = lookup.split('__', 1)[1]
+                side = 'left' if operator in ('gte', 'lt') else 'right'
+                position = int(np.searchsorted(timestamps, _micros(value), side))
+                if operator in ('gt', 'gte'):
+                    start = max(start, position)
+                else:
+                    stop = min(stop, position)
+            elif lookup not in EQUALITY_LOOKUPS:
+                raise ValueError(f'Unsupported archive lookup: {lookup}')
+        if cursor is not None:
+            if reverse:
+                start = max(start, self._position(*cursor, 'right'))
+            else:
+                stop = min(stop, self._position(*cursor, 'left'))
+        if start >= stop:
+            return np.empty(0, dtype=np.int64)
+
+        filters = []
+        for lookup, value in lookups.items():
+            if lookup.startswith('timestamp__'):
+                continue
+            if lookup in DICTIONARY_COLUMNS:
+                code = self.code(lookup, value)
+                if code is None:
+                    return np.empty(0, dtype=np.int64)
+            else:
+                code = int(value)
+            filters.append((self.column(lookup), code))
+        if not filters:
+            if reverse:
+                return np.arange(start, min(stop, start + limit))
+            return np.arange(stop - 1, max(start, stop - limit) - 1, -1)
+
+        # Blocks from the end the page starts at, until the page is full
+        found = []
+        count = 0
+        blocks = range(start, stop, SCAN_BLOCK) if reverse else range(stop, start, -SCAN_BLOCK)
+        for edge in blocks:
+            low, high = (edge, min(edge + SCAN_BLOCK, stop)) if reverse else (max(edge - SCAN_BLOCK, start), edge)
+            mask = None
+            for column, code in filters:
+                matches = column[low:high] == code
+                mask = matches if mask is None else mask & matches
+            positions = np.flatnonzero(mask) + low
+            found.append(positions if reverse else positions[::-1])
+            count += len(positions)
+            if count >= limit:
+                break
+        return np.concatenate(found)[:limit]
+
+    def logs(self, positions):
+        """Unsaved AccessLog instances of the rows at positions"""
+        values = {}
+        for name in COLUMNS:
+            column = self.column(name)[positions].tolist()
+            if name in DICTIONARY_COLUMNS:
+                dictionary = self.dictionaries[name]
+                column = [dictionary[code] for code in column]
+            elif name in TIME_COLUMNS:
+                column = [_datetime(micros) for micros in column]
+            elif name in FLOAT_COLUMNS:
+                column = [None if value != value else Decimal(f'{value:.1f}') for value in column]
+            elif name in UUID_COLUMNS:
+                column = [_uuid(raw) for raw in column]
+            elif name != 'id':
+                column = [None if value == NULL_ID else value for value in column]
+            values[name] = column
+
+        logs = []
+        for index in range(len(positions)):
+            fields = {name: column[index] for name, column in values.items()}
+            point_id = fields.pop('access_point_id')
+            if point_id is not None:
+                fields['access_point'] = AccessPoint(id=point_id, name=self.access_point_names.get(point_id, ''))
+            logs.append(AccessLog(**fields))
+        return logs
+
+    def decode(self):
+        """Every row as column lists of stored values, for rewriting the month"""
+        columns = {}
+        for name in COLUMNS:
+            column = np.asarray(self.column(name)).tolist()
+            if name in DICTIONARY_COLUMNS:
+                dictionary = self.dictionaries[name]
+                column = [dictionary[code] for code in column]
+            columns[name] = column
+        return columns
+
+
+_months = {}
+_months_lock = threading.Lock()
+
+
+def archived_months():
+    """
+    Every archived month, oldest first
+
+    Returns:
+        Dictionary of month_start() value -> ArchivedMonth
+    """
+    root = archive_root()
+    if root is None or not root.is_dir():
+        return {}
+    months = {}
+    for path in sorted(root.iterdir()):
+        if not MONTH_PATTERN.match(path.name):
+            continue
+        try:
+            stat = (path / META_FILE).stat()
+        except FileNotFoundError:
+            continue
+        # A rewritten month is a new directory: reopen it
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with _months_lock:
+            cached = _months.get(path)
+            if cached is None or cached[0] != version:
+                cached = _months[path] = (version, ArchivedMonth(path))
+        months[cached[1].month] = cached[1]
+    return months
+
+
+def search(lookups, limit, cursor=None, reverse=False):
+    """
+    Archived logs matching lookups, newest first (or oldest first)
+
+    Args:
+        lookups: See ArchivedMonth.select()
+        limit: Maximum number of logs
+        cursor: (timestamp, id) the logs must come after, in the order
+            requested (default: from the start)
+        reverse: Oldest first instead of newest first
+
+    Returns:
+        List of unsaved AccessLog instances
+    """
+    months = list(archived_months().values())
+    if not reverse:
+        months.reverse()
+    found = []
+    for month in months:
+        positions = month.select(lookups, limit - len(found), cursor, reverse)
+        found.extend(month.logs(positions))
+        if len(found) >= limit:
+            break
+    return found
+
+
+def overlaps(lookups):
+    """
+    Whether the timestamp range of lookups reaches into an archived month
+
+    Args:
+        lookups: See ArchivedMonth.select()
+    """
+    lower = max((value for lookup, value in lookups.items() if lookup in ('timestamp__gt', 'timestamp__gte')), default=None)
+    upper = min((value for lookup, value in lookups.items() if lookup in ('timestamp__lt', 'timestamp__lte')), default=None)
+    for month in archived_months():
+        if lower is not None and lower >= add_months(month, 1):
+            continue
+        if upper is not None and upper < month:
+            continue
+        return True
+    return False
+
+
+def _read_month(month, using):
+    """Column lists of the month's live rows, and the access point names they use"""
+    columns = {name: [] for name in COLUMNS}
+    logs = AccessLog.objects.using(using).filter(timestamp__gte=month, timestamp__lt=add_months(month, 1))
+    for row in logs.values_list(*COLUMNS).iterator(chunk_size=settings.ACCESS_LOG_EXPORT_CHUNK_SIZE):
+        for name, value in zip(COLUMNS, row):
+            columns[name].append(value)
+    point_ids = {point_id for point_id in columns['access_point_id'] if point_id is not None}
+    names = dict(AccessPoint.objects.using(using).filter(id__in=point_ids).values_list('id', 'name'))
+    return columns, names
+
+
+def _write_month(path, month, columns, access_point_names, last_moved_id=None):
+    path.mkdir(parents=True)
+    timestamps = np.array(
+        [value if isinstance(value, int) else _micros(value) for value in columns['timestamp']], dtype=np.int64
+    )
+    order = np.lexsort((np.array(columns['id'], dtype=np.int64), timestamps))
+
+    dictionaries = {}
+    for name in COLUMNS:
+        values = columns[name]
+        if name in TIME_COLUMNS:
+            array = np.array([value if isinstance(value, int) else _micros(value) for value in values], dtype=np.int64)
+        elif name in ID_COLUMNS:
+            array = np.array([NULL_ID if value is None else value for value in values], dtype=np.int64)
+        elif name in FLOAT_COLUMNS:
+            array = np.array([np.nan if value is None else float(value) for value in values], dtype=np.float32)
+        elif name in UUID_COLUMNS:
+            array = np.array([_uuid_bytes(value) for value in values], dtype='S16')
+        else:
+            mapping = {}
+            codes = [mapping.setdefault(value, len(mapping)) for value in values]
+            array = np.array(codes, dtype=_code_dtype(len(mapping)))
+            dictionaries[name] = list(mapping)
+        np.save(path / f'{name}.npy', array[order])
+
+    with gzip.open(path / DICTIONARY_FILE, 'wt', encoding='utf-8') as file:
+        json.dump(dictionaries, file, ensure_ascii=False)
+    (path / META_FILE).write_text(json.dumps({
+        'version': FORMAT_VERSION,
+        'month': f'{month:%Y-%m}',
+        'rows': len(order),
+        'access_point_names': {str(key): name for key, name in access_point_names.items()},
+        'last_moved_id': last_moved_id,
+    }))
+
+
+def _staging_dirs(root, month):
+    return sorted(root.glob(f'.{month:%Y-%m}.*'))
+
+
+def _promote(staging, final):
+    """Put a staged month in place of the current one"""
+    retired = final.parent / f'.{final.name}.old.{uuid.uuid4().hex}'
+    if final.exists():
+        final.rename(retired)
+    staging.rename(final)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def _recover(root, month, using):
+    """
+    Finish or undo a run of archive_month() interrupted after writing
+
+    A staging directory whose moved rows are gone from the database was
+    committed and takes the month's place; one whose rows are still there
+    was rolled back and is removed.
+    """
+    final = root / f'{month:%Y-%m}'
+    for staging in _staging_dirs(root, month):
+        if '.old.' in staging.name:
+            shutil.rmtree(staging, ignore_errors=True)
+            continue
+        try:
+            meta = json.loads((staging / META_FILE).read_text())
+        except (FileNotFoundError, ValueError):
+            # Interrupted while writing: nothing was deleted yet
+            shutil.rmtree(staging, ignore_errors=True)
+            continue
+        # Ids are increasing, so rows of the month up to the last moved id
+        # are exactly the moved rows
+        still_live = AccessLog.objects.using(using).filter(
+            timestamp__gte=month, timestamp__lt=add_months(month, 1), id__lte=meta['last_moved_id']
+        ).exists()
+        if still_live:
+            shutil.rmtree(staging, ignore_errors=True)
+        else:
+            _promote(staging, final)
+
+
+def _remove_live_rows(connection, month, expected):
+    """Drop the month's partition or delete its rows; raise if the count differs"""
+    partition = list_partitions(connection).get(month) if is_partitioned(connection) else None
+    if partition is not None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(f'SELECT COUNT(*) FROM {partition}')
+            removed = cursor.fetchone()[0]
+            if removed == expected:
+                cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {partition}')
+                cursor.execute(f'DROP TABLE {partition}')
+    else:
+        removed, _ = AccessLog.objects.using(connection.alias).filter(
+            timestamp__gte=month, timestamp__lt=add_months(month, 1)
+        ).delete()
+    if removed != expected:
+        raise ArchiveError(
+            f'{month:%Y-%m}: {removed} rows to remove but {expected} archived; '
+            'logs arrived meanwhile, run again'
+        )
+
+
+def archive_month(month, using=DEFAULT_DB_ALIAS):
+    """
+    Move a month of AccessLog rows into the archive
+
+    Rows of a month archived earlier (e.g. offline logs synced late) are
+    merged into its files.
+
+    Args:
+        month: month_start() value
+        using: Database alias
+
+    Returns:
+        Number of rows moved (0 if the month has none in the database)
+    """
+    connection = connections[using]
+    root = durable_archive_root()
+    _recover(root, month, using)
+    columns, names = _read_month(month, using)
+    moved = len(columns['id'])
+    if not moved:
+        return 0
+    last_moved_id = max(columns['id'])
+
+    final = root / f'{month:%Y-%m}'
+    previous = archived_months().get(month)
+    if previous is not None:
+        archived = previous.decode()
+        # Rows are archived once, whatever happened to an earlier run
+        live_ids = set(columns['id'])
+        kept = [index for index, log_id in enumerate(archived['id']) if log_id not in live_ids]
+        for name in COLUMNS:
+            columns[name] = [archived[name][index] for index in kept] + columns[name]
+        names = {**previous.access_point_names, **names}
+
+    staging = root / f'.{month:%Y-%m}.{uuid.uuid4().hex}'
+    _write_month(staging, month, columns, names, last_moved_id)
+    try:
+        with transaction.atomic(using=using):
+            _remove_live_rows(connection, month, moved)
+    except Exception:
+        # The rows are still in the database
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    # Only now are the files the sole copy; if we stop before this, the
+    # next run finds the rows gone and promotes the staging directory
+    _promote(staging, final)
+    return moved
+
+
+def archive_before(before, using=DEFAULT_DB_ALIAS):
+    """
+    Archive every month older than a cutoff
+
+    Args:
+        before: month_start() value; months before it are archived
+
+    Returns:
+        List of (month, rows moved) for the months that had rows
+    """
+    oldest = AccessLog.objects.using(using).filter(timestamp__lt=before).aggregate(oldest=Min('timestamp'))['oldest']
+    if oldest is None:
+        return []
+    archived = []
+    month = month_start(oldest)
+    while month < before:
+        moved = archive_month(month, using)
+        if moved:
+            archived.append((month, moved))
+        month = add_months(month, 1)
+    return archived
@@ -0,0 +1,55 @@
+"""
+Management command to maintain the monthly AccessLog partitions
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.access_logs.partitions import (
+    detach_partitions, ensure_partitions, is_partitioned, list_partitions
+)
+
+
+def _parse_month(value):
+    try:
+        return datetime.strptime(value, '%Y-%m').replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        raise CommandError(f'Invalid month "{value}", expected YYYY-MM')
+
+
+class Command(BaseCommand):
+    help = (
+        'Create upcoming monthly AccessLog partitions and detach or drop old ones. '
+        'Run it daily (e.g. from cron) so the next months always exist.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=3,
+            help='Months after the current one to create partitions for (default: 3)'
+        )
+        parser.add_argument(
+            '--detach-before', metavar='YYYY-MM',
+            help='Detach the partitions of months before this one, keeping them as tables'
+        )
+        parser.add_argument(
+            '--drop-before', metavar='YYYY-MM',
+            help='Drop the partitions of months before this one'
+        )
+
+    def handle(self, *args, **options):
+        for name in ensure_partitions(connection, options['months_ahead']):
+            self.stdout.write(self.style.SUCCESS(f'Created partition {name}'))
+
+        if options['detach_before']:
+            for name in detach_partitions(connection, _parse_month(options['detach_before'])):
+                self.stdout.write(self.style.SUCCESS(f'Detached {name}'))
+        if options['drop_before']:
+            for name in detach_partitions(connection, _parse_month(options['drop_before']), drop=True):
+                self.stdout.write(self.style.SUCCESS(f'Dropped {name}'))
+
+        if not is_partitioned(connection) and connection.vendor != 'sqlite':
+            self.stdout.write(self.style.WARNING('AccessLog table is not partitioned on this database'))
+        partitions = list_partitions(connection)
+        self.stdout.write(f'{len(partitions)} monthly partitions: ' + ', '.join(partitions.values()))
@@ -0,0 +1,46 @@
+"""
+Management command to move old access logs into the columnar archive
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.access_logs.archive import ArchiveError, archive_before, durable_archive_root
+from apps.access_logs.partitions import add_months, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Move access logs of whole months older than ACCESS_LOG_RETENTION_MONTHS '
+        'out of the database into columnar files under ACCESS_LOG_ARCHIVE_DIR, '
+        'which must be set to persistent storage outside the application directory. '
+        'Archived logs are still listed by /api/logs/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', metavar='YYYY-MM',
+            help='Archive the months before this one instead of using the retention setting'
+        )
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                before = datetime.strptime(options['before'], '%Y-%m').replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                raise CommandError(f'Invalid month "{options["before"]}", expected YYYY-MM')
+        else:
+            before = add_months(month_start(), -settings.ACCESS_LOG_RETENTION_MONTHS)
+
+        try:
+            root = durable_archive_root()
+            archived = archive_before(before)
+        except ArchiveError as error:
+            raise CommandError(str(error))
+        for month, moved in archived:
+            self.stdout.write(self.style.SUCCESS(f'Archived {moved} access logs of {month:%Y-%m}'))
+        if not archived:
+            self.stdout.write(f'No access logs before {before:%Y-%m} to archive')
+        else:
+            self.stdout.write(f'Archive: {root}')
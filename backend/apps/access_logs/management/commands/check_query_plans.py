@@ -0,0 +1,238 @@
+"""
+Management command to check the query plans of the list endpoints
+"""
+import itertools
+import random
+import uuid
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.access_control.models import AccessPoint
+from apps.access_logs.models import AccessLog
+from apps.access_logs.views import AccessLogViewSet
+from apps.residents.models import Building, Unit, Resident
+from apps.residents.views import ResidentViewSet
+from apps.visitors.models import Visitor, TemporaryCode
+from apps.visitors.views import VisitorViewSet, TemporaryCodeViewSet
+from utils.query_plans import capture_queries, explain, sequential_scans
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a synthetic dataset, request every list endpoint '
+        'with every combination of its filters, and fail if any of their queries '
+        'reads a whole table. The dataset is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=200000,
+            help='Number of synthetic access logs; other tables scale with it (default: 200000)'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(f'Query plans can only be checked on PostgreSQL or SQLite, not {connection.vendor}')
+
+        with transaction.atomic():
+            sample = self.seed(options['rows'])
+            self.analyze(connection)
+            failures, checked = self.check_endpoints(connection, sample, options['verbosity'])
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(
+                f'{len(failures)} of {checked} queries read a whole table:\n' + '\n'.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} queries: no sequential scans'))
+
+    def seed(self, rows):
+        """Bulk-insert a synthetic dataset of about rows access logs"""
+        rng = random.Random(0)
+        now = timezone.now()
+        prefix = uuid.uuid4().hex[:6].upper()
+        people = max(rows // 20, 100)
+
+        user = User.objects.create(username=f'query-plans-{prefix}')
+        buildings = Building.objects.bulk_create(
+            Building(name=f'Torre {prefix}{i}', code=f'{prefix}{i}') for i in range(4)
+        )
+        units = Unit.objects.bulk_create(
+            Unit(building=buildings[i % 4], number=f'{i + 100}', floor=i // 40 + 1)
+            for i in range(max(people // 3, 40))
+        )
+        residents = Resident.objects.bulk_create(
+            (
+                Resident(
+                    unit=rng.choice(units), first_name=f'Residente {i}', last_name=prefix,
+                    document_id=f'{prefix}R{i}', phone='5512345678',
+                    is_authorized=rng.random() < 0.95,
+                    move_out_date=now.date() - timedelta(days=rng.randrange(1000)) if rng.random() < 0.2 else None,
+                )
+                for i in range(people)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        visitors = Visitor.objects.bulk_create(
+            (
+                Visitor(
+                    unit=rng.choice(units), first_name=f'Visitante {i}', last_name=prefix,
+                    document_id=f'{prefix}V{i}', phone='5512345678',
+                    expected_date=now.date() - timedelta(days=rng.randrange(365)),
+                    status=rng.choice(Visitor.Status.values),
+                    visitor_type=rng.choice(Visitor.VisitorType.values),
+                )
+                for i in range(people)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        # Mostly spent or expired codes, as after months of use
+        TemporaryCode.objects.bulk_create(
+            (
+                TemporaryCode(
+                    visitor=rng.choice(visitors), code=f'{prefix}{i:09d}',
+                    valid_until=now + timedelta(hours=rng.randrange(-24 * 365, 48)),
+                    is_active=rng.random() < 0.3,
+                )
+                for i in range(people * 2)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        points = AccessPoint.objects.bulk_create(
+            AccessPoint(name=f'Punto {prefix}{i}', code=f'{prefix}P{i}', building=buildings[i % 4])
+            for i in range(8)
+        )
+        AccessLog.objects.bulk_create(
+            (
+                AccessLog(
+                    access_point=rng.choice(points),
+                    resident=rng.choice(residents) if rng.random() < 0.6 else None,
+                    visitor=rng.choice(visitors) if rng.random() < 0.3 else None,
+                    access_type=rng.choice(AccessLog.AccessType.values),
+                    access_method=rng.choice(AccessLog.AccessMethod.values),
+                    status=rng.choices(AccessLog.Status.values, weights=[85, 13, 2])[0],
+                    timestamp=now - timedelta(seconds=rng.randrange(365 * 86400)),
+                )
+                for _ in range(rows)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        return {
+            'user': user,
+            'access_point': points[0].pk,
+            'resident': residents[0].pk,
+            'visitor': visitors[0].pk,
+            'unit': units[0].pk,
+            'building': buildings[0].pk,
+            'date_from': (now - timedelta(days=30)).date().isoformat(),
+            'date_to': now.date().isoformat(),
+        }
+
+    def analyze(self, connection):
+        """Refresh planner statistics so plans reflect the dataset"""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in (Building, Unit, Resident, Visitor, TemporaryCode, AccessPoint, AccessLog):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+            else:
+                cursor.execute('ANALYZE')
+
+    def cases(self, sample):
+        """
+        (viewset, url name, query params) of every filter combination
+
+        Filters listed together are combined in every way; single filters
+        are requested on their own.
+        """
+        endpoints = [
+            (AccessLogViewSet, 'access_logs:accesslog-list', {
+                'access_point': sample['access_point'],
+                'status': AccessLog.Status.DENIED,
+                'access_type': AccessLog.AccessType.ENTRY,
+                'date_from': sample['date_from'],
+                'date_to': sample['date_to'],
+            }, {'resident': sample['resident'], 'visitor': sample['visitor']}),
+            (TemporaryCodeViewSet, 'visitors:temporarycode-list', {
+                'visitor': sample['visitor'],
+                'is_active': 'true',
+            }, {}),
+            (ResidentViewSet, 'residents:resident-list', {
+                'unit': sample['unit'],
+                'is_active': 'true',
+            }, {'building': sample['building']}),
+            (VisitorViewSet, 'visitors:visitor-list', {
+                'status': Visitor.Status.APPROVED,
+                'visitor_type': Visitor.VisitorType.GUEST,
+                'unit': sample['unit'],
+            }, {}),
+        ]
+        for viewset, url_name, combined, single in endpoints:
+            names = list(combined)
+            # date_from and date_to are one range filter
+            groups = [name for name in names if name != 'date_to']
+            for size in range(len(groups) + 1):
+                for subset in itertools.combinations(groups, size):
+                    params = {name: str(combined[name]) for name in subset}
+                    if 'date_from' in params:
+                        params['date_to'] = str(combined['date_to'])
+                    yield viewset, url_name, params
+            for name, value in single.items():
+                yield viewset, url_name, {name: str(value)}
+
+    def request(self, viewset, url_name, params, user):
+        """Run a list request, returning the response and its statements"""
+        factory = APIRequestFactory()
+        request = factory.get(reverse(url_name), params)
+        force_authenticate(request, user=user)
+        view = viewset.as_view({'get': 'list'})
+        connection = connections[DEFAULT_DB_ALIAS]
+        with capture_queries(connection) as queries:
+            response = view(request)
+        if response.status_code != 200:
+            raise CommandError(f'{url_name} {params}: HTTP {response.status_code} {response.data}')
+        return response, queries
+
+    def check_endpoints(self, connection, sample, verbosity):
+        failures = []
+        checked = 0
+        user = sample['user']
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for viewset, url_name, params in self.cases(sample):
+                table = viewset.queryset.model._meta.db_table
+                response, queries = self.request(viewset, url_name, params, user)
+                pages = [(params, queries)]
+                # Keyset pages after the first add a (field, id) < cursor bound
+                following = response.data.get('next') if isinstance(response.data, dict) else None
+                if following and 'cursor=' in following:
+                    next_params = dict(parse_qsl(urlsplit(following).query))
+                    pages.append((next_params, self.request(viewset, url_name, next_params, user)[1]))
+
+                for page_params, statements in pages:
+                    for sql, sql_params in statements:
+                        # Page-number counts read every matching row whatever the
+                        # plan, and scanning is cheapest when most rows match
+                        if not sql.startswith('SELECT') or sql.startswith('SELECT COUNT(*)'):
+                            continue
+                        checked += 1
+                        scans = sequential_scans(connection, sql, sql_params, [table])
+                        label = f'{url_name} {page_params}'
+                        if scans:
+                            failures.append(f'  {label}: {", ".join(scans)}\n    {sql}')
+                        if verbosity >= 2:
+                            self.stdout.write(f'{"SEQ SCAN" if scans else "ok"}  {label}')
+                            if verbosity >= 3:
+                                self.stdout.write(f'    {explain(connection, sql, sql_params)}')
+        return failures, checked
@@ -0,0 +1,19 @@
+"""
+Management command to insert access logs left in the write-ahead journal
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.access_logs.writer import durable_journal_root, replay_journal
+
+
+class Command(BaseCommand):
+    help = (
+        'Insert access logs journaled in ACCESS_LOG_JOURNAL_DIR while the database was '
+        'unavailable; logs already stored are skipped'
+    )
+
+    def handle(self, *args, **kwargs):
+        if durable_journal_root() is None:
+            raise CommandError('ACCESS_LOG_JOURNAL_DIR is not set; there is no journal to replay')
+        replayed = replay_journal()
+        self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} journaled access logs'))
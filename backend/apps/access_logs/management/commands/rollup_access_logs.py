@@ -0,0 +1,42 @@
+"""
+Management command to update the hourly AccessLog rollups
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.access_logs.rollups import catch_up, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll up access logs created since the last run into hourly counts. '
+        'With --rebuild, recompute the rollups from the raw logs instead.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Recompute the rollups from the raw logs (backfill)'
+        )
+        parser.add_argument(
+            '--since', metavar='YYYY-MM-DD',
+            help='With --rebuild, only recompute hours from this date on'
+        )
+
+    def handle(self, *args, **options):
+        if not options['rebuild']:
+            if options['since']:
+                raise CommandError('--since requires --rebuild')
+            rolled_up = catch_up()
+            self.stdout.write(self.style.SUCCESS(f'Rolled up {rolled_up} new access logs'))
+            return
+
+        since = None
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                raise CommandError(f'Invalid date "{options["since"]}", expected YYYY-MM-DD')
+        rolled_up = rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups from {rolled_up} access logs'))
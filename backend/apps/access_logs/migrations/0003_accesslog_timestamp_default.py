@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_logs', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accesslog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text='When the access occurred'),
+        ),
+    ]
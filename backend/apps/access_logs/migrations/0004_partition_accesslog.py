@@ -0,0 +1,27 @@
+"""
+Range-partition access_logs_accesslog by month on PostgreSQL
+
+Other databases are left unchanged; see apps.access_logs.partitions.
+"""
+from django.db import migrations
+
+from apps.access_logs.partitions import partition_table, unpartition_table
+
+
+def partition(apps, schema_editor):
+    partition_table(schema_editor.connection)
+
+
+def unpartition(apps, schema_editor):
+    unpartition_table(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_logs', '0003_accesslog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
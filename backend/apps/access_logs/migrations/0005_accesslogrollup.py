@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_control', '0005_credential_versioning'),
+        ('access_logs', '0004_partition_accesslog'),
+        ('residents', '0002_initial'),
+        ('visitors', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessLogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour (UTC)')),
+                ('access_type', models.CharField(choices=[('ENTRY', 'Entry'), ('EXIT', 'Exit')], max_length=20)),
+                ('access_method', models.CharField(choices=[('QR_CODE', 'QR Code'), ('RFID', 'RFID Card'), ('NUMERIC_CODE', 'Numeric Code'), ('ALPHANUMERIC_CODE', 'Alphanumeric Code'), ('MANUAL', 'Manual Entry'), ('BIOMETRIC', 'Biometric'), ('OTHER', 'Other')], max_length=30)),
+                ('status', models.CharField(choices=[('SUCCESS', 'Success'), ('DENIED', 'Denied'), ('ERROR', 'Error')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Access Log Rollup',
+                'verbose_name_plural': 'Access Log Rollups',
+                'ordering': ['-hour'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AccessLogRollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('rolled_up_to', models.DateTimeField(null=True)),
+            ],
+            options={
+                'verbose_name': 'Access Log Rollup Watermark',
+                'verbose_name_plural': 'Access Log Rollup Watermarks',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='accesslog',
+            index=models.Index(fields=['created_at'], name='access_logs_created_35f0ee_idx'),
+        ),
+        migrations.AddField(
+            model_name='accesslogrollup',
+            name='access_point',
+            field=models.ForeignKey(help_text='Access point used', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='access_log_rollups', to='access_control.accesspoint'),
+        ),
+        migrations.AddConstraint(
+            model_name='accesslogrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'access_point', 'access_type', 'access_method', 'status'), name='unique_access_log_rollup'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+"""
+Search index for AccessLog: trigram GIN indexes on PostgreSQL, FTS5 on SQLite
+
+See utils.search.
+"""
+from django.db import migrations
+
+from utils.search import create_search_index, drop_search_index
+
+SEARCH_INDEX_FIELDS = ['person_name', 'person_document', 'code_used']
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor.connection, apps.get_model('access_logs', 'AccessLog'), SEARCH_INDEX_FIELDS)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection, apps.get_model('access_logs', 'AccessLog'), SEARCH_INDEX_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_logs', '0005_accesslogrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
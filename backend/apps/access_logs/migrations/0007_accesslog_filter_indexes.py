@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_control', '0005_credential_versioning'),
+        ('access_logs', '0006_accesslog_search_index'),
+        ('residents', '0004_resident_list_indexes'),
+        ('visitors', '0004_temporarycode_active_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='accesslog',
+            name='access_logs_timesta_9b4166_idx',
+        ),
+        migrations.AddIndex(
+            model_name='accesslog',
+            index=models.Index(fields=['-timestamp', '-id'], name='access_logs_timesta_5b93b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accesslog',
+            index=models.Index(fields=['access_point', 'status', 'access_type', '-timestamp'], name='access_logs_access__4f53d2_idx'),
+        ),
+    ]
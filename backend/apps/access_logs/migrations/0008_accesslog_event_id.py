@@ -0,0 +1,40 @@
+"""
+Idempotency key for AccessLog, used when replaying the write-ahead journal
+
+The unique constraint includes timestamp, the partition key on PostgreSQL.
+"""
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_logs', '0007_accesslog_filter_indexes'),
+    ]
+
+    operations = [
+        # Existing rows keep a NULL event_id: adding the column with the
+        # default would give every row the same UUID
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.AddField(
+                    model_name='accesslog',
+                    name='event_id',
+                    field=models.UUIDField(editable=False, null=True, help_text='Unique identifier of the access event'),
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='accesslog',
+                    name='event_id',
+                    field=models.UUIDField(default=uuid.uuid4, editable=False, null=True, help_text='Unique identifier of the access event'),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='accesslog',
+            constraint=models.UniqueConstraint(fields=('event_id', 'timestamp'), name='unique_access_log_event'),
+        ),
+    ]
@@ -1,8 +1,11 @@
 """
 Access Logs models for Access Control System
 """
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -121,7 +124,8 @@ class AccessLog(models.Model):
     
     # Metadata
     timestamp = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
+        editable=False,
         help_text=_('When the access occurred')
     )
     
@@ -173,6 +177,15 @@ class AccessLog(models.Model):
         help_text=_('Device identifier')
     )
     
+    # Idempotency key: set when the decision is made, so a log replayed
+    # from the write-ahead journal is never stored twice
+    event_id = models.UUIDField(
+        default=uuid.uuid4,
+        null=True,
+        editable=False,
+        help_text=_('Unique identifier of the access event')
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -180,12 +193,22 @@ class AccessLog(models.Model):
         verbose_name_plural = _('Access Logs')
         ordering = ['-timestamp']
         indexes = [
-            models.Index(fields=['-timestamp']),
+            models.Index(fields=['-timestamp', '-id']),
             models.Index(fields=['resident', '-timestamp']),
             models.Index(fields=['visitor', '-timestamp']),
             models.Index(fields=['access_point', '-timestamp']),
             models.Index(fields=['status', '-timestamp']),
+            # Access point dashboards filtering status and/or direction
+            models.Index(fields=['access_point', 'status', 'access_type', '-timestamp']),
+            models.Index(fields=['created_at']),
         ]
+        constraints = [
+            # Includes the partition key, as PostgreSQL requires
+            models.UniqueConstraint(fields=['event_id', 'timestamp'], name='unique_access_log_event'),
+        ]
+    
+    # Text fields served by the search index (see utils/search.py)
+    SEARCH_INDEX_FIELDS = ['person_name', 'person_document', 'code_used']
     
     def __str__(self):
         return f"{self.person_name} - {self.get_access_type_display()} at {self.timestamp}"
@@ -204,3 +227,75 @@ class AccessLog(models.Model):
     def is_exit(self):
         """Check if this is an exit log"""
         return self.access_type == self.AccessType.EXIT
+
+
+class AccessLogRollup(models.Model):
+    """
+    Hourly access counts per access point, type, method and status
+
+    Maintained from AccessLog by apps.access_logs.rollups. Counts are
+    additive, so long windows are summed from these rows instead of
+    counting raw logs.
+    """
+    
+    hour = models.DateTimeField(
+        help_text=_('Start of the hour (UTC)')
+    )
+    
+    access_point = models.ForeignKey(
+        'access_control.AccessPoint',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='access_log_rollups',
+        help_text=_('Access point used')
+    )
+    
+    access_type = models.CharField(
+        max_length=20,
+        choices=AccessLog.AccessType.choices
+    )
+    
+    access_method = models.CharField(
+        max_length=30,
+        choices=AccessLog.AccessMethod.choices
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=AccessLog.Status.choices
+    )
+    
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = _('Access Log Rollup')
+        verbose_name_plural = _('Access Log Rollups')
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'access_point', 'access_type', 'access_method', 'status'],
+                name='unique_access_log_rollup'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}h {self.access_type} {self.status}: {self.count}"
+
+
+class AccessLogRollupWatermark(models.Model):
+    """
+    Progress of the rollup catch-up
+
+    Every AccessLog created before rolled_up_to is counted in AccessLogRollup.
+    """
+    
+    name = models.CharField(max_length=50, primary_key=True)
+    
+    rolled_up_to = models.DateTimeField(null=True)
+    
+    class Meta:
+        verbose_name = _('Access Log Rollup Watermark')
+        verbose_name_plural = _('Access Log Rollup Watermarks')
+    
+    def __str__(self):
+        return f"{self.name}: {self.rolled_up_to}"
@@ -0,0 +1,282 @@
+"""
+Monthly partitions for the AccessLog table
+
+PostgreSQL: access_logs_accesslog is range-partitioned on timestamp, one
+partition per calendar month (UTC) plus a default partition for rows outside
+the pre-created range. Queries filtering on timestamp only scan the months
+they cover, and old months are removed by detaching or dropping their
+partition instead of running a DELETE.
+
+SQLite has no partitioning: closed months are moved out of the live table
+into per-month tables with the same names, which can then be dropped at once.
+
+Future partitions are created by `manage.py access_log_partitions`.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+TABLE = 'access_logs_accesslog'
+DEFAULT_PARTITION = f'{TABLE}_default'
+LEGACY_TABLE = f'{TABLE}_legacy'
+ID_SEQUENCE = f'{TABLE}_id_seq'
+PARTITION_PATTERN = re.compile(rf'^{TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+
+def month_start(value=None):
+    """First instant (UTC) of the month containing value (default: now)"""
+    value = (value or timezone.now()).astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    """Shift a month_start() value by count months"""
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    """Table name of a month's partition"""
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def _bound(month):
+    # Literal bound usable in DDL and in SQLite's text timestamps
+    return month.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def is_partitioned(connection):
+    """Whether the AccessLog table is a partitioned table"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(connection):
+    """
+    Monthly partitions (PostgreSQL) or month tables (SQLite)
+
+    Returns:
+        Dictionary of month_start() value -> table name, oldest first
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = to_regclass(%s)', [TABLE]
+            )
+        else:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s",
+                [f'{TABLE}_p%']
+            )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            month = datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)
+            partitions[month] = name
+    return dict(sorted(partitions.items()))
+
+
+def _rebuild_table(connection, partitioned, months_ahead=3):
+    """
+    Recreate the PostgreSQL AccessLog table, partitioned or not, keeping its
+    rows, sequence, constraints and indexes
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}')
+
+        # Index and key names are schema-wide: free them for the new table
+        cursor.execute(
+            "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')", [LEGACY_TABLE]
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s', [LEGACY_TABLE]
+        )
+        indexes = [
+            (name, definition) for name, definition in cursor.fetchall()
+            if name not in {constraint[0] for constraint in constraints}
+        ]
+        for name, kind, _ in constraints:
+            if kind in ('p', 'u'):
+                cursor.execute(
+                    f'ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT "{name}" TO "{name[:56]}_legacy"'
+                )
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"')
+
+        create = f'CREATE TABLE {TABLE} (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        if partitioned:
+            create += ' PARTITION BY RANGE ("timestamp")'
+        cursor.execute(create)
+
+        # Own the id sequence, continuing from the existing ids
+        cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'ALTER TABLE {LEGACY_TABLE} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(
+            "SELECT pg_get_serial_sequence(%s, 'id')", [LEGACY_TABLE]
+        )
+        legacy_sequence = cursor.fetchone()[0]
+        if legacy_sequence:
+            cursor.execute(
+                "SELECT a.attidentity FROM pg_attribute a "
+                "WHERE a.attrelid = %s::regclass AND a.attname = 'id'", [LEGACY_TABLE]
+            )
+            if cursor.fetchone()[0]:
+                cursor.execute(f'ALTER TABLE {LEGACY_TABLE} ALTER COLUMN id DROP IDENTITY')
+            else:
+                cursor.execute(f'DROP SEQUENCE {legacy_sequence}')
+        cursor.execute(f'CREATE SEQUENCE {ID_SEQUENCE} AS bigint OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{ID_SEQUENCE}')")
+        cursor.execute(
+            f"SELECT setval('{ID_SEQUENCE}', COALESCE((SELECT MAX(id) FROM {LEGACY_TABLE}), 0) + 1, false)"
+        )
+
+        # A partitioned table's primary key must include the partition key
+        primary_key = '(id, "timestamp")' if partitioned else '(id)'
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY {primary_key}')
+        for name, kind, definition in constraints:
+            if kind == 'f':
+                cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT "{name}" {definition}')
+        for name, definition in indexes:
+            definition = re.sub(rf' ON (ONLY )?(\S+\.)?{LEGACY_TABLE} ', f' ON {TABLE} ', definition)
+            cursor.execute(definition)
+
+        if partitioned:
+            cursor.execute(f'SELECT MIN("timestamp") FROM {LEGACY_TABLE}')
+            oldest = cursor.fetchone()[0]
+            month = month_start(oldest)
+            last = add_months(month_start(), months_ahead)
+            while month <= last:
+                cursor.execute(
+                    f'CREATE TABLE {partition_name(month)} PARTITION OF {TABLE} '
+                    f"FOR VALUES FROM ('{_bound(month)}+00') TO ('{_bound(add_months(month, 1))}+00')"
+                )
+                month = add_months(month, 1)
+            cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {LEGACY_TABLE}')
+        cursor.execute(f'DROP TABLE {LEGACY_TABLE}')
+
+
+def partition_table(connection, months_ahead=3):
+    """Convert the PostgreSQL AccessLog table to monthly partitions (no-op elsewhere)"""
+    if connection.vendor == 'postgresql' and not is_partitioned(connection):
+        _rebuild_table(connection, partitioned=True, months_ahead=months_ahead)
+
+
+def unpartition_table(connection):
+    """Convert a partitioned AccessLog table back to a plain table"""
+    if is_partitioned(connection):
+        _rebuild_table(connection, partitioned=False)
+
+
+def ensure_partitions(connection, months_ahead=3):
+    """
+    Create the partitions of the current and next months_ahead months
+
+    Rows that already landed in the default partition for a new month are
+    moved into it.
+
+    Returns:
+        List of the partition names created
+    """
+    if not is_partitioned(connection):
+        return []
+
+    existing = list_partitions(connection)
+    created = []
+    month = month_start()
+    for _ in range(months_ahead + 1):
+        if month not in existing:
+            name = partition_name(month)
+            start, end = f"'{_bound(month)}+00'", f"'{_bound(add_months(month, 1))}+00'"
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+                    f'WHERE "timestamp" >= {start} AND "timestamp" < {end} RETURNING *) '
+                    f'INSERT INTO {name} SELECT * FROM moved'
+                )
+                cursor.execute(
+                    f'ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})'
+                )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def _archive_sqlite_months(connection, before):
+    """Move whole months older than before out of the live SQLite table"""
+    archived = []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT DISTINCT substr("timestamp", 1, 7) FROM {TABLE} WHERE "timestamp" < %s',
+            [_bound(before)]
+        )
+        months = sorted(row[0] for row in cursor.fetchall())
+
+    for value in months:
+        month = datetime.strptime(value, '%Y-%m').replace(tzinfo=dt_timezone.utc)
+        name = partition_name(month)
+        bounds = [_bound(month), _bound(add_months(month, 1))]
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {name} AS SELECT * FROM {TABLE} WHERE 0')
+            cursor.execute(
+                f'INSERT INTO {name} SELECT * FROM {TABLE} WHERE "timestamp" >= %s AND "timestamp" < %s',
+                bounds
+            )
+            cursor.execute(f'DELETE FROM {TABLE} WHERE "timestamp" >= %s AND "timestamp" < %s', bounds)
+        archived.append(name)
+    return archived
+
+
+def detach_partitions(connection, before, drop=False):
+    """
+    Take every month ending on or before a cutoff out of the AccessLog table
+
+    On PostgreSQL the partitions are detached (kept as standalone tables) or
+    dropped, both without touching rows. On SQLite the months are first moved
+    into their per-month tables, then dropped if requested.
+
+    Args:
+        connection: Database connection
+        before: month_start() value; months older than it are removed
+        drop: Drop the tables instead of keeping them
+
+    Returns:
+        List of the table names detached or dropped
+    """
+    removed = []
+    if connection.vendor == 'sqlite':
+        removed = _archive_sqlite_months(connection, before)
+        if not drop:
+            return removed
+        partitions = list_partitions(connection)
+    elif is_partitioned(connection):
+        partitions = list_partitions(connection)
+    else:
+        return removed
+
+    for month, name in partitions.items():
+        if add_months(month, 1) > before:
+            continue
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+            if drop:
+                cursor.execute(f'DROP TABLE {name}')
+        if name not in removed:
+            removed.append(name)
+    return removed
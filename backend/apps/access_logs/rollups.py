@@ -0,0 +1,220 @@
+"""
+Hourly AccessLog rollups
+
+AccessLogRollup holds one count per hour, access point, access type, access
+method and status. catch_up() folds in the logs created since the watermark,
+aggregated in SQL, so each run costs one GROUP BY over the new rows whatever
+the size of the history. rebuild() recomputes rollups from raw logs with
+bulk inserts.
+
+Catch-up runs from `manage.py rollup_access_logs` (schedule it with cron)
+and, with ACCESS_LOG_WRITE_BEHIND on, from the background flusher after it
+writes a batch (at most every ACCESS_LOG_ROLLUP_INTERVAL seconds per
+worker). It never runs in the request that logged the scan. Logs are picked
+by created_at, not timestamp, so offline logs ingested late still land in the
+hour they happened. Logs created in the last ACCESS_LOG_ROLLUP_LAG seconds
+are left for the next run: their transactions may still be committing.
+
+count_by() reads a window from rollups plus the few raw logs they do not
+cover (the partial first hour and the rows after the watermark).
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Trunc, TruncHour
+from django.utils import timezone
+
+from .models import AccessLog, AccessLogRollup, AccessLogRollupWatermark
+
+WATERMARK_NAME = 'hourly'
+DIMENSIONS = ('access_point', 'access_type', 'access_method', 'status')
+
+# Rollup rows per INSERT when rebuilding
+REBUILD_BATCH_SIZE = 1000
+
+
+def hour_start(value):
+    """Start of the UTC hour containing value"""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _aggregate(logs):
+    """Hourly counts of a set of logs, as rollup field dicts"""
+    return (
+        logs.order_by()
+        .annotate(hour=TruncHour('timestamp', tzinfo=dt_timezone.utc))
+        .values('hour', *DIMENSIONS)
+        .annotate(count=Count('id'))
+    )
+
+
+def _apply(rows):
+    """Add aggregated counts to the rollups; callers hold the watermark lock"""
+    applied = 0
+    for row in rows:
+        count = row.pop('count')
+        updated = AccessLogRollup.objects.filter(**row).update(count=F('count') + count)
+        if not updated:
+            row['access_point_id'] = row.pop('access_point')
+            AccessLogRollup.objects.create(count=count, **row)
+        applied += count
+    return applied
+
+
+def _insert(rows):
+    """Write aggregated counts for hours that have no rollups; callers hold the watermark lock"""
+    rollups = []
+    for row in rows:
+        row['access_point_id'] = row.pop('access_point')
+        rollups.append(AccessLogRollup(**row))
+    AccessLogRollup.objects.bulk_create(rollups, batch_size=REBUILD_BATCH_SIZE)
+    return sum(rollup.count for rollup in rollups)
+
+
+def _lock_watermark():
+    watermark, _ = AccessLogRollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+    return AccessLogRollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+
+
+def catch_up():
+    """
+    Add the logs created since the watermark to the rollups
+
+    Returns:
+        Number of logs rolled up
+    """
+    upper = timezone.now() - timedelta(seconds=settings.ACCESS_LOG_ROLLUP_LAG)
+    with transaction.atomic():
+        watermark = _lock_watermark()
+        if watermark.rolled_up_to is not None and watermark.rolled_up_to >= upper:
+            return 0
+        logs = AccessLog.objects.filter(created_at__lt=upper)
+        if watermark.rolled_up_to is not None:
+            logs = logs.filter(created_at__gte=watermark.rolled_up_to)
+        applied = _apply(_aggregate(logs))
+        watermark.rolled_up_to = upper
+        watermark.save(update_fields=['rolled_up_to'])
+    return applied
+
+
+def rebuild(since=None):
+    """
+    Recompute the rollups from raw logs
+
+    Args:
+        since: Only recompute hours from this datetime on; older rollups are
+            kept, e.g. for months whose logs were dropped, and only get the
+            late logs not yet caught up added (default: all)
+
+    Returns:
+        Number of logs rolled up
+    """
+    upper = timezone.now() - timedelta(seconds=settings.ACCESS_LOG_ROLLUP_LAG)
+    with transaction.atomic():
+        watermark = _lock_watermark()
+        rollups = AccessLogRollup.objects.all()
+        logs = AccessLog.objects.filter(created_at__lt=upper)
+        pending = AccessLog.objects.none()
+        if since is not None:
+            since = hour_start(since)
+            rollups = rollups.filter(hour__gte=since)
+            # Offline logs uploaded since the last catch-up may belong to
+            # earlier hours; the watermark moves past them below
+            pending = logs.filter(timestamp__lt=since)
+            if watermark.rolled_up_to is not None:
+                pending = pending.filter(created_at__gte=watermark.rolled_up_to)
+            logs = logs.filter(timestamp__gte=since)
+        rollups.delete()
+        applied = _insert(_aggregate(logs)) + _apply(_aggregate(pending))
+        watermark.rolled_up_to = upper
+        watermark.save(update_fields=['rolled_up_to'])
+    return applied
+
+
+class CatchUpScheduler:
+    """
+    Runs catch_up() after log writes, at most once per interval per worker
+
+    Called from the write-behind flusher thread, never from a request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_run = 0.0
+
+    def logs_written(self):
+        """Note that logs were written; catch up if the interval has passed"""
+        interval = settings.ACCESS_LOG_ROLLUP_INTERVAL
+        if interval <= 0 or time.monotonic() - self._last_run < interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_run = time.monotonic()
+            catch_up()
+        except Exception:
+            # The next run or the rollup command picks these rows up
+            logging.getLogger(__name__).exception('Access log rollup catch-up failed')
+        finally:
+            self._lock.release()
+
+
+catch_up_scheduler = CatchUpScheduler()
+
+
+def window_sources(start):
+    """
+    Querysets that together count every log from start on, exactly once
+
+    Returns:
+        List of (queryset, time field, count expression)
+    """
+    first_hour = hour_start(start)
+    if first_hour < start:
+        first_hour += timedelta(hours=1)
+    rolled_up_to = (
+        AccessLogRollupWatermark.objects.filter(name=WATERMARK_NAME)
+        .values_list('rolled_up_to', flat=True).first()
+    )
+    tail = AccessLog.objects.filter(timestamp__gte=first_hour)
+    if rolled_up_to is not None:
+        tail = tail.filter(created_at__gte=rolled_up_to)
+    return [
+        (AccessLogRollup.objects.filter(hour__gte=first_hour), 'hour', Sum('count')),
+        (AccessLog.objects.filter(timestamp__gte=start, timestamp__lt=first_hour), 'timestamp', Count('id')),
+        (tail, 'timestamp', Count('id')),
+    ]
+
+
+def count_by(start, *fields, interval=None):
+    """
+    Count the logs from start on, grouped by fields
+
+    Args:
+        start: Aware datetime where the window begins
+        *fields: Fields shared by AccessLog and AccessLogRollup to group by
+            (e.g. 'status', 'access_point__name')
+        interval: Also group by period: 'hour' or 'day' (default: no period)
+
+    Returns:
+        Counter of tuple of field values (then period) -> count
+    """
+    counts = Counter()
+    for queryset, time_field, total in window_sources(start):
+        queryset = queryset.order_by()
+        group = fields
+        if interval:
+            queryset = queryset.annotate(period=Trunc(time_field, interval, tzinfo=timezone.get_current_timezone()))
+            group = (*fields, 'period')
+        if not group:
+            counts[()] += queryset.aggregate(count=total)['count'] or 0
+            continue
+        for row in queryset.values(*group).annotate(count=total):
+            counts[tuple(row[field] for field in group)] += row['count']
+    return counts
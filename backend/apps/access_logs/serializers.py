@@ -17,9 +17,9 @@ class AccessLogSerializer(serializers.ModelSerializer):
             'access_point', 'access_point_name', 'access_type', 'access_method',
             'code_used', 'temporary_code', 'access_code', 'status', 'denial_reason',
             'timestamp', 'vehicle_plate', 'temperature', 'photo', 'authorized_by',
-            'notes', 'ip_address', 'device_id', 'is_successful', 'created_at'
+            'notes', 'ip_address', 'device_id', 'is_successful', 'event_id', 'created_at'
         ]
-        read_only_fields = ['id', 'timestamp', 'created_at']
+        read_only_fields = ['id', 'timestamp', 'event_id', 'created_at']
 
 
 class AccessLogMinimalSerializer(serializers.ModelSerializer):
@@ -46,3 +46,43 @@ class AccessStatsSerializer(serializers.Serializer):
     by_access_method = serializers.DictField()
     by_access_point = serializers.DictField()
     recent_accesses = AccessLogMinimalSerializer(many=True)
+
+
+class AccessTimeseriesSerializer(serializers.Serializer):
+    """Serializer for one period of access counts"""
+    period = serializers.DateTimeField()
+    total = serializers.IntegerField()
+    successful = serializers.IntegerField()
+    denied = serializers.IntegerField()
+
+
+class AccessPointHeatmapSerializer(serializers.Serializer):
+    """Serializer for one access point's weekday x hour counts"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    total = serializers.IntegerField()
+    matrix = serializers.ListField(child=serializers.ListField(child=serializers.IntegerField()))
+
+
+class AccessHeatmapSerializer(serializers.Serializer):
+    """Serializer for the traffic heatmap"""
+    timezone = serializers.CharField()
+    days = serializers.IntegerField()
+    weekdays = serializers.ListField(child=serializers.CharField())
+    all = serializers.ListField(child=serializers.ListField(child=serializers.IntegerField()))
+    access_points = AccessPointHeatmapSerializer(many=True)
+
+
+class DenialAlertSerializer(serializers.Serializer):
+    """Serializer for a denial-rate alert"""
+    scope = serializers.ChoiceField(choices=['access_point', 'device'])
+    key = serializers.CharField()
+    access_point_id = serializers.IntegerField(allow_null=True)
+    window_seconds = serializers.IntegerField()
+    denied = serializers.IntegerField()
+    total = serializers.IntegerField()
+    denial_rate = serializers.FloatField()
+    baseline_rate = serializers.FloatField()
+    z_score = serializers.FloatField()
+    first_flagged_at = serializers.DateTimeField()
+    last_flagged_at = serializers.DateTimeField()
@@ -0,0 +1,16 @@
+"""
+Signals for Access Logs app
+"""
+from django.dispatch import Signal, receiver
+
+from .anomalies import anomaly_detector
+
+# Sent by the log writer once AccessLog rows are in the database.
+# Arguments: logs (list of AccessLog)
+access_logged = Signal()
+
+
+@receiver(access_logged)
+def detect_denial_anomalies(sender, logs, **kwargs):
+    """Feed new logs to the denial-rate anomaly detector"""
+    anomaly_detector.logs_written(logs)
@@ -1,3 +1,601 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import math
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.access_control.models import AccessPoint
+from apps.users.models import CustomUser
+from utils.journal import read_segment
+from . import anomalies, archive, export, partitions, rollups, writer
+from .models import AccessLog, AccessLogRollup
+from .partitions import add_months, month_start
+
+
+class LogTestCase(TestCase):
+    """The main gate, the garage and a guard's API client"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.point = AccessPoint.objects.create(name='Puerta Principal', code='MAIN')
+        cls.garage = AccessPoint.objects.create(name='Garaje', code='GAR')
+        cls.guard = CustomUser.objects.create_user(username='guardia', password='x')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.guard)
+
+
+class PartitionTests(TestCase):
+    """Old months leave the live table whole"""
+
+    def setUp(self):
+        self.now = month_start()
+        AccessLog.objects.bulk_create(
+            AccessLog(person_name=f'Persona {months}', timestamp=add_months(self.now, -months) + timedelta(days=1, hours=n))
+            for months in range(4) for n in range(3)
+        )
+
+    def test_month_arithmetic(self):
+        december = month_start(datetime(2025, 12, 31, 23, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(december, datetime(2025, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(december, 1), datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(december, -12), datetime(2024, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.partition_name(december), 'access_logs_accesslog_p2025_12')
+
+    def test_detach_and_drop_old_months(self):
+        cutoff = add_months(self.now, -1)
+        call_command('access_log_partitions', detach_before=f'{cutoff:%Y-%m}', stdout=StringIO())
+
+        self.assertEqual(list(partitions.list_partitions(connection)), [add_months(self.now, -3), add_months(self.now, -2)])
+        self.assertEqual(AccessLog.objects.count(), 6)
+        self.assertFalse(AccessLog.objects.filter(timestamp__lt=cutoff).exists())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {partitions.partition_name(add_months(self.now, -2))}')
+            self.assertEqual(cursor.fetchone()[0], 3)
+
+        call_command('access_log_partitions', drop_before=f'{self.now:%Y-%m}', stdout=StringIO())
+        self.assertEqual(partitions.list_partitions(connection), {})
+        self.assertEqual(AccessLog.objects.count(), 3)
+
+
+@override_settings(ACCESS_STATS_CACHE_TTL=0)
+class StatsTests(LogTestCase):
+    """Stats read from rollups match counting the raw logs"""
+
+    def setUp(self):
+        super().setUp()
+        points = [self.point, self.garage]
+        now = timezone.now()
+        AccessLog.objects.bulk_create(
+            AccessLog(
+                access_point=points[n % 2] if n % 5 else None,
+                access_type=AccessLog.AccessType.ENTRY if n % 3 else AccessLog.AccessType.EXIT,
+                access_method=AccessLog.AccessMethod.values[n % len(AccessLog.AccessMethod.values)],
+                status=AccessLog.Status.values[n % len(AccessLog.Status.values)],
+                timestamp=now - timedelta(hours=n * 1.3 + 0.25),
+            )
+            for n in range(200)
+        )
+
+    def expected(self, days):
+        logs = AccessLog.objects.filter(timestamp__gte=timezone.now() - timedelta(days=days))
+        return {
+            'total_accesses': logs.count(),
+            'successful_accesses': logs.filter(status=AccessLog.Status.SUCCESS).count(),
+            'denied_accesses': logs.filter(status=AccessLog.Status.DENIED).count(),
+            'entries': logs.filter(access_type=AccessLog.AccessType.ENTRY).count(),
+            'exits': logs.filter(access_type=AccessLog.AccessType.EXIT).count(),
+            'by_access_method': {
+                method: logs.filter(access_method=method).count()
+                for method in set(logs.values_list('access_method', flat=True))
+            },
+            # Logs without an access point are listed under 'None'
+            'by_access_point': {
+                str(name): logs.filter(access_point__name=name).count() if name else logs.filter(access_point=None).count()
+                for name in set(logs.values_list('access_point__name', flat=True))
+            },
+        }
+
+    def assert_exact(self):
+        for days in (1, 7, 30):
+            data = self.client.get('/api/logs/stats/', {'days': days}).data
+            with self.subTest(days=days):
+                self.assertEqual({key: data[key] for key in self.expected(days)}, self.expected(days))
+
+    def test_counts_match_raw_logs(self):
+        # Raw logs only, then rollups, then rollups plus newer logs
+        self.assert_exact()
+        with override_settings(ACCESS_LOG_ROLLUP_LAG=0):
+            rollups.rebuild()
+        self.assertTrue(AccessLogRollup.objects.exists())
+        self.assert_exact()
+        AccessLog.objects.create(person_name='Tarde', status=AccessLog.Status.DENIED)
+        self.assert_exact()
+
+
+@override_settings(ACCESS_LOG_ROLLUP_LAG=0)
+class RollupTests(LogTestCase):
+    """Incremental catch-ups add up to a full rebuild"""
+
+    def rollup_rows(self):
+        return sorted(AccessLogRollup.objects.values_list('hour', 'access_point', 'access_type', 'access_method', 'status', 'count'))
+
+    def test_catch_up_matches_rebuild(self):
+        now = timezone.now()
+        for batch in range(3):
+            AccessLog.objects.bulk_create(
+                AccessLog(
+                    access_point=self.point if n % 2 else None,
+                    status=AccessLog.Status.DENIED if n % 3 == 0 else AccessLog.Status.SUCCESS,
+                    # Late uploads land in the hour they happened
+                    timestamp=now - timedelta(hours=n * 5 + batch),
+                )
+                for n in range(20)
+            )
+            self.assertEqual(rollups.catch_up(), 20)
+        self.assertEqual(rollups.catch_up(), 0)
+        incremental = self.rollup_rows()
+
+        self.assertEqual(rollups.rebuild(), 60)
+        self.assertEqual(self.rollup_rows(), incremental)
+        self.assertEqual(sum(row[-1] for row in incremental), 60)
+
+    def test_rebuild_inserts_in_bulk(self):
+        now = timezone.now()
+        AccessLog.objects.bulk_create(
+            AccessLog(person_name=f'Visita {n}', timestamp=now - timedelta(hours=n)) for n in range(50)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(rollups.rebuild(), 50)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "access_logs_accesslogrollup"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(AccessLogRollup.objects.count(), 50)
+
+    def test_partial_rebuild_keeps_late_logs(self):
+        now = timezone.now()
+        AccessLog.objects.create(person_name='Temprano', timestamp=now - timedelta(hours=10))
+        rollups.catch_up()
+        # Uploaded by an offline controller after the catch-up
+        AccessLog.objects.create(person_name='Sin conexión', timestamp=now - timedelta(hours=10))
+        AccessLog.objects.create(person_name='Reciente', timestamp=now)
+
+        self.assertEqual(rollups.rebuild(since=now - timedelta(hours=2)), 2)
+        self.assertEqual(sum(row[-1] for row in self.rollup_rows()), 3)
+        self.assertEqual(rollups.catch_up(), 0)
+
+
+@override_settings(ACCESS_LOG_EXPORT_CHUNK_SIZE=3)
+class ExportTests(LogTestCase):
+    """Exports parse back to the rows they were made from"""
+
+    def setUp(self):
+        super().setUp()
+        point = AccessPoint.objects.create(name='Puerta "Norte", Torre B', code='NORTH')
+        now = timezone.now()
+        names = ['Ana Gómez', 'O\'Brien, "Jr."', 'Línea\nnueva', 'Tab\there', '']
+        AccessLog.objects.bulk_create(
+            AccessLog(
+                access_point=point if n % 2 else None,
+                person_name=names[n % len(names)],
+                status=AccessLog.Status.DENIED if n % 3 == 0 else AccessLog.Status.SUCCESS,
+                temperature=Decimal('36.5') if n % 4 == 0 else None,
+                ip_address='10.0.0.1' if n % 2 else None,
+                timestamp=now - timedelta(minutes=n),
+            )
+            for n in range(10)
+        )
+
+    def export(self, **params):
+        response = self.client.get('/api/logs/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content), response
+
+    def expected(self, **filters):
+        return [
+            {
+                'id': log.id,
+                'timestamp': log.timestamp,
+                'person_name': log.person_name,
+                'access_point_name': log.access_point.name if log.access_point else None,
+                'status': log.status,
+                'temperature': log.temperature,
+                'ip_address': log.ip_address,
+            }
+            for log in AccessLog.objects.filter(**filters).order_by('-timestamp', '-id')
+        ]
+
+    def test_ndjson(self):
+        content, response = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = content.decode('utf-8').splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(list(rows[0]), list(export.EXPORT_COLUMNS))
+        self.assertEqual(
+            [
+                {
+                    'id': row['id'], 'timestamp': datetime.fromisoformat(row['timestamp']),
+                    'person_name': row['person_name'], 'access_point_name': row['access_point_name'],
+                    'status': row['status'], 'ip_address': row['ip_address'],
+                    'temperature': Decimal(row['temperature']) if row['temperature'] else None,
+                }
+                for row in rows
+            ],
+            self.expected()
+        )
+
+    def test_csv_with_filters(self):
+        content, response = self.export(type='csv', status='DENIED')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        reader = csv.DictReader(io.StringIO(content.decode('utf-8'), newline=''))
+        self.assertEqual(reader.fieldnames, list(export.EXPORT_COLUMNS))
+        self.assertEqual(
+            [
+                {
+                    'id': int(row['id']), 'timestamp': datetime.fromisoformat(row['timestamp']),
+                    'person_name': row['person_name'], 'access_point_name': row['access_point_name'] or None,
+                    'status': row['status'], 'ip_address': row['ip_address'] or None,
+                    'temperature': Decimal(row['temperature']) if row['temperature'] else None,
+                }
+                for row in reader
+            ],
+            self.expected(status='DENIED')
+        )
+
+    def test_gzip(self):
+        plain, _ = self.export(type='csv')
+        compressed, response = self.export(type='csv', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.csv.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+    def test_unknown_type_is_rejected(self):
+        self.assertEqual(self.client.get('/api/logs/export/', {'type': 'xml'}).status_code, 400)
+
+
+class HeatmapTests(LogTestCase):
+    """Logs land in the weekday and hour of TIME_ZONE they happened in"""
+
+    def setUp(self):
+        super().setUp()
+        self.main = self.point
+        today = timezone.localdate()
+        monday = today - timedelta(days=today.weekday() + 7)
+
+        def at(day, hour, minute=30):
+            return timezone.make_aware(datetime(day.year, day.month, day.day, hour, minute))
+
+        AccessLog.objects.bulk_create(
+            [AccessLog(access_point=self.main, timestamp=at(monday, 9)) for _ in range(3)]
+            + [AccessLog(access_point=self.main, timestamp=at(monday, 9, 59), status=AccessLog.Status.DENIED)]
+            # Sunday night locally, Monday morning in UTC
+            + [AccessLog(access_point=self.garage, timestamp=at(monday - timedelta(days=1), 23)) for _ in range(2)]
+            + [AccessLog(access_point=None, timestamp=at(monday, 10))]
+        )
+
+    def heatmap(self, **params):
+        response = self.client.get('/api/logs/heatmap/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_are_binned_in_local_time(self):
+        data = self.heatmap()
+        self.assertEqual(data['all'][0][9], 4)
+        self.assertEqual(data['all'][6][23], 2)
+        self.assertEqual(sum(map(sum, data['all'])), 6)
+        points = {point['id']: point for point in data['access_points']}
+        self.assertEqual(points[self.main.id]['total'], 4)
+        self.assertEqual(points[self.garage.id]['matrix'][6][23], 2)
+
+        self.assertEqual(self.heatmap(status='DENIED')['all'][0][9], 1)
+        filtered = self.heatmap(access_point=self.garage.id)
+        self.assertEqual([point['id'] for point in filtered['access_points']], [self.garage.id])
+
+        # Same bins once the hours are read from the rollups
+        with override_settings(ACCESS_LOG_ROLLUP_LAG=-60):
+            rollups.rebuild()
+        self.assertEqual(self.heatmap(), data)
+
+    def test_access_point_must_be_an_integer(self):
+        response = self.client.get('/api/logs/heatmap/', {'access_point': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ANOMALY_WINDOW=300, ANOMALY_MIN_DENIALS=10, ANOMALY_Z_THRESHOLD=4.0)
+class AnomalyTests(LogTestCase):
+    """Denial spikes are flagged against each series' own baseline"""
+
+    def setUp(self):
+        super().setUp()
+        cache.delete(anomalies.ALERTS_CACHE_KEY)
+        self.detector = anomalies.DenialAnomalyDetector()
+        self.start = 1_700_000_000.0
+
+    def feed(self, access_point_id, device, buckets, scans, denied, offset=0):
+        """scans per 30 s bucket, denied of them, for a number of buckets"""
+        for bucket in range(buckets):
+            now = self.start + (offset + bucket) * anomalies.BUCKET_SECONDS
+            self.detector.observe(access_point_id, device, False, count=scans - denied, now=now)
+            self.detector.observe(access_point_id, device, True, count=denied, now=now)
+
+    def alerts(self):
+        return {(alert['scope'], alert['key']): alert for alert in anomalies.active_alerts()}
+
+    def test_spike_over_baseline_is_flagged(self):
+        # Two hours at a 10% denial rate, then a reader starts failing
+        self.feed(1, 'reader-1', 240, scans=20, denied=2)
+        self.assertEqual(self.alerts(), {})
+        self.feed(1, 'reader-1', 2, scans=20, denied=20, offset=240)
+
+        alerts = self.alerts()
+        self.assertEqual(set(alerts), {('access_point', '1'), ('device', 'reader-1')})
+        alert = alerts[('device', 'reader-1')]
+        window = 10 * 20
+        # Ring of 10 buckets: 8 normal ones and the 2 failing ones
+        denied, total, rate = 8 * 2 + 2 * 20, window, alert['baseline_rate']
+        self.assertEqual((alert['denied'], alert['total']), (denied, total))
+        self.assertAlmostEqual(rate, 0.1, places=2)
+        self.assertAlmostEqual(
+            alert['z_score'], (denied - total * rate) / math.sqrt(total * rate * (1 - rate)), delta=0.05
+        )
+        self.assertGreaterEqual(alert['z_score'], 4.0)
+
+    def test_steady_high_denial_rate_is_not_flagged(self):
+        # A gate that always denies half its scans: alarming against the prior
+        # while it warms up, normal once it has a 50% baseline
+        self.feed(2, 'reader-2', 240, scans=20, denied=10)
+        cache.delete(anomalies.ALERTS_CACHE_KEY)
+        self.feed(2, 'reader-2', 10, scans=20, denied=11, offset=240)
+        self.assertEqual(self.alerts(), {})
+
+    def test_few_denials_are_not_flagged(self):
+        # A quiet reader: 9 denials of 9 scans stay under ANOMALY_MIN_DENIALS
+        self.feed(3, 'reader-3', 9, scans=1, denied=1)
+        self.assertEqual(self.alerts(), {})
+        self.feed(3, 'reader-3', 1, scans=1, denied=1, offset=9)
+        self.assertEqual(self.alerts()[('device', 'reader-3')]['denied'], 10)
+
+    def test_alerts_endpoint_filters_by_scope(self):
+        self.feed(4, 'reader-4', 2, scans=20, denied=20)
+        response = self.client.get('/api/logs/alerts/', {'scope': 'device'})
+        self.assertEqual([(alert['scope'], alert['key']) for alert in response.data], [('device', 'reader-4')])
+        response = self.client.get('/api/logs/alerts/', {'access_point': 4})
+        self.assertEqual(len(response.data), 2)
+
+
+class QueryPlanTests(TestCase):
+    """List endpoints keep using indexes as the tables grow"""
+
+    def test_list_filters_avoid_sequential_scans(self):
+        out = StringIO()
+        call_command('check_query_plans', rows=5000, stdout=out)
+        self.assertIn('no sequential scans', out.getvalue())
+
+    def test_missing_index_is_reported(self):
+        timestamp_index = next(index for index in AccessLog._meta.indexes if index.fields == ['-timestamp', '-id'])
+        # Rolled back with the test
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX "{timestamp_index.name}"')
+
+        with self.assertRaisesMessage(CommandError, 'access_logs_accesslog'):
+            call_command('check_query_plans', rows=5000, stdout=StringIO())
+
+
+class ArchiveTests(LogTestCase):
+    """Archived months leave the table but stay listed"""
+
+    def setUp(self):
+        super().setUp()
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        now = timezone.now()
+        AccessLog.objects.bulk_create(
+            AccessLog(
+                access_point=self.point if day % 3 else None,
+                person_name=f'Persona {day % 7}',
+                status=AccessLog.Status.DENIED if day % 4 == 0 else AccessLog.Status.SUCCESS,
+                timestamp=now - timedelta(days=day, minutes=day % 2),
+            )
+            for day in range(0, 200) for _ in range(2)
+        )
+
+    def list_ids(self, **params):
+        ids = []
+        response = self.client.get('/api/logs/', {'page_size': 15, **params})
+        while True:
+            ids += [log['id'] for log in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def export(self, **params):
+        return b''.join(self.client.get('/api/logs/export/', params).streaming_content)
+
+    def test_archived_logs_are_still_listed(self):
+        cases = [{}, {'status': 'DENIED'}, {'access_point': self.point.id, 'date_from': '2000-01-01'}]
+        expected = [self.list_ids(**params) for params in cases]
+        before = add_months(month_start(), -2)
+
+        with override_settings(ACCESS_LOG_ARCHIVE_DIR=self.archive_dir):
+            call_command('archive_access_logs', before=f'{before:%Y-%m}', stdout=StringIO())
+
+            self.assertFalse(AccessLog.objects.filter(timestamp__lt=before).exists())
+            self.assertEqual(
+                sum(month.rows for month in archive.archived_months().values()),
+                400 - AccessLog.objects.count()
+            )
+            for params, ids in zip(cases, expected):
+                self.assertEqual(self.list_ids(**params), ids)
+
+    def test_archive_dir_must_be_persistent(self):
+        before = f'{add_months(month_start(), -2):%Y-%m}'
+        for archive_dir in (None, str(Path(settings.BASE_DIR) / 'var' / 'access_log_archive')):
+            with override_settings(ACCESS_LOG_ARCHIVE_DIR=archive_dir):
+                with self.assertRaisesMessage(CommandError, 'ACCESS_LOG_ARCHIVE_DIR'):
+                    call_command('archive_access_logs', before=before, stdout=StringIO())
+        self.assertEqual(AccessLog.objects.count(), 400)
+
+    def test_export_includes_archived_months(self):
+        before = add_months(month_start(), -2)
+
+        with override_settings(ACCESS_LOG_ARCHIVE_DIR=self.archive_dir, ACCESS_LOG_EXPORT_CHUNK_SIZE=7):
+            expected = self.export(status='DENIED')
+            call_command('archive_access_logs', before=f'{before:%Y-%m}', stdout=StringIO())
+            self.assertFalse(AccessLog.objects.filter(timestamp__lt=before).exists())
+            self.assertEqual(self.export(status='DENIED'), expected)
+
+            # Archived months have no search index
+            response = self.client.get('/api/logs/export/', {'search': 'Persona'})
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get('/api/logs/export/', {'search': 'Persona', 'date_from': f'{month_start():%Y-%m-%d}'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_interrupted_archive_is_finished_by_next_run(self):
+        month = add_months(month_start(), -3)
+        expected = self.list_ids()
+        in_month = AccessLog.objects.filter(timestamp__gte=month, timestamp__lt=add_months(month, 1)).count()
+
+        with override_settings(ACCESS_LOG_ARCHIVE_DIR=self.archive_dir):
+            # Rolled back: the rows stay and the staged files go
+            with mock.patch.object(archive, '_remove_live_rows', side_effect=OperationalError('lost connection')):
+                with self.assertRaises(OperationalError):
+                    archive.archive_month(month)
+            self.assertEqual(list(Path(self.archive_dir).iterdir()), [])
+
+            # Committed, then stopped before the files took their place
+            with mock.patch.object(archive, '_promote', side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    archive.archive_month(month)
+            self.assertNotIn(month, archive.archived_months())
+
+            self.assertEqual(archive.archive_month(month), 0)
+            self.assertEqual(archive.archived_months()[month].rows, in_month)
+            self.assertEqual(self.list_ids(), expected)
+
+
+class JournalTests(LogTestCase):
+    """Logs survive a database outage through the write-ahead journal"""
+
+    def setUp(self):
+        super().setUp()
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        settings_override = override_settings(ACCESS_LOG_JOURNAL_DIR=journal_dir, ACCESS_LOG_WRITE_BEHIND=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(writer.journal.seal)
+        replayer = mock.patch.object(writer, 'replayer', writer.JournalReplayer())
+        self.replayer = replayer.start()
+        self.addCleanup(replayer.stop)
+
+    def make_logs(self, count):
+        return [
+            AccessLog(access_point=self.point, person_name=f'Persona {i}', access_method=AccessLog.AccessMethod.RFID)
+            for i in range(count)
+        ]
+
+    def test_journal_dir_must_be_persistent(self):
+        for journal_dir in (None, str(Path(settings.BASE_DIR) / 'var' / 'access_log_journal')):
+            with override_settings(ACCESS_LOG_JOURNAL_DIR=journal_dir, ACCESS_LOG_WRITE_BEHIND=True):
+                with self.assertRaisesMessage(ImproperlyConfigured, 'ACCESS_LOG_JOURNAL_DIR'):
+                    writer.durable_journal_root()
+        self.assertEqual(writer.durable_journal_root(), writer.journal.directory)
+
+    @override_settings(ACCESS_LOG_JOURNAL_DIR=None)
+    def test_inline_write_without_journal_fails_with_database(self):
+        self.assertIsNone(writer.durable_journal_root())
+        with mock.patch.object(writer, 'insert_logs', side_effect=OperationalError('server closed the connection')):
+            with self.assertRaises(OperationalError):
+                writer.write_logs(self.make_logs(1))
+
+    def test_outage_is_journaled_and_replayed_once(self):
+        with mock.patch.object(writer, 'insert_logs', side_effect=OperationalError('server closed the connection')) as insert:
+            writer.write_logs(self.make_logs(3))
+            # Not retried until ACCESS_LOG_JOURNAL_RETRY has passed
+            writer.write_logs(self.make_logs(2))
+        self.assertEqual(insert.call_count, 1)
+        self.assertFalse(AccessLog.objects.exists())
+        self.assertTrue(writer.journal.pending())
+
+        self.assertEqual(writer.replay_journal(), 5)
+        self.assertEqual(AccessLog.objects.count(), 5)
+        self.assertFalse(writer.journal.pending())
+
+    def test_replay_skips_logs_already_stored(self):
+        logs = self.make_logs(4)
+        writer.journal_logs(logs)
+        # As if a replay had crashed after inserting, before deleting the segment
+        AccessLog.objects.bulk_create([
+            AccessLog(access_point=self.point, person_name=log.person_name, access_method=log.access_method,
+                      timestamp=log.timestamp, event_id=log.event_id)
+            for log in logs[:2]
+        ])
+
+        writer.replay_journal()
+        self.assertEqual(AccessLog.objects.count(), 4)
+        self.assertEqual(
+            set(AccessLog.objects.values_list('event_id', flat=True)), {log.event_id for log in logs}
+        )
+
+    def test_torn_record_ends_segment(self):
+        writer.journal_logs(self.make_logs(2))
+        writer.journal_logs(self.make_logs(3))
+        writer.journal.seal()
+        segment = next(Path(writer.journal.directory).iterdir())
+        segment.write_bytes(segment.read_bytes()[:-5])
+
+        self.assertEqual(len(read_segment(segment)), 2)
+
+
+class WriteBehindTests(TransactionTestCase):
+    """The background flusher never drops rows silently"""
+
+    def test_rejected_row_is_isolated_and_logged(self):
+        point = AccessPoint.objects.create(name='Puerta Principal', code='MAIN')
+        stored = AccessLog.objects.create(access_point=point, person_name='Persona 1')
+        duplicate = AccessLog(
+            access_point=point, person_name='Persona 1', event_id=stored.event_id, timestamp=stored.timestamp
+        )
+        batch = [AccessLog(access_point=point, person_name=f'Persona {i}') for i in range(2, 4)] + [duplicate]
+
+        with self.assertLogs('apps.access_logs.writer', 'ERROR') as logs:
+            writer.WriteBehindLogWriter()._write_batch(batch)
+
+        self.assertEqual(AccessLog.objects.count(), 3)
+        self.assertIn(str(stored.event_id), logs.output[0])
+
+    @override_settings(ACCESS_LOG_ROLLUP_INTERVAL=1)
+    def test_rollups_catch_up_off_the_request(self):
+        point = AccessPoint.objects.create(name='Puerta Principal', code='MAIN')
+        with mock.patch.object(writer, 'catch_up_scheduler', rollups.CatchUpScheduler()), \
+                mock.patch.object(rollups, 'catch_up') as catch_up:
+            writer.insert_logs([AccessLog(access_point=point, person_name='Persona 1')])
+            catch_up.assert_not_called()
+
+            flusher = writer.WriteBehindLogWriter()
+            self.addCleanup(flusher.stop)
+            flusher.enqueue([AccessLog(access_point=point, person_name='Persona 2')])
+            deadline = time.monotonic() + 5
+            while not catch_up.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        catch_up.assert_called_once_with()
+        self.assertEqual(AccessLog.objects.count(), 2)
@@ -4,12 +4,66 @@ Views for Access Logs app
 from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.db.models import Count, Q
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta, timezone as dt_timezone
 
+from . import archive
+from .anomalies import active_alerts
+from .export import CONTENT_TYPES, stream_logs
+from .heatmap import traffic_heatmap
 from .models import AccessLog
-from .serializers import AccessLogSerializer, AccessLogMinimalSerializer, AccessStatsSerializer
+from .rollups import count_by
+from .serializers import (
+    AccessLogSerializer, AccessLogMinimalSerializer, AccessStatsSerializer, AccessTimeseriesSerializer,
+    AccessHeatmapSerializer, DenialAlertSerializer
+)
+from utils.pagination import KeysetPagination
+from utils.search import IndexedSearchFilter
+
+STATS_CACHE_KEY = 'access_logs:stats:{}:{}'
+
+# List query parameter -> AccessLog lookup
+LIST_FILTERS = {
+    'resident': 'resident_id',
+    'visitor': 'visitor_id',
+    'access_point': 'access_point_id',
+    'access_type': 'access_type',
+    'status': 'status',
+}
+
+
+def parse_date_bound(value, end=False):
+    """
+    Parse a date_from/date_to query value into a timestamp lookup
+
+    Args:
+        value: ISO date or datetime string
+        end: Whether the value is an upper bound; a bare date then covers
+            the whole day
+
+    Returns:
+        Dictionary of timestamp lookup -> aware datetime, empty if value is
+        not a valid date
+    """
+    try:
+        day = parse_date(value) if len(value) <= 10 else None
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        return {}
+    if day is not None:
+        if end:
+            return {'timestamp__lt': timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))}
+        moment = datetime.combine(day, time.min)
+    if moment is None:
+        return {}
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return {'timestamp__lte' if end else 'timestamp__gte': moment}
 
 
 class AccessLogViewSet(viewsets.ReadOnlyModelViewSet):
@@ -18,92 +72,237 @@ class AccessLogViewSet(viewsets.ReadOnlyModelViewSet):
         'resident', 'visitor', 'access_point', 'authorized_by'
     ).all()
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, IndexedSearchFilter]
     search_fields = ['person_name', 'person_document', 'code_used']
     ordering_fields = ['timestamp', 'created_at']
     ordering = ['-timestamp']
+    pagination_class = KeysetPagination
+    keyset_fields = ('timestamp',)
     
     def get_serializer_class(self):
         if self.action == 'list':
             return AccessLogMinimalSerializer
         return AccessLogSerializer
     
+    def get_list_lookups(self):
+        """
+        Lookups of the list filters (resident, visitor, access_point,
+        access_type, status, date_from, date_to), understood by both the
+        queryset and the archive
+        """
+        params = self.request.query_params
+        lookups = {}
+        for param, lookup in LIST_FILTERS.items():
+            value = params.get(param, None)
+            if value:
+                lookups[lookup] = value
+        # Compared as datetimes so PostgreSQL only scans the months they span
+        if params.get('date_from', None):
+            lookups.update(parse_date_bound(params['date_from']))
+        if params.get('date_to', None):
+            lookups.update(parse_date_bound(params['date_to'], end=True))
+        return lookups
+    
     def get_queryset(self):
-        queryset = super().get_queryset()
-        
-        # Filters
-        resident_id = self.request.query_params.get('resident', None)
-        visitor_id = self.request.query_params.get('visitor', None)
-        access_point_id = self.request.query_params.get('access_point', None)
-        access_type = self.request.query_params.get('access_type', None)
-        status = self.request.query_params.get('status', None)
-        date_from = self.request.query_params.get('date_from', None)
-        date_to = self.request.query_params.get('date_to', None)
-        
-        if resident_id:
-            queryset = queryset.filter(resident_id=resident_id)
-        if visitor_id:
-            queryset = queryset.filter(visitor_id=visitor_id)
-        if access_point_id:
-            queryset = queryset.filter(access_point_id=access_point_id)
-        if access_type:
-            queryset = queryset.filter(access_type=access_type)
-        if status:
-            queryset = queryset.filter(status=status)
-        if date_from:
-            queryset = queryset.filter(timestamp__gte=date_from)
-        if date_to:
-            queryset = queryset.filter(timestamp__lte=date_to)
-        
-        return queryset
+        return super().get_queryset().filter(**self.get_list_lookups())
+    
+    def get_extra_keyset_rows(self, cursor, reverse, limit):
+        """Archived logs matching the list filters, merged into its pages"""
+        if self.action != 'list':
+            return []
+        position = cursor['key'] if cursor else None
+        return archive.search(self.get_list_lookups(), limit, position, reverse)
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get access statistics"""
         # Date range filter
         days = int(request.query_params.get('days', 7))
-        start_date = timezone.now() - timedelta(days=days)
-        
-        queryset = AccessLog.objects.filter(timestamp__gte=start_date)
-        
-        # Calculate statistics
-        total_accesses = queryset.count()
-        successful_accesses = queryset.filter(status=AccessLog.Status.SUCCESS).count()
-        denied_accesses = queryset.filter(status=AccessLog.Status.DENIED).count()
-        entries = queryset.filter(access_type=AccessLog.AccessType.ENTRY).count()
-        exits = queryset.filter(access_type=AccessLog.AccessType.EXIT).count()
-        unique_residents = queryset.filter(resident__isnull=False).values('resident').distinct().count()
-        unique_visitors = queryset.filter(visitor__isnull=False).values('visitor').distinct().count()
-        
-        # By access method
-        by_access_method = dict(
-            queryset.values('access_method').annotate(count=Count('id')).values_list('access_method', 'count')
-        )
-        
-        # By access point
-        by_access_point = dict(
-            queryset.values('access_point__name').annotate(count=Count('id')).values_list('access_point__name', 'count')
-        )
-        
+
+        # Stations polling within the same bucket share one computation; the
+        # window is anchored to the bucket so they also get the same numbers
+        ttl = settings.ACCESS_STATS_CACHE_TTL
+        if ttl <= 0:
+            return Response(self._compute_stats(timezone.now(), days))
+        bucket = int(timezone.now().timestamp()) // ttl
+        cache_key = STATS_CACHE_KEY.format(days, bucket)
+        data = cache.get(cache_key)
+        if data is None:
+            now = datetime.fromtimestamp(bucket * ttl, tz=dt_timezone.utc)
+            data = self._compute_stats(now, days)
+            cache.set(cache_key, data, ttl * 2)
+        return Response(data)
+
+    def _compute_stats(self, now, days):
+        """Serialized statistics for the days before now"""
+        start = now - timedelta(days=days)
+        queryset = AccessLog.objects.filter(timestamp__gte=start)
+
+        unique = {
+            'unique_residents': Count('resident', distinct=True),
+            'unique_visitors': Count('visitor', distinct=True),
+        }
+        if days > 1:
+            # Counters come from the hourly rollups; distinct people still
+            # need the raw logs
+            totals = {**self._rollup_totals(start), **queryset.aggregate(**unique)}
+            by_access_method = {
+                method: count for (method,), count in count_by(start, 'access_method').items()
+            }
+            by_access_point = {
+                name: count for (name,), count in count_by(start, 'access_point__name').items()
+            }
+        else:
+            # Scalar counts in a single scan of the window
+            totals = queryset.aggregate(
+                total_accesses=Count('id'),
+                successful_accesses=Count('id', filter=Q(status=AccessLog.Status.SUCCESS)),
+                denied_accesses=Count('id', filter=Q(status=AccessLog.Status.DENIED)),
+                entries=Count('id', filter=Q(access_type=AccessLog.AccessType.ENTRY)),
+                exits=Count('id', filter=Q(access_type=AccessLog.AccessType.EXIT)),
+                **unique,
+            )
+
+            # By access method
+            by_access_method = dict(
+                queryset.values('access_method').annotate(count=Count('id')).values_list('access_method', 'count')
+            )
+
+            # By access point
+            by_access_point = dict(
+                queryset.values('access_point__name').annotate(count=Count('id')).values_list('access_point__name', 'count')
+            )
+
         # Recent accesses
-        recent_accesses = queryset.order_by('-timestamp')[:10]
-        
+        recent_accesses = queryset.select_related('access_point').order_by('-timestamp')[:10]
+
         stats = {
-            'total_accesses': total_accesses,
-            'successful_accesses': successful_accesses,
-            'denied_accesses': denied_accesses,
-            'entries': entries,
-            'exits': exits,
-            'unique_residents': unique_residents,
-            'unique_visitors': unique_visitors,
+            **totals,
             'by_access_method': by_access_method,
             'by_access_point': by_access_point,
             'recent_accesses': recent_accesses
         }
-        
-        serializer = AccessStatsSerializer(stats)
+
+        return AccessStatsSerializer(stats).data
+
+    def _rollup_totals(self, start):
+        """Scalar counters of the stats payload, read from the rollups"""
+        counts = count_by(start, 'status', 'access_type')
+        totals = {
+            'total_accesses': 0, 'successful_accesses': 0, 'denied_accesses': 0,
+            'entries': 0, 'exits': 0,
+        }
+        for (status, access_type), count in counts.items():
+            totals['total_accesses'] += count
+            if status == AccessLog.Status.SUCCESS:
+                totals['successful_accesses'] += count
+            elif status == AccessLog.Status.DENIED:
+                totals['denied_accesses'] += count
+            if access_type == AccessLog.AccessType.ENTRY:
+                totals['entries'] += count
+            elif access_type == AccessLog.AccessType.EXIT:
+                totals['exits'] += count
+        return totals
+
+    @action(detail=False, methods=['get'])
+    def timeseries(self, request):
+        """Get access counts per hour or day, read from the hourly rollups"""
+        interval = request.query_params.get('interval', 'day')
+        if interval not in ('hour', 'day'):
+            return Response({'error': 'interval must be hour or day'}, status=400)
+        try:
+            days = int(request.query_params.get('days', 7))
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=400)
+
+        start = timezone.now() - timedelta(days=days)
+        counts = count_by(start, 'status', interval=interval)
+        periods = {}
+        for (status, period), count in counts.items():
+            point = periods.setdefault(period, {
+                'period': period, 'total': 0, 'successful': 0, 'denied': 0
+            })
+            point['total'] += count
+            if status == AccessLog.Status.SUCCESS:
+                point['successful'] += count
+            elif status == AccessLog.Status.DENIED:
+                point['denied'] += count
+
+        serializer = AccessTimeseriesSerializer([periods[period] for period in sorted(periods)], many=True)
         return Response(serializer.data)
-    
+
+    @action(detail=False, methods=['get'])
+    def heatmap(self, request):
+        """Get access counts by weekday and hour of day, per access point"""
+        try:
+            days = int(request.query_params.get('days', 28))
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=400)
+
+        filters = {}
+        access_point_id = request.query_params.get('access_point', None)
+        access_type = request.query_params.get('access_type', None)
+        status = request.query_params.get('status', None)
+        if access_point_id:
+            try:
+                filters['access_point_id'] = int(access_point_id)
+            except ValueError:
+                return Response({'error': 'access_point must be an integer'}, status=400)
+        if access_type:
+            filters['access_type'] = access_type
+        if status:
+            filters['status'] = status
+
+        data = traffic_heatmap(timezone.now() - timedelta(days=days), **filters)
+        data['timezone'] = settings.TIME_ZONE
+        data['days'] = days
+        serializer = AccessHeatmapSerializer(data)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def alerts(self, request):
+        """Get active denial-rate alerts per access point and device"""
+        active = active_alerts()
+        scope = request.query_params.get('scope', None)
+        access_point_id = request.query_params.get('access_point', None)
+        if scope:
+            active = [alert for alert in active if alert['scope'] == scope]
+        if access_point_id:
+            active = [alert for alert in active if str(alert['access_point_id']) == access_point_id]
+        serializer = DenialAlertSerializer(active, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the filtered access logs as NDJSON or CSV, archived months included
+
+        Takes the list filters plus type (ndjson or csv) and gzip (1 to compress)
+        """
+        export_format = request.query_params.get('type', 'ndjson')
+        if export_format not in CONTENT_TYPES:
+            return Response({'error': 'type must be ndjson or csv'}, status=400)
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true')
+        archive_lookups = self.get_list_lookups()
+        if 'search' in request.query_params:
+            # Archived months have no search index
+            if archive.overlaps(archive_lookups):
+                return Response(
+                    {'error': 'search cannot reach archived months; set date_from after them'}, status=400
+                )
+            archive_lookups = None
+
+        queryset = self.filter_queryset(self.get_queryset()).select_related(None).order_by('-timestamp', '-id')
+        filename = f'access_logs-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+        if compress:
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            stream_logs(queryset, export_format, compress, archive_lookups),
+            content_type='application/gzip' if compress else CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     @action(detail=False, methods=['get'])
     def resident_logs(self, request):
         """Get access logs for a specific resident"""
@@ -112,8 +311,9 @@ class AccessLogViewSet(viewsets.ReadOnlyModelViewSet):
             return Response({'error': 'resident_id parameter required'}, status=400)
         
         queryset = self.get_queryset().filter(resident_id=resident_id)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def visitor_logs(self, request):
@@ -123,5 +323,6 @@ class AccessLogViewSet(viewsets.ReadOnlyModelViewSet):
             return Response({'error': 'visitor_id parameter required'}, status=400)
         
         queryset = self.get_queryset().filter(visitor_id=visitor_id)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
@@ -0,0 +1,385 @@
+"""
+AccessLog writer for Access Control System
+
+Every access decision is logged through write_logs(). By default the rows
+are inserted before the request returns, with one bulk_create. With
+ACCESS_LOG_WRITE_BEHIND on, they are queued instead and a background thread
+bulk_creates them every ACCESS_LOG_FLUSH_INTERVAL milliseconds or
+ACCESS_LOG_FLUSH_SIZE rows, whichever comes first.
+
+Rows that cannot be inserted are appended to a local write-ahead journal in
+ACCESS_LOG_JOURNAL_DIR (see utils/journal.py), so a decision is never lost
+nor delayed by the database. The directory must be persistent storage
+outside BASE_DIR; write-behind refuses to start without one, and inline
+writes without one fail with the database. Rows are journaled when:
+
+- the insert fails (database unavailable), or takes longer than
+  ACCESS_LOG_WRITE_BUDGET milliseconds (PostgreSQL statement_timeout);
+- after a failure, the database is not tried again for
+  ACCESS_LOG_JOURNAL_RETRY seconds and rows go straight to the journal;
+- the worker shuts down with rows still queued.
+
+A write-behind batch the database rejects (IntegrityError, DataError) is
+retried row by row; rows rejected alone are dropped and logged in full,
+since replaying them would fail the same way.
+
+The first insert that succeeds after rows were journaled (and after a
+worker starts) replays the journal from a background thread; the
+replay_access_log_journal command does the same. Every AccessLog carries a
+unique event_id and the replay skips rows already present, so replaying a
+segment twice inserts nothing new.
+
+access_logged is sent after rows reach the database, in either mode. The
+write-behind flusher also keeps the hourly rollups caught up (see
+rollups.py); without it, run the rollup_access_logs command from cron.
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DataError, Error, IntegrityError, close_old_connections, connection, models, transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import AccessLog
+from .rollups import catch_up_scheduler
+from .signals import access_logged
+from utils.journal import Journal
+from utils.paths import inside_base_dir
+
+logger = logging.getLogger(__name__)
+
+journal = Journal(lambda: settings.ACCESS_LOG_JOURNAL_DIR)
+
+
+def _log_to_dict(log):
+    data = {}
+    for field in AccessLog._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        value = getattr(log, field.attname)
+        if isinstance(field, models.FileField):
+            value = value.name or ''
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        elif isinstance(value, (Decimal, uuid.UUID)):
+            value = str(value)
+        data[field.attname] = value
+    return data
+
+
+def _log_from_dict(data):
+    data = dict(data)
+    data['timestamp'] = parse_datetime(data['timestamp'])
+    return AccessLog(**data)
+
+
+def insert_logs(logs, ignore_conflicts=False):
+    """
+    Insert AccessLog rows now and announce them
+
+    Args:
+        logs: Unsaved AccessLog instances
+        ignore_conflicts: Skip rows whose event_id is already stored
+    """
+    if not logs:
+        return
+    AccessLog.objects.bulk_create(logs, ignore_conflicts=ignore_conflicts)
+    access_logged.send(sender=AccessLog, logs=logs)
+
+
+def _insert_within_budget(logs):
+    budget = settings.ACCESS_LOG_WRITE_BUDGET
+    if not budget or connection.vendor != 'postgresql':
+        insert_logs(logs)
+        return
+    nested = connection.in_atomic_block
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT current_setting('statement_timeout'), set_config('statement_timeout', %s, true)",
+                [str(budget)]
+            )
+            previous = cursor.fetchone()[0]
+            AccessLog.objects.bulk_create(logs)
+            if nested:
+                # Otherwise the setting ends with the transaction
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous])
+    access_logged.send(sender=AccessLog, logs=logs)
+
+
+def durable_journal_root():
+    """
+    ACCESS_LOG_JOURNAL_DIR, checked when the app starts
+
+    Returns:
+        Path of the journal, or None if journaling is off
+
+    Raises:
+        ImproperlyConfigured: if write-behind is on without a journal, or the
+            journal lies inside BASE_DIR, which is replaced on every deploy
+    """
+    if not settings.ACCESS_LOG_JOURNAL_DIR:
+        if settings.ACCESS_LOG_WRITE_BEHIND:
+            raise ImproperlyConfigured(
+                'ACCESS_LOG_WRITE_BEHIND needs ACCESS_LOG_JOURNAL_DIR on persistent storage: '
+                'queued logs are journaled there when the database is unavailable'
+            )
+        return None
+    if inside_base_dir(settings.ACCESS_LOG_JOURNAL_DIR):
+        raise ImproperlyConfigured(
+            f'ACCESS_LOG_JOURNAL_DIR ({settings.ACCESS_LOG_JOURNAL_DIR}) is inside the application '
+            'directory, which does not survive a deploy; use a persistent disk'
+        )
+    return journal.directory
+
+
+def journal_logs(logs):
+    """
+    Append AccessLog rows to the journal for later insertion
+
+    Args:
+        logs: Unsaved AccessLog instances
+    """
+    journal.append([_log_to_dict(log) for log in logs])
+
+
+def replay_journal():
+    """
+    Insert the rows of every journal segment, deleting each once inserted
+
+    Returns:
+        Number of rows replayed (rows already stored are skipped)
+    """
+    return journal.replay(
+        lambda records: insert_logs([_log_from_dict(record) for record in records], ignore_conflicts=True),
+        settings.ACCESS_LOG_FLUSH_SIZE
+    )
+
+
+class JournalReplayer:
+    """
+    Database availability as seen by this worker, and the background replay
+    of the journal once the database takes writes again
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+        self._replay_at = 0.0
+        # Other workers may have left segments behind
+        self._pending = True
+        self._thread = None
+
+    def available(self):
+        """Whether the database should be tried"""
+        return time.monotonic() >= self._retry_at
+
+    def failed(self):
+        """Record a failed insert: rows were journaled"""
+        self._retry_at = time.monotonic() + settings.ACCESS_LOG_JOURNAL_RETRY
+        self._pending = True
+
+    def succeeded(self):
+        """Record a successful insert, replaying the journal if needed"""
+        if not self._pending or time.monotonic() < self._replay_at:
+            return
+        with self._lock:
+            if not self._pending or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._pending = False
+            self._thread = threading.Thread(target=self._run, name='access-log-replay', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        close_old_connections()
+        try:
+            replay_journal()
+        except Exception:
+            # Failed segments stay in place for a later attempt or the command
+            logger.exception('Access log journal replay failed; retrying in %s s', settings.ACCESS_LOG_JOURNAL_RETRY)
+            self._replay_at = time.monotonic() + settings.ACCESS_LOG_JOURNAL_RETRY
+            self._pending = True
+        finally:
+            connection.close()
+
+
+replayer = JournalReplayer()
+
+
+def _store(logs, budget):
+    """Insert rows, or journal them while the database is unavailable"""
+    if not settings.ACCESS_LOG_JOURNAL_DIR:
+        # Nowhere durable to keep them: the caller fails with the database
+        insert_logs(logs)
+        return
+    if not replayer.available():
+        journal_logs(logs)
+        return
+    try:
+        if budget:
+            _insert_within_budget(logs)
+        else:
+            insert_logs(logs)
+    except (IntegrityError, DataError):
+        # Bad rows, not an outage: replaying them would fail the same way
+        raise
+    except Error:
+        journal_logs(logs)
+        replayer.failed()
+        return
+    replayer.succeeded()
+
+
+class WriteBehindLogWriter:
+    """
+    In-process queue of AccessLog rows with a background bulk flusher
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._in_flight = []
+
+    def enqueue(self, logs):
+        """Queue rows for the flusher"""
+        self._ensure_started()
+        for log in logs:
+            self._queue.put(log)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='access-log-writer', daemon=True
+                )
+                self._thread.start()
+
+    def _take_batch(self, block):
+        size = settings.ACCESS_LOG_FLUSH_SIZE
+        interval = settings.ACCESS_LOG_FLUSH_INTERVAL / 1000
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=interval) if block else self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + interval
+        while len(batch) < size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if block and remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        _store(batch, budget=False)
+
+    def _run(self):
+        while not self._stopping:
+            batch = self._take_batch(block=True)
+            if not batch:
+                continue
+            self._in_flight = batch
+            close_old_connections()
+            try:
+                self._write_batch(batch)
+            except Exception:
+                # Keep the flusher alive for the next batches
+                logger.exception('Access log writer lost %d rows', len(batch))
+            self._in_flight = []
+            catch_up_scheduler.logs_written()
+
+    def _write_batch(self, batch):
+        """Write a batch from the flusher, isolating rows the database rejects"""
+        try:
+            self._write(batch)
+        except (IntegrityError, DataError):
+            logger.warning('Access log batch of %d rows rejected; writing rows one by one', len(batch), exc_info=True)
+            for log in batch:
+                self._write_row(log)
+        except Exception:
+            logger.exception('Access log writer failed; journaling %d rows', len(batch))
+            journal_logs(batch)
+
+    def _write_row(self, log):
+        try:
+            self._write([log])
+        except (IntegrityError, DataError):
+            logger.exception('Dropped access log rejected by the database: %s', json.dumps(_log_to_dict(log)))
+        except Exception:
+            logger.exception('Access log writer failed; journaling 1 row')
+            journal_logs([log])
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        """Stop the flusher and journal whatever is still queued"""
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(timeout=settings.ACCESS_LOG_FLUSH_INTERVAL / 1000 + 5)
+        # A batch still being inserted is journaled too: a duplicate is
+        # skipped on replay, a lost row is not recovered
+        pending = list(self._in_flight) if self._thread is not None and self._thread.is_alive() else []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if pending:
+            journal_logs(pending)
+
+
+write_behind = WriteBehindLogWriter()
+
+
+@atexit.register
+def _journal_on_exit():
+    # Don't wait on the database during shutdown; the next worker replays
+    write_behind.stop()
+    journal.seal()
+
+
+def write_logs(logs):
+    """
+    Log access decisions
+
+    Rows are journaled instead when the database is unavailable or over
+    ACCESS_LOG_WRITE_BUDGET.
+
+    Args:
+        logs: Unsaved AccessLog instances
+    """
+    if not logs:
+        return
+    if settings.ACCESS_LOG_WRITE_BEHIND:
+        write_behind.enqueue(logs)
+    else:
+        _store(logs, budget=True)
+
+
+async def awrite_logs(logs):
+    """Async variant of write_logs(); queuing needs no thread hop"""
+    if not logs:
+        return
+    if settings.ACCESS_LOG_WRITE_BEHIND:
+        write_behind.enqueue(logs)
+    else:
+        await sync_to_async(_store)(logs, budget=True)
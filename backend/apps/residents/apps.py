@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ResidentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.residents'
+
+    def ready(self):
+        from utils.search import repair_search_indexes
+
+        post_migrate.connect(repair_search_indexes, sender=self)
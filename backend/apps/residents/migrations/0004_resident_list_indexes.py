@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('residents', '0003_resident_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='resident',
+            index=models.Index(fields=['-created_at'], name='residents_r_created_ce078e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resident',
+            index=models.Index(condition=models.Q(('is_authorized', True), ('move_out_date__isnull', True)), fields=['-created_at'], name='residents_current_created_idx'),
+        ),
+    ]
@@ -2,6 +2,7 @@
 Residents models for Access Control System
 """
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from utils.validators import validate_phone_number, validate_unit_number
@@ -221,6 +222,18 @@ class Resident(models.Model):
         verbose_name = _('Resident')
         verbose_name_plural = _('Residents')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at']),
+            # ?is_active=true: authorized residents who have not moved out
+            models.Index(
+                fields=['-created_at'],
+                condition=Q(is_authorized=True, move_out_date__isnull=True),
+                name='residents_current_created_idx'
+            ),
+        ]
+    
+    # Text fields served by the search index (see utils/search.py)
+    SEARCH_INDEX_FIELDS = ['first_name', 'last_name', 'document_id', 'phone', 'email']
     
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.unit}"
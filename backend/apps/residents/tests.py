@@ -1,3 +1,65 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from apps.users.models import CustomUser
+from .models import Building, Unit, Resident
+
+
+class ResidentSearchTests(TestCase):
+    """?search= is served by the search index and ranked by relevance"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(username='admin', password='x')
+        building = Building.objects.create(name='Torre A', code='A')
+        units = [Unit.objects.create(building=building, number=number, floor=1) for number in ('101', '102')]
+        cls.residents = {}
+        for first_name, last_name, email, unit in [
+            ('Ana', 'Gómez', 'ana@example.com', 0),
+            ('Luis', 'Gómez', 'luis@example.com', 0),
+            ('Ana', 'Pérez', 'aperez@example.com', 1),
+            ('Marta', 'Ruiz', 'marta.ruiz@example.com', 1),
+            ('Pedro', 'Díaz', 'pedro@example.com', 1),
+            ('Carlos', 'Ruizdíaz', 'carlos@example.com', 1),
+        ]:
+            cls.residents[f'{first_name} {last_name}'] = Resident.objects.create(
+                unit=units[unit], first_name=first_name, last_name=last_name, email=email,
+                document_id=f'{len(cls.residents):08d}', phone=f'+57300000000{len(cls.residents)}'
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def search(self, term):
+        response = self.client.get('/api/residents/', {'search': term})
+        self.assertEqual(response.status_code, 200)
+        ids = {resident.pk: name for name, resident in self.residents.items()}
+        return [ids[resident['id']] for resident in response.data['results']]
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search('Ana Gómez'), ['Ana Gómez'])
+        self.assertEqual(set(self.search('gómez')), {'Ana Gómez', 'Luis Gómez'})
+
+    def test_best_match_first(self):
+        # Newest first without a search; the closer match wins with one
+        self.assertEqual(self.client.get('/api/residents/').data['results'][0]['id'], self.residents['Carlos Ruizdíaz'].pk)
+        self.assertEqual(self.search('Ruiz'), ['Marta Ruiz', 'Carlos Ruizdíaz'])
+
+    def test_substring_and_case_insensitive(self):
+        self.assertEqual(set(self.search('ÓMEZ')), {'Ana Gómez', 'Luis Gómez'})
+        self.assertEqual(self.search('.ruiz@'), ['Marta Ruiz'])
+        self.assertEqual(self.search('ruiz.'), [])
+
+    def test_short_terms_and_related_fields(self):
+        # Below the trigram length and on related models, icontains is used
+        self.assertEqual(set(self.search('Dí')), {'Pedro Díaz', 'Carlos Ruizdíaz'})
+        self.assertEqual(set(self.search('102')), {'Ana Pérez', 'Marta Ruiz', 'Pedro Díaz', 'Carlos Ruizdíaz'})
+
+    def test_index_follows_updates(self):
+        resident = self.residents['Pedro Díaz']
+        resident.last_name = 'Gómez'
+        resident.save()
+        self.assertIn('Pedro Díaz', self.search('gómez'))
+        resident.delete()
+        self.assertNotIn('Pedro Díaz', self.search('gómez'))
@@ -8,6 +8,7 @@ from .models import Building, Unit, Resident
 from .serializers import (
     BuildingSerializer, UnitSerializer, ResidentSerializer, ResidentMinimalSerializer
 )
+from utils.search import IndexedSearchFilter
 
 
 class BuildingViewSet(viewsets.ModelViewSet):
@@ -43,7 +44,7 @@ class ResidentViewSet(viewsets.ModelViewSet):
     """ViewSet for managing residents"""
     queryset = Resident.objects.select_related('unit', 'unit__building', 'user').all()
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, IndexedSearchFilter]
     search_fields = ['first_name', 'last_name', 'document_id', 'phone', 'email', 'unit__number']
     ordering_fields = ['first_name', 'last_name', 'created_at']
     ordering = ['-created_at']
@@ -0,0 +1,67 @@
+"""
+Async-native views for Visitors app
+"""
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.http import JsonResponse
+from rest_framework import status
+
+from apps.access_control.idempotency import aidempotent
+from apps.access_control.throttling import athrottle_scans
+from utils.async_api import authenticate, unauthorized, throttled, parse_request
+from .models import Visitor, TemporaryCode
+from .serializers import VisitorSerializer, TemporaryCodeSerializer, ValidateCodeRequestSerializer
+
+
+@csrf_exempt
+@require_POST
+async def validate_code(request):
+    """Validate a temporary access code (async variant of VisitorViewSet.validate_code)"""
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    
+    data, error_response = parse_request(request, ValidateCodeRequestSerializer)
+    if error_response is not None:
+        return error_response
+    
+    wait = await athrottle_scans(user.id, [data])
+    if wait is not None:
+        return throttled(wait)
+    
+    return await aidempotent(request, user.id, 'validate_code', lambda: _use_code(data['code']))
+
+
+async def _use_code(code):
+    """Consume a temporary code, answering like VisitorViewSet.validate_code"""
+    # Load everything the serializers read, so they never query lazily
+    temp_code = await TemporaryCode.objects.select_related(
+        'visitor__unit__building', 'visitor__resident'
+    ).filter(code=code).afirst()
+    if temp_code is None:
+        return JsonResponse(
+            {'valid': False, 'error': 'Invalid code'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # Use the code; fails if it is not valid or another scan took the last use
+    if not await temp_code.aconsume():
+        error = 'Code has expired' if temp_code.is_expired else 'Code is not active or has been used'
+        return JsonResponse(
+            {'valid': False, 'error': error},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Update visitor status
+    visitor = temp_code.visitor
+    if visitor.status == Visitor.Status.APPROVED:
+        visitor.status = Visitor.Status.CHECKED_IN
+        visitor.check_in_time = timezone.now()
+        await visitor.asave(update_fields=['status', 'check_in_time', 'updated_at'])
+    
+    return JsonResponse({
+        'valid': True,
+        'visitor': VisitorSerializer(visitor).data,
+        'code': TemporaryCodeSerializer(temp_code).data
+    })
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('residents', '0002_initial'),
+        ('visitors', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='temporarycode',
+            index=models.Index(fields=['-created_at', '-id'], name='visitors_te_created_8110c7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visitor',
+            index=models.Index(fields=['-created_at', '-id'], name='visitors_vi_created_63b282_idx'),
+        ),
+    ]
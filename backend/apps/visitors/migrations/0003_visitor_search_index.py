@@ -0,0 +1,29 @@
+"""
+Search index for Visitor: trigram GIN indexes on PostgreSQL, FTS5 on SQLite
+
+See utils.search.
+"""
+from django.db import migrations
+
+from utils.search import create_search_index, drop_search_index
+
+SEARCH_INDEX_FIELDS = ['first_name', 'last_name', 'document_id', 'phone', 'company']
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor.connection, apps.get_model('visitors', 'Visitor'), SEARCH_INDEX_FIELDS)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection, apps.get_model('visitors', 'Visitor'), SEARCH_INDEX_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visitors', '0002_created_at_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visitors', '0003_visitor_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='temporarycode',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['valid_until'], name='visitors_tc_active_until_idx'),
+        ),
+    ]
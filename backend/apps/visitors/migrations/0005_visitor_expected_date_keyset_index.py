@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('residents', '0004_resident_list_indexes'),
+        ('visitors', '0004_temporarycode_active_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='visitor',
+            name='visitors_vi_created_63b282_idx',
+        ),
+        migrations.AddIndex(
+            model_name='visitor',
+            index=models.Index(fields=['-expected_date', '-created_at', '-id'], name='visitors_vi_expecte_cfb787_idx'),
+        ),
+    ]
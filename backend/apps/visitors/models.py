@@ -1,11 +1,24 @@
 """
 Visitors models for Access Control System
 """
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import connections, models, router
+from django.db.models import Case, F, Q, Value, When
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from utils.validators import validate_phone_number
+from .signals import temporary_code_used
+
+# TemporaryCode.consume() on backends with RETURNING: the conditional update
+# and the counters it leaves, in one statement
+CONSUME_SQL = """
+UPDATE {table}
+SET times_used = times_used + 1, last_used_at = %s, updated_at = %s,
+    is_active = (times_used + 1 < max_uses)
+WHERE id = %s AND is_active AND valid_from <= %s AND valid_until >= %s AND times_used < max_uses
+RETURNING times_used, is_active
+"""
 
 
 class Visitor(models.Model):
@@ -152,6 +165,12 @@ class Visitor(models.Model):
         verbose_name = _('Visitor')
         verbose_name_plural = _('Visitors')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-expected_date', '-created_at', '-id']),
+        ]
+    
+    # Text fields served by the search index (see utils/search.py)
+    SEARCH_INDEX_FIELDS = ['first_name', 'last_name', 'document_id', 'phone', 'company']
     
     def __str__(self):
         return f"{self.full_name} - {self.unit} ({self.get_status_display()})"
@@ -256,6 +275,16 @@ class TemporaryCode(models.Model):
         verbose_name = _('Temporary Code')
         verbose_name_plural = _('Temporary Codes')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            # ?is_active=true: active codes that have not expired yet
+            models.Index(
+                fields=['valid_until'], condition=Q(is_active=True), name='visitors_tc_active_until_idx'
+            ),
+        ]
+    
+    # Fields written when the code is used
+    USAGE_FIELDS = ['times_used', 'last_used_at', 'is_active', 'updated_at']
     
     def __str__(self):
         return f"{self.code} - {self.visitor.full_name}"
@@ -275,10 +304,62 @@ class TemporaryCode(models.Model):
         """Check if code has expired"""
         return timezone.now() > self.valid_until
     
-    def increment_usage(self):
-        """Increment the usage counter"""
-        self.times_used += 1
-        self.last_used_at = timezone.now()
-        if self.times_used >= self.max_uses:
-            self.is_active = False
-        self.save()
+    def consume(self, now=None):
+        """
+        Use the code once, atomically
+        
+        A single conditional UPDATE increments times_used only while the code
+        is active, inside its validity window and below max_uses, so
+        concurrent scans can never use it more than max_uses times. Where the
+        backend has RETURNING (PostgreSQL, SQLite) it also returns the counters
+        it left, which are handed to temporary_code_used listeners.
+        
+        Args:
+            now: Time of the use (default: timezone.now())
+            
+        Returns:
+            True if this call used the code, False if it was not usable
+        """
+        now = now or timezone.now()
+        connection = connections[router.db_for_write(TemporaryCode, instance=self)]
+        if connection.features.can_return_columns_from_insert:
+            # Other gates may have used the code too: take the outcome from the row
+            value = connection.ops.adapt_datetimefield_value(now)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    CONSUME_SQL.format(table=connection.ops.quote_name(self._meta.db_table)),
+                    [value, value, self.pk, value, value]
+                )
+                row = cursor.fetchone()
+            if row is None:
+                return False
+            self.times_used, self.is_active = row[0], bool(row[1])
+        else:
+            won = TemporaryCode.objects.using(connection.alias).filter(
+                pk=self.pk,
+                is_active=True,
+                valid_from__lte=now,
+                valid_until__gte=now,
+                times_used__lt=F('max_uses')
+            ).update(
+                times_used=F('times_used') + 1,
+                last_used_at=now,
+                is_active=Case(
+                    When(max_uses__lte=F('times_used') + 1, then=Value(False)),
+                    default=Value(True)
+                ),
+                updated_at=now
+            )
+            if not won:
+                return False
+            # No RETURNING (MySQL): count from what this instance last saw
+            self.times_used += 1
+            self.is_active = self.times_used < self.max_uses
+        self.last_used_at = self.updated_at = now
+        
+        temporary_code_used.send(sender=TemporaryCode, instance=self)
+        return True
+    
+    async def aconsume(self, now=None):
+        """Async variant of consume"""
+        return await sync_to_async(self.consume)(now)
@@ -0,0 +1,104 @@
+"""
+Lazily rendered QR images for temporary codes
+
+Codes are mostly shared as text, so generate_code renders nothing: a code's
+QR image is rendered the first time /api/codes/{id}/qr.png or qr.svg is
+requested. Images are content-addressed: named by the SHA-256 of the
+encoded data, format and size, and saved under STORAGE_DIR in the
+default storage, so an image is rendered once whichever worker serves it.
+Each worker also keeps the images it served last in an LRU bounded to
+QR_CACHE_BYTES.
+
+A renamed visitor encodes different data, hence a new image, so nothing
+needs invalidating.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from utils.qr_generator import render_qr, visitor_qr_data
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+STORAGE_DIR = 'codes/qr'
+
+
+class ImageLRU:
+    """
+    Images by digest, least recently served evicted past a total size
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+        self._bytes = 0
+
+    def get(self, digest):
+        with self._lock:
+            content = self._images.get(digest)
+            if content is not None:
+                self._images.move_to_end(digest)
+            return content
+
+    def put(self, digest, content):
+        limit = settings.QR_CACHE_BYTES
+        if len(content) > limit:
+            return
+        with self._lock:
+            previous = self._images.pop(digest, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._images[digest] = content
+            self._bytes += len(content)
+            while self._bytes > limit:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+recent_images = ImageLRU()
+
+
+def image_digest(data, image_format, size):
+    """Content address of a QR image: SHA-256 of what determines its bytes"""
+    key = f'{image_format}\0{size if image_format == "png" else ""}\0{data}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def storage_name(digest, image_format):
+    return f'{STORAGE_DIR}/{digest[:2]}/{digest}.{image_format}'
+
+
+def qr_image(temp_code, image_format='png', size=300):
+    """
+    QR image of a temporary code, rendered on first use
+
+    Args:
+        temp_code: TemporaryCode with its visitor loaded
+        image_format: 'png' or 'svg'
+        size: Size of PNG images in pixels
+
+    Returns:
+        Tuple of (digest, image contents as bytes or a memoryview); the
+        digest changes with the contents
+    """
+    data = visitor_qr_data(temp_code.code, temp_code.visitor.full_name)
+    digest = image_digest(data, image_format, size)
+    content = recent_images.get(digest)
+    if content is not None:
+        return digest, content
+
+    name = storage_name(digest, image_format)
+    if default_storage.exists(name):
+        with default_storage.open(name, 'rb') as file:
+            content = file.read()
+    else:
+        content = render_qr(data, image_format, size)
+        saved = default_storage.save(name, ContentFile(content))
+        if saved != name:
+            # Another worker rendered it meanwhile; the storage kept both
+            default_storage.delete(saved)
+    recent_images.put(digest, content)
+    return digest, content
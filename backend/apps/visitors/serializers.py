@@ -1,6 +1,7 @@
 """
 Serializers for Visitors app
 """
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Visitor, TemporaryCode
 from apps.residents.serializers import UnitSerializer, ResidentMinimalSerializer
@@ -40,16 +41,23 @@ class TemporaryCodeSerializer(serializers.ModelSerializer):
     visitor_name = serializers.CharField(source='visitor.full_name', read_only=True)
     is_valid = serializers.BooleanField(read_only=True)
     is_expired = serializers.BooleanField(read_only=True)
+    qr_code_url = serializers.SerializerMethodField()
     
     class Meta:
         model = TemporaryCode
         fields = [
             'id', 'visitor', 'visitor_name', 'code', 'code_type',
-            'qr_code_image', 'secret_key', 'valid_from', 'valid_until',
+            'qr_code_image', 'qr_code_url', 'secret_key', 'valid_from', 'valid_until',
             'max_uses', 'times_used', 'is_active', 'generated_by',
             'last_used_at', 'is_valid', 'is_expired', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'times_used', 'last_used_at', 'created_at', 'updated_at']
+    
+    def get_qr_code_url(self, obj):
+        """Path of the QR image (rendered on first request), for QR codes"""
+        if obj.code_type != TemporaryCode.CodeType.QR:
+            return None
+        return reverse('visitors:temporarycode-qr', kwargs={'pk': obj.pk, 'image_format': 'png'})
 
 
 class GenerateCodeRequestSerializer(serializers.Serializer):
@@ -64,3 +72,4 @@ class ValidateCodeRequestSerializer(serializers.Serializer):
     """Serializer for code validation request"""
     code = serializers.CharField(max_length=100)
     access_point_id = serializers.IntegerField(required=False)
+    device_id = serializers.CharField(max_length=100, required=False, allow_blank=True)
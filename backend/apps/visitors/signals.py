@@ -0,0 +1,8 @@
+"""
+Signals for Visitors app
+"""
+from django.dispatch import Signal
+
+# Sent by TemporaryCode.consume() once a use is recorded; the instance holds
+# the counters the use left. Arguments: instance (TemporaryCode)
+temporary_code_used = Signal()
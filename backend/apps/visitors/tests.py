@@ -1,3 +1,265 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import qrcode
+from django.db import connection, connections, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from apps.residents.models import Building, Unit
+from apps.users.models import CustomUser
+from . import qr_images
+from .models import Visitor, TemporaryCode
+from .signals import temporary_code_used
+from utils.qr_generator import encode_qr, visitor_qr_data
+
+
+class TemporaryCodeConsumeTests(TransactionTestCase):
+    """TemporaryCode.consume() under concurrent scans"""
+
+    def setUp(self):
+        building = Building.objects.create(name='Torre A', code='A')
+        unit = Unit.objects.create(building=building, number='101', floor=1)
+        self.visitor = Visitor.objects.create(
+            first_name='Juan', last_name='Pérez', unit=unit,
+            expected_date=date.today(), status=Visitor.Status.APPROVED
+        )
+
+    def create_code(self, code, **fields):
+        fields.setdefault('valid_until', timezone.now() + timedelta(hours=1))
+        return TemporaryCode.objects.create(visitor=self.visitor, code=code, **fields)
+
+    def test_consume_stops_at_max_uses(self):
+        temp_code = self.create_code('ONCE0001', max_uses=2)
+
+        self.assertTrue(temp_code.consume())
+        self.assertEqual(temp_code.times_used, 1)
+        self.assertTrue(temp_code.is_active)
+        self.assertTrue(temp_code.consume())
+        self.assertFalse(temp_code.is_active)
+        self.assertFalse(temp_code.consume())
+
+        temp_code.refresh_from_db()
+        self.assertEqual(temp_code.times_used, 2)
+
+    def test_consume_reads_nothing_back(self):
+        temp_code = self.create_code('ONCE0002', max_uses=1)
+        received = []
+        temporary_code_used.connect(
+            lambda sender, instance, **kwargs: received.append((instance.times_used, instance.is_active)),
+            sender=TemporaryCode, weak=False, dispatch_uid='test_consume_reads_nothing_back'
+        )
+        self.addCleanup(temporary_code_used.disconnect, sender=TemporaryCode, dispatch_uid='test_consume_reads_nothing_back')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(temp_code.consume())
+        self.assertFalse(any(query['sql'].startswith('SELECT') for query in queries))
+        self.assertEqual(received, [(1, False)])
+        self.assertEqual(
+            TemporaryCode.objects.values_list('times_used', 'is_active').get(pk=temp_code.pk), (1, False)
+        )
+
+    def test_consume_without_returning(self):
+        temp_code = self.create_code('ONCE0003', max_uses=2)
+
+        with mock.patch.object(connection.features, 'can_return_columns_from_insert', False):
+            self.assertTrue(temp_code.consume())
+            self.assertTrue(temp_code.is_active)
+            self.assertTrue(temp_code.consume())
+            self.assertFalse(temp_code.is_active)
+            self.assertFalse(temp_code.consume())
+        self.assertEqual(
+            TemporaryCode.objects.values_list('times_used', 'is_active').get(pk=temp_code.pk), (2, False)
+        )
+
+    def test_consume_rejects_codes_outside_validity_window(self):
+        expired = self.create_code('EXPIRED1', valid_until=timezone.now() - timedelta(minutes=1))
+        future = self.create_code('FUTURE01', valid_from=timezone.now() + timedelta(hours=1))
+        inactive = self.create_code('INACTIV1', is_active=False)
+
+        for temp_code in (expired, future, inactive):
+            self.assertFalse(temp_code.consume())
+            temp_code.refresh_from_db()
+            self.assertEqual(temp_code.times_used, 0)
+
+    def test_no_double_spend_under_concurrency(self):
+        """Many threads scanning the same code never exceed max_uses"""
+        threads_count = 32
+        max_uses = 3
+        temp_code = self.create_code('RACE0001', max_uses=max_uses)
+        barrier = threading.Barrier(threads_count)
+        wins = []
+        errors = []
+
+        def scan():
+            try:
+                code = TemporaryCode.objects.get(pk=temp_code.pk)
+                barrier.wait()
+                # SQLite refuses concurrent writers instead of queueing them;
+                # retry like a gate would (PostgreSQL waits on the row lock)
+                for _ in range(200):
+                    try:
+                        if code.consume():
+                            wins.append(code.times_used)
+                        return
+                    except OperationalError:
+                        time.sleep(0.005)
+                errors.append('gave up after repeated lock errors')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=scan) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(wins), max_uses)
+        temp_code.refresh_from_db()
+        self.assertEqual(temp_code.times_used, max_uses)
+        self.assertFalse(temp_code.is_active)
+
+    def test_sequential_scans_spend_each_use_once(self):
+        """On every backend, repeated scans from separate loads stay exact"""
+        temp_code = self.create_code('SEQ00001', max_uses=5)
+        # Stale copies, as held by different gates
+        copies = [TemporaryCode.objects.get(pk=temp_code.pk) for _ in range(20)]
+
+        wins = sum(1 for copy in copies if copy.consume())
+
+        self.assertEqual(wins, 5)
+        temp_code.refresh_from_db()
+        self.assertEqual(temp_code.times_used, 5)
+
+
+class LazyQRTests(TestCase):
+    """QR images are rendered on first request, once"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        qr_images.recent_images = qr_images.ImageLRU()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_user(username='guardia', password='x'))
+        building = Building.objects.create(name='Torre A', code='A')
+        unit = Unit.objects.create(building=building, number='101', floor=1)
+        self.visitor = Visitor.objects.create(
+            first_name='Juan', last_name='Pérez', unit=unit, expected_date=date.today()
+        )
+
+    def stored_images(self):
+        return [path for path in Path(self.media_root).rglob('*') if path.is_file()]
+
+    def test_qr_rendered_on_first_request(self):
+        response = self.client.post(
+            '/api/visitors/generate_code/', {'visitor_id': self.visitor.id, 'code_type': 'QR'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stored_images(), [])
+
+        png_url = response.data['qr_code_url']
+        png = self.client.get(png_url)
+        self.assertEqual(png['Content-Type'], 'image/png')
+        self.assertTrue(png.content.startswith(b'\x89PNG'))
+        svg = self.client.get(png_url.replace('qr.png', 'qr.svg'))
+        self.assertEqual(svg['Content-Type'], 'image/svg+xml')
+        self.assertEqual(len(self.stored_images()), 2)
+
+        self.assertEqual(self.client.get(png_url, HTTP_IF_NONE_MATCH=png['ETag']).status_code, 304)
+        # Another worker, with an empty LRU, reads the stored image
+        qr_images.recent_images = qr_images.ImageLRU()
+        self.assertEqual(self.client.get(png_url).content, png.content)
+        self.assertEqual(len(self.stored_images()), 2)
+
+    def test_png_drawn_at_requested_size(self):
+        temp_code = TemporaryCode.objects.create(
+            visitor=self.visitor, code='QR000001', code_type='QR', valid_until=timezone.now() + timedelta(hours=1)
+        )
+        response = self.client.get(f'/api/codes/{temp_code.id}/qr.png/', {'size': 333})
+        image = Image.open(BytesIO(response.content))
+        self.assertEqual((image.size, image.mode), ((333, 333), '1'))
+
+        data = visitor_qr_data(temp_code.code, self.visitor.full_name)
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=0)
+        qr.add_data(data)
+        qr.make()
+        np.testing.assert_array_equal(encode_qr(data), qr.get_matrix())
+
+    def test_encoder_matches_qrcode_across_versions(self):
+        # Lengths spanning versions 1 to 10, and each mask pattern
+        for length in (1, 17, 30, 60, 100, 150, 200, 250):
+            for offset in range(8):
+                data = ''.join(chr(0x41 + (i * 7 + offset) % 58) for i in range(length))
+                qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=0)
+                qr.add_data(data)
+                qr.make()
+                with self.subTest(version=qr.version, length=length, offset=offset):
+                    np.testing.assert_array_equal(encode_qr(data), qr.get_matrix())
+
+
+class VisitorPaginationTests(TestCase):
+    """Visitor cursor pages follow the default ordering and stay stable"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_user(username='guardia', password='x'))
+        building = Building.objects.create(name='Torre A', code='A')
+        self.unit = Unit.objects.create(building=building, number='101', floor=1)
+        today = date.today()
+        for n in range(23):
+            # Registered in a different order than they are expected
+            self.add_visitor(n, today + timedelta(days=(n * 7) % 5))
+
+    def add_visitor(self, n, expected_date):
+        return Visitor.objects.create(
+            first_name='Visitante', last_name=str(n), unit=self.unit, expected_date=expected_date
+        )
+
+    def walk(self, url, params):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            ids += [visitor['id'] for visitor in response.data['results']]
+            if not response.data['next']:
+                return ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pages_keep_expected_date_ordering(self):
+        ordered = list(Visitor.objects.order_by('-expected_date', '-created_at', '-id').values_list('id', flat=True))
+        ids, _ = self.walk('/api/visitors/', {'page_size': 4})
+        self.assertEqual(ids, ordered)
+        # Page numbers keep the same default ordering
+        numbered = [visitor['id'] for visitor in self.client.get('/api/visitors/', {'page': 1}).data['results']]
+        self.assertEqual(numbered, ordered[:len(numbered)])
+
+    def test_rows_added_while_scrolling_do_not_shift_pages(self):
+        first = self.client.get('/api/visitors/', {'page_size': 5})
+        seen = [visitor['id'] for visitor in first.data['results']]
+        # Sorts before and after the cursor
+        self.add_visitor(100, date.today() + timedelta(days=30))
+        self.add_visitor(101, date.today() - timedelta(days=30))
+
+        rest, last = self.walk(first.data['next'], {})
+        self.assertEqual(len(set(seen + rest)), len(seen + rest))
+        self.assertEqual(len(seen + rest), 24)
+
+        # Walking back from the last page returns the rows before it
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual(
+            [visitor['id'] for visitor in previous.data['results']],
+            (seen + rest)[-len(last.data['results']) - 5:-len(last.data['results'])]
+        )
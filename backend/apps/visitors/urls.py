@@ -4,6 +4,7 @@ URL configuration for Visitors app
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import VisitorViewSet, TemporaryCodeViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'visitors', VisitorViewSet, basename='visitor')
@@ -12,5 +13,6 @@ router.register(r'codes', TemporaryCodeViewSet, basename='temporarycode')
 app_name = 'visitors'
 
 urlpatterns = [
+    path('visitors/async/validate_code/', async_views.validate_code, name='async-validate-code'),
     path('', include(router.urls)),
 ]
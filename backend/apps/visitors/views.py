@@ -6,25 +6,32 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
 from datetime import timedelta
-from django.core.files.base import ContentFile
+from django.http import HttpResponse
 
 from .models import Visitor, TemporaryCode
+from .qr_images import CONTENT_TYPES, qr_image
 from .serializers import (
     VisitorSerializer, VisitorMinimalSerializer, TemporaryCodeSerializer,
     GenerateCodeRequestSerializer, ValidateCodeRequestSerializer
 )
+from apps.access_control.idempotency import idempotent
+from apps.access_control.models import Credential
+from apps.access_control.throttling import ScanRateThrottle
 from utils.code_generator import generate_temporary_access_code, generate_otp
-from utils.qr_generator import generate_visitor_qr
+from utils.pagination import KeysetPagination
+from utils.search import IndexedSearchFilter
 
 
 class VisitorViewSet(viewsets.ModelViewSet):
     """ViewSet for managing visitors"""
     queryset = Visitor.objects.select_related('unit', 'resident', 'authorized_by').all()
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, IndexedSearchFilter]
     search_fields = ['first_name', 'last_name', 'document_id', 'phone', 'company']
     ordering_fields = ['expected_date', 'created_at']
     ordering = ['-expected_date', '-created_at']
+    pagination_class = KeysetPagination
+    keyset_fields = ('expected_date', 'created_at')
     
     def get_serializer_class(self):
         if self.action == 'list_minimal':
@@ -72,18 +79,21 @@ class VisitorViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Generate code based on type
-        if code_type == TemporaryCode.CodeType.OTP:
-            code, secret_key = generate_otp()
-        elif code_type == TemporaryCode.CodeType.NUMERIC:
-            code = generate_temporary_access_code('numeric', length=6)
-            secret_key = ''
-        elif code_type == TemporaryCode.CodeType.ALPHANUMERIC:
-            code = generate_temporary_access_code('alphanumeric', length=8)
-            secret_key = ''
-        else:  # QR
-            code = generate_temporary_access_code('alphanumeric', length=12)
-            secret_key = ''
+        # Generate code based on type, skipping codes already held by anyone
+        while True:
+            if code_type == TemporaryCode.CodeType.OTP:
+                code, secret_key = generate_otp()
+            elif code_type == TemporaryCode.CodeType.NUMERIC:
+                code = generate_temporary_access_code('numeric', length=6)
+                secret_key = ''
+            elif code_type == TemporaryCode.CodeType.ALPHANUMERIC:
+                code = generate_temporary_access_code('alphanumeric', length=8)
+                secret_key = ''
+            else:  # QR
+                code = generate_temporary_access_code('alphanumeric', length=12)
+                secret_key = ''
+            if not Credential.objects.filter(code=code).exists():
+                break
         
         # Create temporary code
         temp_code = TemporaryCode.objects.create(
@@ -97,14 +107,7 @@ class VisitorViewSet(viewsets.ModelViewSet):
             generated_by=request.user
         )
         
-        # Generate QR code if needed
-        if code_type == TemporaryCode.CodeType.QR:
-            qr_image = generate_visitor_qr(code, visitor.full_name)
-            temp_code.qr_code_image.save(
-                f'visitor_{visitor.id}_{temp_code.id}.png',
-                ContentFile(qr_image.read()),
-                save=True
-            )
+        # The QR image is rendered when first requested (see qr_images.py)
         
         # Update visitor status
         if visitor.status == Visitor.Status.PENDING:
@@ -114,7 +117,8 @@ class VisitorViewSet(viewsets.ModelViewSet):
         code_serializer = TemporaryCodeSerializer(temp_code)
         return Response(code_serializer.data, status=status.HTTP_201_CREATED)
     
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_classes=[ScanRateThrottle])
+    @idempotent
     def validate_code(self, request):
         """Validate a temporary access code"""
         serializer = ValidateCodeRequestSerializer(data=request.data)
@@ -130,23 +134,20 @@ class VisitorViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Check if code is valid
-        if not temp_code.is_valid:
+        # Use the code; fails if it is not valid or another scan took the last use
+        if not temp_code.consume():
             error = 'Code has expired' if temp_code.is_expired else 'Code is not active or has been used'
             return Response(
                 {'valid': False, 'error': error},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Increment usage
-        temp_code.increment_usage()
-        
         # Update visitor status
         visitor = temp_code.visitor
         if visitor.status == Visitor.Status.APPROVED:
             visitor.status = Visitor.Status.CHECKED_IN
             visitor.check_in_time = timezone.now()
-            visitor.save()
+            visitor.save(update_fields=['status', 'check_in_time', 'updated_at'])
         
         return Response({
             'valid': True,
@@ -164,6 +165,7 @@ class TemporaryCodeViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ['code', 'visitor__first_name', 'visitor__last_name']
     ordering_fields = ['created_at', 'valid_until']
     ordering = ['-created_at']
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -180,3 +182,27 @@ class TemporaryCodeViewSet(viewsets.ReadOnlyModelViewSet):
                 )
         
         return queryset
+    
+    @action(detail=True, methods=['get'], url_path=r'qr\.(?P<image_format>png|svg)')
+    def qr(self, request, pk=None, image_format='png'):
+        """QR image of the code (PNG with ?size=, or SVG), rendered on first request"""
+        temp_code = self.get_object()
+        try:
+            size = int(request.query_params.get('size', 300))
+        except ValueError:
+            size = None
+        if size is None or not 100 <= size <= 1000:
+            return Response(
+                {'error': 'size must be between 100 and 1000 pixels'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        digest, content = qr_image(temp_code, image_format, size)
+        etag = f'"{digest}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(content, content_type=CONTENT_TYPES[image_format])
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=300'
+        return response
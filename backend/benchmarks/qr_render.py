@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of QR code rendering
+
+Renders visitor QR codes with the previous path (qrcode's QRCode.make at
+box_size 10, LANCZOS resampling to the requested size, default PNG
+settings) and with utils.qr_generator.render_qr_png, and reports time per
+image and peak memory traced while rendering one. Pillow's image buffers
+are allocated outside the Python allocator and do not show in the peak.
+
+Usage:
+    python benchmarks/qr_render.py --count 500 --size 300
+"""
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+import qrcode
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.qr_generator import render_qr_png, visitor_qr_data  # noqa: E402
+
+
+def legacy_png(data, size):
+    """generate_qr_code as it was before the numpy encoder"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    if size != 300:
+        img = img.resize((size, size), Image.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def measure(render, payloads, size):
+    """Return (median ms per image, peak KiB per image, mean bytes per image)"""
+    render(payloads[0], size)
+    timings = []
+    lengths = []
+    for data in payloads:
+        started = time.perf_counter()
+        lengths.append(len(render(data, size)))
+        timings.append(time.perf_counter() - started)
+
+    peaks = []
+    tracemalloc.start()
+    for data in payloads[:50]:
+        tracemalloc.reset_peak()
+        render(data, size)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return statistics.median(timings) * 1000, statistics.median(peaks) / 1024, statistics.mean(lengths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=500, help='Images per path')
+    parser.add_argument('--size', type=int, default=300, help='Image size in pixels')
+    args = parser.parse_args()
+
+    payloads = [visitor_qr_data(f'{n:08X}', f'Visitante Número {n}') for n in range(args.count)]
+    print(f'{args.count} images of {args.size}px')
+    print(f'{"path":<10} {"ms/image":>9} {"peak KiB":>9} {"bytes":>7}')
+    for name, render in (('legacy', legacy_png), ('numpy', render_qr_png)):
+        ms, peak, length = measure(render, payloads, args.size)
+        print(f'{name:<10} {ms:>9.3f} {peak:>9.1f} {length:>7.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Latency benchmark for the access validation endpoints
+
+Fires concurrent validate requests at a running server and reports
+throughput and latency percentiles. Point it at the WSGI and ASGI services
+in turn to compare them. Standard library only.
+
+Usage:
+    python benchmarks/validate_latency.py http://localhost:8000/api/access/async/validate/ \
+        --token <access_token> --code RFID123456 --access-point 1
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    index = min(len(samples) - 1, max(0, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def validate_once(url, token, body):
+    """Send one validate request, returning (elapsed seconds, HTTP status)"""
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json',
+    })
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            code = response.status
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        code = exc.code
+    return time.perf_counter() - started, code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('url', help='Full URL of the validate endpoint')
+    parser.add_argument('--token', required=True, help='JWT access token')
+    parser.add_argument('--code', required=True, help='Code to scan')
+    parser.add_argument('--access-point', type=int, required=True, help='Access point id')
+    parser.add_argument('--access-type', default='ENTRY', choices=['ENTRY', 'EXIT'])
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    body = json.dumps({
+        'code': args.code,
+        'access_point_id': args.access_point,
+        'access_type': args.access_type,
+    }).encode('utf-8')
+
+    # Warm up connections and the server's credential index
+    validate_once(args.url, args.token, body)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda _: validate_once(args.url, args.token, body), range(args.requests)
+        ))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    statuses = {}
+    for _, code in results:
+        statuses[code] = statuses.get(code, 0) + 1
+
+    print(f'{args.requests} requests, concurrency {args.concurrency}, {wall:.2f}s')
+    print(f'throughput: {args.requests / wall:.1f} req/s')
+    print(f'latency ms: mean {statistics.mean(latencies):.2f}  '
+          f'p50 {percentile(latencies, 0.50):.2f}  '
+          f'p95 {percentile(latencies, 0.95):.2f}  '
+          f'p99 {percentile(latencies, 0.99):.2f}')
+    print('statuses: ' + ', '.join(f'{code}={count}' for code, count in sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    main()
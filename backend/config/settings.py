@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from decouple import config, Csv
 from datetime import timedelta
 import dj_database_url
@@ -97,6 +98,12 @@ if DATABASE_URL:
     DATABASES = {
         'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600)
     }
+    # Fail fast when the server is unreachable, so access logs fall back to
+    # their journal instead of waiting on TCP timeouts
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+        DATABASES['default'].setdefault('OPTIONS', {}).setdefault(
+            'connect_timeout', config('DATABASE_CONNECT_TIMEOUT', default=3, cast=int)
+        )
 else:
     DATABASES = {
         'default': {
@@ -106,6 +113,26 @@ else:
     }
 
 
+# Cache
+# Use Redis when available so workers share counters (e.g. credential index
+# generation); fall back to per-process memory for local development
+REDIS_URL = config('REDIS_URL', default=None)
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Custom User Model
 AUTH_USER_MODEL = 'users.CustomUser'
 
@@ -155,6 +182,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# QR images are rendered on first request and stored under MEDIA_ROOT/codes/qr/;
+# bytes of them each worker keeps in memory
+QR_CACHE_BYTES = config('QR_CACHE_BYTES', default=8 * 1024 * 1024, cast=int)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -176,9 +207,101 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ),
+    # Token buckets for the scan validation endpoints (see access_control/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'scan_access_point': config('SCAN_THROTTLE_ACCESS_POINT', default='20/s'),
+        'scan_device': config('SCAN_THROTTLE_DEVICE', default='10/s'),
+        'scan_user': config('SCAN_THROTTLE_USER', default='100/s'),
+    },
 }
 
 
+# Access validation
+# Seconds a worker may serve decisions from its in-process credential index
+# before reloading it from the database
+CREDENTIAL_INDEX_TTL = config('CREDENTIAL_INDEX_TTL', default=300, cast=int)
+
+# Without REDIS_URL, workers cannot tell each other about changes: each one
+# applies the credentials changed elsewhere at most this often (seconds)
+CREDENTIAL_INDEX_SYNC_INTERVAL = config('CREDENTIAL_INDEX_SYNC_INTERVAL', default=1.0, cast=float)
+
+# Keep a Bloom filter of issued codes so unknown codes skip the database
+CREDENTIAL_NEGATIVE_FILTER = config('CREDENTIAL_NEGATIVE_FILTER', default=True, cast=bool)
+
+# Seconds during which further unknown-code denials from one device are
+# counted instead of logged individually (0 logs every scan)
+UNKNOWN_CODE_WINDOW = config('UNKNOWN_CODE_WINDOW', default=60, cast=int)
+
+# Where scan throttle buckets live: 'cache' shares them through Redis when it
+# is the configured cache, 'local' keeps them per worker
+SCAN_THROTTLE_STORE = config('SCAN_THROTTLE_STORE', default='cache')
+
+# Repeats of a scan (same code, access point and access type) within this many
+# seconds get the first decision back without a new log (0 disables), and
+# seconds a response is replayed for requests repeating its Idempotency-Key.
+# Both are kept in Redis when it is the cache ('cache'), else per worker ('local')
+SCAN_DEBOUNCE_WINDOW = config('SCAN_DEBOUNCE_WINDOW', default=3, cast=int)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=900, cast=int)
+SCAN_DEDUP_STORE = config('SCAN_DEDUP_STORE', default='cache')
+
+# Seconds between publications of a worker's metrics to the shared cache
+# (at least 1)
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=10, cast=int)
+
+
+# Access logs
+# Queue access logs in memory and insert them in batches from a background
+# thread, instead of inserting before each validate response
+ACCESS_LOG_WRITE_BEHIND = config('ACCESS_LOG_WRITE_BEHIND', default=False, cast=bool)
+ACCESS_LOG_FLUSH_INTERVAL = config('ACCESS_LOG_FLUSH_INTERVAL', default=200, cast=int)  # milliseconds
+ACCESS_LOG_FLUSH_SIZE = config('ACCESS_LOG_FLUSH_SIZE', default=500, cast=int)
+
+# Local write-ahead journal for logs that cannot be inserted (outage, shutdown):
+# milliseconds an insert may take before its rows are journaled instead
+# (PostgreSQL only, 0 disables), and seconds the database is skipped after a
+# failed insert. The journal holds the only copy of those rows, so its
+# directory must be persistent storage outside BASE_DIR; write-behind refuses
+# to start without one. Unset, inline writes fail with the database instead
+ACCESS_LOG_JOURNAL_DIR = config('ACCESS_LOG_JOURNAL_DIR', default=None)
+ACCESS_LOG_WRITE_BUDGET = config('ACCESS_LOG_WRITE_BUDGET', default=250, cast=int)
+ACCESS_LOG_JOURNAL_RETRY = config('ACCESS_LOG_JOURNAL_RETRY', default=5, cast=int)
+
+# Seconds between rollup catch-ups run by the write-behind flusher, per worker
+# (0, or ACCESS_LOG_WRITE_BEHIND off, leaves it to the rollup_access_logs
+# command), and age a log must reach before it is rolled up, covering
+# transactions still committing
+ACCESS_LOG_ROLLUP_INTERVAL = config('ACCESS_LOG_ROLLUP_INTERVAL', default=60, cast=int)
+ACCESS_LOG_ROLLUP_LAG = config('ACCESS_LOG_ROLLUP_LAG', default=5, cast=int)
+
+# Whole months older than this many months are moved by archive_access_logs
+# into columnar files under ACCESS_LOG_ARCHIVE_DIR, still listed by /api/logs/.
+# The files are the only copy: archiving refuses to run until the directory
+# is set to persistent storage outside BASE_DIR (e.g. a mounted disk)
+ACCESS_LOG_RETENTION_MONTHS = config('ACCESS_LOG_RETENTION_MONTHS', default=24, cast=int)
+ACCESS_LOG_ARCHIVE_DIR = config('ACCESS_LOG_ARCHIVE_DIR', default=None)
+
+# Rows fetched per round trip when streaming /api/logs/export/
+ACCESS_LOG_EXPORT_CHUNK_SIZE = config('ACCESS_LOG_EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Seconds a computed /api/logs/stats/ response is shared between dashboards
+# (0 disables caching)
+ACCESS_STATS_CACHE_TTL = config('ACCESS_STATS_CACHE_TTL', default=10, cast=int)
+
+# Denial-rate alerts (/api/logs/alerts/): sliding window in seconds, denials
+# the window must hold, and standard deviations above the access point's or
+# device's usual denial rate
+ANOMALY_WINDOW = config('ANOMALY_WINDOW', default=300, cast=int)
+ANOMALY_MIN_DENIALS = config('ANOMALY_MIN_DENIALS', default=10, cast=int)
+ANOMALY_Z_THRESHOLD = config('ANOMALY_Z_THRESHOLD', default=4.0, cast=float)
+
+# Maximum number of scans accepted by one validate_batch request
+VALIDATE_BATCH_MAX_SIZE = config('VALIDATE_BATCH_MAX_SIZE', default=1000, cast=int)
+
+# Seconds of overlap between controller delta syncs, covering transactions
+# that were still committing when the previous sync ran
+CREDENTIAL_SYNC_OVERLAP = config('CREDENTIAL_SYNC_OVERLAP', default=5, cast=int)
+
+
 # Simple JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -210,6 +333,9 @@ CORS_ALLOWED_ORIGINS = config(
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Gate controllers may retry validate requests with an Idempotency-Key
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+
 # Allow CORS for all origins in development
 if DEBUG:
     CORS_ALLOW_ALL_ORIGINS = True
@@ -0,0 +1,110 @@
+"""
+Helpers for async-native API views under ASGI
+
+DRF views are synchronous, so under ASGI every request is bridged through a
+thread. These helpers let plain Django async views authenticate JWTs and
+validate request bodies without leaving the event loop.
+"""
+import json
+import math
+import time
+
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+# Seconds a worker trusts a cached "user is active" answer
+ACTIVE_USER_TTL = 60
+
+_active_users = {}
+
+
+async def _is_active(user_id):
+    now = time.monotonic()
+    cached = _active_users.get(user_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    
+    User = get_user_model()
+    is_active = await User.objects.filter(
+        **{api_settings.USER_ID_FIELD: user_id, 'is_active': True}
+    ).aexists()
+    _active_users[user_id] = (is_active, now + ACTIVE_USER_TTL)
+    return is_active
+
+
+async def authenticate(request):
+    """
+    Authenticate a request carrying a JWT access token
+    
+    The token is validated without a database read; whether the user is
+    still active is cached per worker for ACTIVE_USER_TTL seconds.
+    
+    Args:
+        request: Django HttpRequest
+        
+    Returns:
+        TokenUser for the token, or None if the request is not authenticated
+    """
+    backend = JWTStatelessUserAuthentication()
+    header = backend.get_header(request)
+    if header is None:
+        return None
+    
+    try:
+        raw_token = backend.get_raw_token(header)
+        if raw_token is None:
+            return None
+        user = backend.get_user(backend.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    
+    if not await _is_active(user.id):
+        return None
+    return user
+
+
+def unauthorized():
+    """Response matching DRF's NotAuthenticated error"""
+    return JsonResponse(
+        {'detail': 'Authentication credentials were not provided.'},
+        status=status.HTTP_401_UNAUTHORIZED
+    )
+
+
+def throttled(wait):
+    """Response matching DRF's Throttled error"""
+    response = JsonResponse(
+        {'detail': f'Request was throttled. Expected available in {math.ceil(wait)} seconds.'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def parse_request(request, serializer_class):
+    """
+    Parse and validate a JSON request body
+    
+    Args:
+        request: Django HttpRequest
+        serializer_class: DRF serializer used to validate the body
+        
+    Returns:
+        Tuple of (validated data, None), or (None, error JsonResponse)
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None, JsonResponse(
+            {'detail': 'JSON parse error'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    serializer = serializer_class(data=data)
+    if not serializer.is_valid():
+        return None, JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    return serializer.validated_data, None
@@ -0,0 +1,59 @@
+"""
+Bloom filter for Access Control System
+"""
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Probabilistic set of strings with no false negatives
+
+    might_contain() is False only for strings that were never added; it may
+    be True for strings that were not, at roughly the configured error rate
+    while no more than capacity strings have been added.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Args:
+            capacity: Number of strings the filter is sized for
+            error_rate: Target false positive rate at capacity (default: 0.01)
+        """
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hash_count = max(round(self.size / capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        """Add a string to the filter"""
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def might_contain(self, value):
+        """
+        Check whether a string may have been added
+
+        Args:
+            value: String to check
+
+        Returns:
+            False if the string was definitely never added
+        """
+        bits = self._bits
+        return all(bits[position >> 3] >> (position & 7) & 1 for position in self._positions(value))
+
+    @property
+    def is_saturated(self):
+        """True once more strings were added than the filter is sized for"""
+        return self.count > self.capacity
@@ -0,0 +1,280 @@
+"""
+Append-only local journal for Access Control System
+
+A journal is a directory of segment files holding JSON records. Each
+segment starts with MAGIC and holds framed records: a header with the
+payload length and its CRC-32, then the payload (one appended batch).
+
+Every process appends to its own open segment (`*.open`, held under an
+exclusive flock) and seals it (renamed to `*.seg`) once it reaches
+SEGMENT_BYTES, when asked to, or at exit. Segments left open by a process
+that died are sealed by the next replay, since nothing holds their lock.
+
+append() returns once its batch is on disk. Appends from several threads
+share fsyncs: while one thread syncs, the others wait, and the next sync
+covers all of them (group commit).
+
+replay() claims sealed segments by renaming them, hands their records to a
+callback and deletes them. A segment is read up to its first torn or
+corrupt record, which is where its writer crashed.
+"""
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: only sealed segments are replayed
+    fcntl = None
+
+MAGIC = b'JRNL1\n'
+HEADER = struct.Struct('<II')
+SEGMENT_BYTES = 16 << 20
+NEW_SUFFIX = '.new'
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+CLAIM_MARKER = '.replaying-'
+
+
+def _lock(fd):
+    """Take the exclusive lock of a segment without waiting"""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _fsync_directory(path):
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def read_segment(path):
+    """
+    Records of a segment, up to its first torn or corrupt record
+
+    Args:
+        path: Segment file
+
+    Returns:
+        List of records
+    """
+    data = Path(path).read_bytes()
+    if not data.startswith(MAGIC):
+        return []
+    records = []
+    offset = len(MAGIC)
+    while offset + HEADER.size <= len(data):
+        length, checksum = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        records.extend(json.loads(payload))
+        offset = start + length
+    return records
+
+
+class Journal:
+    """
+    Durable append-only journal of JSON records in a directory
+
+    Args:
+        directory: Callable returning the journal directory, read on use so
+            settings overrides apply
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._written = 0
+        self._synced = 0
+
+    @property
+    def directory(self):
+        return Path(self._directory())
+
+    def append(self, records):
+        """
+        Append a batch of records, returning once it is on disk
+
+        Args:
+            records: List of JSON-serializable records
+        """
+        if not records:
+            return
+        payload = json.dumps(records, separators=(',', ':')).encode()
+        frame = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._ensure_segment(len(frame))
+            view = memoryview(frame)
+            while view:
+                view = view[os.write(self._file.fileno(), view):]
+            self._size += len(frame)
+            self._written += 1
+            ticket = self._written
+        self._sync(ticket)
+
+    def _sync(self, ticket):
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return
+            with self._lock:
+                target = self._written
+                if self._synced >= ticket:
+                    return
+                # A duplicate survives the segment being sealed meanwhile
+                fd = os.dup(self._file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = max(self._synced, target)
+
+    def _ensure_segment(self, needed):
+        if self._pid != os.getpid():
+            # Forked: the parent's segment is the parent's to write
+            if self._file is not None:
+                self._file.close()
+            self._pid = os.getpid()
+            self._file = self._path = None
+            self._written = self._synced = 0
+        directory = self.directory
+        if self._file is not None and (
+            self._path.parent != directory or self._size + needed > SEGMENT_BYTES
+        ):
+            self._seal()
+        if self._file is not None:
+            return
+
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f'{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        new_path = directory / f'{name}{NEW_SUFFIX}'
+        file = open(new_path, 'xb', buffering=0)
+        # Locked before it is visible as open, so no replay can take it
+        _lock(file.fileno())
+        file.write(MAGIC)
+        os.fsync(file.fileno())
+        self._path = directory / f'{name}{OPEN_SUFFIX}'
+        os.replace(new_path, self._path)
+        _fsync_directory(directory)
+        self._file = file
+        self._size = len(MAGIC)
+
+    def _seal(self):
+        os.fsync(self._file.fileno())
+        self._synced = self._written
+        self._file.close()
+        os.replace(self._path, self._path.with_suffix(SEALED_SUFFIX))
+        self._file = self._path = None
+
+    def seal(self):
+        """Close the open segment so replay() can take it"""
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._seal()
+
+    def pending(self):
+        """Whether the directory holds segments to replay"""
+        directory = self.directory
+        if not directory.is_dir():
+            return False
+        return any(path.suffix != NEW_SUFFIX for path in directory.iterdir())
+
+    def _seal_orphans(self, directory):
+        for path in directory.glob(f'*{OPEN_SUFFIX}'):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                if _lock(fd):
+                    os.replace(path, path.with_suffix(SEALED_SUFFIX))
+            except FileNotFoundError:
+                pass
+            finally:
+                os.close(fd)
+
+    def _claimable(self, directory):
+        for path in sorted(directory.iterdir()):
+            if path.suffix == SEALED_SUFFIX:
+                yield path, path
+            elif CLAIM_MARKER in path.name:
+                sealed, _, pid = path.name.rpartition(CLAIM_MARKER)
+                # Claimed by a replay that died before finishing
+                if pid.isdigit() and not _process_alive(int(pid)):
+                    yield path, directory / sealed
+
+    def replay(self, insert, batch_size):
+        """
+        Hand every sealed segment's records to insert(), deleting each
+        segment once all of its records were inserted
+
+        The calling process's own segment is sealed first. Segments are
+        claimed by renaming, so concurrent replays never take the same one.
+        A segment whose insert() raises is put back and the others are
+        still replayed; the first error is raised at the end.
+
+        Args:
+            insert: Callable taking a list of at most batch_size records
+            batch_size: Records per insert() call
+
+        Returns:
+            Number of records inserted
+        """
+        self.seal()
+        directory = self.directory
+        if not directory.is_dir():
+            return 0
+        self._seal_orphans(directory)
+
+        inserted = 0
+        error = None
+        for path, sealed in self._claimable(directory):
+            claimed = directory / f'{sealed.name}{CLAIM_MARKER}{os.getpid()}'
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            records = read_segment(claimed)
+            try:
+                for start in range(0, len(records), batch_size):
+                    insert(records[start:start + batch_size])
+            except Exception as exc:
+                # Records inserted before the failure are inserted again next time
+                os.replace(claimed, sealed)
+                error = error or exc
+                continue
+            claimed.unlink()
+            inserted += len(records)
+        if error is not None:
+            raise error
+        return inserted
@@ -0,0 +1,25 @@
+"""
+Network helpers for Access Control System
+"""
+import ipaddress
+
+
+def get_client_ip(request):
+    """
+    Get the address of the device that sent a request
+    
+    Uses the first X-Forwarded-For entry when behind a proxy (as on Render).
+    The value is only recorded in logs, never used for access decisions.
+    
+    Args:
+        request: Django or DRF request
+        
+    Returns:
+        IP address string, or None if it cannot be determined
+    """
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    address = forwarded.split(',')[0].strip() or request.META.get('REMOTE_ADDR', '')
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        return None
@@ -0,0 +1,174 @@
+"""
+Pagination for Access Control System
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (ordering fields..., id), all descending
+
+    Each page is fetched with WHERE (fields, id) < (last row's fields, id)
+    ORDER BY fields DESC, id DESC LIMIT n, so deep pages cost the same as the
+    first one and rows inserted meanwhile never shift or repeat a page. No
+    COUNT(*) is run.
+
+    Views set keyset_fields (default: ('created_at',)), matching their
+    default ordering and a composite index. Requests with ?page or ?ordering
+    fall back to PageNumberPagination, for the admin UI, and so do ?search
+    requests, whose results are ranked by relevance.
+
+    Views may also define get_extra_keyset_rows(cursor, reverse, limit),
+    returning rows kept outside the queryset (e.g. archived logs) in the
+    same order; they are merged into the pages. cursor['key'] is the
+    position (fields..., id) of the last row seen.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_number = None
+        if {'page', 'ordering', 'search'} & request.query_params.keys():
+            self.page_number = PageNumberPagination()
+            return self.page_number.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.fields = tuple(getattr(view, 'keyset_fields', ('created_at',)))
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+
+        reverse = cursor is not None and cursor['reverse']
+        key_fields = self.fields + ('id',)
+        if reverse:
+            # Walk backwards from the cursor, then restore the page order
+            queryset = queryset.order_by(*key_fields)
+        else:
+            queryset = queryset.order_by(*(f'-{field}' for field in key_fields))
+        if cursor is not None:
+            queryset = queryset.filter(self.after(key_fields, cursor['key'], 'gt' if reverse else 'lt'))
+
+        rows = list(queryset[:page_size + 1])
+        get_extra_rows = getattr(view, 'get_extra_keyset_rows', None)
+        if get_extra_rows is not None:
+            extra = get_extra_rows(cursor, reverse, page_size + 1)
+            if extra:
+                rows = sorted(rows + extra, key=self.row_key, reverse=not reverse)[:page_size + 1]
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    @staticmethod
+    def after(fields, key, comparison):
+        """
+        Filter for rows past a position: (fields) < key, or > with 'gt'
+
+        Spelled out as (a < x) OR (a = x AND b < y) OR ..., which every
+        database can match against a composite index on the fields.
+        """
+        condition = Q()
+        for index, field in enumerate(fields):
+            equal = {name: value for name, value in zip(fields[:index], key)}
+            condition |= Q(**equal, **{f'{field}__{comparison}': key[index]})
+        return condition
+
+    def row_key(self, row):
+        return tuple(getattr(row, field) for field in self.fields) + (row.pk,)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request, model):
+        """
+        Position carried by the cursor query parameter
+
+        Returns:
+            Dictionary with key (the row position) and reverse, or None on
+            the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values = data['v']
+            if not isinstance(values, list):
+                # Cursors issued before keys had several fields
+                values = [values]
+            if len(values) != len(self.fields):
+                raise ValueError('cursor does not match the ordering')
+            key = tuple(
+                model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)
+            )
+            return {
+                'key': key + (int(data['id']),),
+                'reverse': bool(data.get('r')),
+            }
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        values = [getattr(row, field) for field in self.fields]
+        data = {
+            'v': [value.isoformat() if hasattr(value, 'isoformat') else value for value in values],
+            'id': row.pk,
+        }
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+        url = remove_query_param(self.base_url, 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.page_number is not None:
+            return self.page_number.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
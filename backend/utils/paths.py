@@ -0,0 +1,21 @@
+"""
+Filesystem locations for Access Control System
+"""
+from pathlib import Path
+
+from django.conf import settings
+
+
+def inside_base_dir(path):
+    """
+    Whether a path lies inside BASE_DIR, which is replaced on every deploy
+
+    Args:
+        path: Path to check, resolved first
+
+    Returns:
+        True if data written there does not survive a deploy
+    """
+    path = Path(path).resolve()
+    base_dir = Path(settings.BASE_DIR).resolve()
+    return path == base_dir or base_dir in path.parents
@@ -1,43 +1,192 @@
 """
 QR Code Generator for Access Control System
 """
+import functools
 import qrcode
+import qrcode.image.svg
+import numpy as np
 from io import BytesIO
 from PIL import Image
 import base64
 
+BORDER = 4
+ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_L
+# zlib level of rendered PNGs; higher levels take longer than the few
+# bytes they save on 1-bit images are worth
+PNG_COMPRESS_LEVEL = 6
 
-def generate_qr_code(data, size=300):
+# 1:1:3:1:1 finder-like patterns with 4 light modules on either side, as
+# 11-bit numbers read first module first
+FINDER_LIKE = (0b10111010000, 0b00001011101)
+FINDER_LIKE_LENGTH = 11
+
+
+@functools.lru_cache(maxsize=None)
+def _mask_planes(version):
     """
-    Generate a QR code from the given data
+    Symbols of a version with all-light data, one per mask pattern, with
+    format and version information left blank as while choosing the mask
+    """
+    qr = qrcode.QRCode(version=version)
+    qr.data_cache = []
+    planes = []
+    for mask_pattern in range(8):
+        qr.makeImpl(True, mask_pattern)
+        planes.append(qr.modules)
+    planes = np.array(planes, dtype=bool)
+    planes.setflags(write=False)
+    return planes
+
+
+@functools.lru_cache(maxsize=None)
+def _format_modules(version, error_correction, mask_pattern):
+    """Dark format and version information modules of a symbol"""
+    qr = qrcode.QRCode(version=version, error_correction=error_correction)
+    qr.data_cache = []
+    qr.makeImpl(False, mask_pattern)
+    modules = np.array(qr.modules, dtype=bool) ^ _mask_planes(version)[mask_pattern]
+    modules.setflags(write=False)
+    return modules
+
+
+def mask_penalties(symbols):
+    """
+    Penalty scores of candidate symbols, as qrcode's util.lost_point
     
     Args:
-        data: String data to encode in QR
-        size: Size of the QR code in pixels (default: 300)
+        symbols: Boolean array of shape (candidates, modules, modules)
         
     Returns:
-        BytesIO object containing the QR code image
+        Array with the penalty of each candidate
     """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+    count = symbols.shape[-1]
+    lines = np.concatenate([symbols, symbols.transpose(0, 2, 1)], axis=1)
+
+    # Runs of 5 or more modules of one color in a row or column, each
+    # scoring its length minus 2: one per uniform stretch of 5 modules it
+    # holds, plus 2 at its first one
+    same = lines[..., 1:] == lines[..., :-1]
+    uniform = same[..., :-3] & same[..., 1:-2] & same[..., 2:-1] & same[..., 3:]
+    run_starts = uniform.copy()
+    run_starts[..., 1:] &= ~same[..., :-4]
+    penalties = np.count_nonzero(uniform, axis=(1, 2)) + 2 * np.count_nonzero(run_starts, axis=(1, 2))
+
+    # 2x2 blocks of one color
+    top, bottom = symbols[:, :-1], symbols[:, 1:]
+    blocks = (
+        (top[..., :-1] == top[..., 1:])
+        & (top[..., 1:] == bottom[..., 1:])
+        & (bottom[..., 1:] == bottom[..., :-1])
     )
-    qr.add_data(data)
-    qr.make(fit=True)
+    penalties += 3 * np.count_nonzero(blocks, axis=(1, 2))
+
+    # Finder-like patterns in a row or column
+    starts = count - FINDER_LIKE_LENGTH + 1
+    windows = np.zeros(lines.shape[:2] + (starts,), dtype=np.uint16)
+    for offset in range(FINDER_LIKE_LENGTH):
+        windows <<= 1
+        windows |= lines[..., offset:offset + starts]
+    found = (windows == FINDER_LIKE[0]) | (windows == FINDER_LIKE[1])
+    penalties += 40 * np.count_nonzero(found, axis=(1, 2))
+
+    # Every 5% of dark modules away from 50%
+    percent = np.count_nonzero(symbols, axis=(1, 2)) / count ** 2
+    penalties += 10 * (np.abs(percent * 100 - 50) // 5).astype(int)
+    return penalties
+
+
+def best_mask_pattern(qr):
+    """
+    Choose the mask pattern of a QR code as qrcode's QRCode.make does
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    The data is placed once and the eight mask patterns are applied and
+    scored with numpy, rather than placing and scoring each in Python.
     
-    # Resize if needed
-    if size != 300:
-        img = img.resize((size, size), Image.LANCZOS)
+    Args:
+        qr: qrcode.QRCode with its data added and version set
+        
+    Returns:
+        Tuple of (mask pattern, boolean array of the masked modules
+        without format information)
+    """
+    qr.makeImpl(True, 0)
+    planes = _mask_planes(qr.version)
+    candidates = planes ^ (np.array(qr.modules, dtype=bool) ^ planes[0])
+    mask_pattern = int(np.argmin(mask_penalties(candidates)))
+    return mask_pattern, candidates[mask_pattern]
+
+
+def encode_qr(data):
+    """
+    Encode data as a QR code module matrix, the same symbol as qrcode's
     
-    # Save to BytesIO
+    Args:
+        data: String data to encode in QR
+        
+    Returns:
+        Boolean array of modules, True for dark, without border
+    """
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECTION)
+    qr.add_data(data)
+    qr.best_fit()
+    mask_pattern, modules = best_mask_pattern(qr)
+    return modules ^ _format_modules(qr.version, ERROR_CORRECTION, mask_pattern)
+
+
+def _write_qr_png(data, size, compress_level):
+    modules = np.pad(encode_qr(data), BORDER)
+    count = len(modules)
+    scale = max(1, size // count)
+    side = max(size, count)
+    # Pixels left over by integer scaling widen the quiet zone
+    offset = (side - count * scale) // 2
+    # Pack each module row into 1-bit pixels (set for light) once, then
+    # repeat packed rows rather than pixels
+    light = np.ones((count + 2, side), dtype=bool)
+    light[1:-1, offset:offset + count * scale] = ~modules.repeat(scale, axis=1)
+    rows = np.packbits(light, axis=1)
+    repeats = [offset] + [scale] * count + [side - offset - count * scale]
+    pixels = rows.repeat(repeats, axis=0)
+
     buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
+    Image.frombuffer('1', (side, side), pixels, 'raw', '1', 0, 1).save(
+        buffer, format='PNG', compress_level=compress_level
+    )
+    return buffer
+
+
+def render_qr_png(data, size=300, compress_level=PNG_COMPRESS_LEVEL):
+    """
+    Render a QR code as a 1-bit PNG
+    
+    Modules are scaled by a whole number of pixels, so edges stay sharp
+    without resampling.
     
+    Args:
+        data: String data to encode in QR
+        size: Width and height of the image in pixels (default: 300), or
+            one pixel per module if the code does not fit
+        compress_level: zlib compression level, 0 to 9
+        
+    Returns:
+        memoryview of the PNG file, without copying it out of its buffer
+    """
+    return _write_qr_png(data, size, compress_level).getbuffer()
+
+
+def generate_qr_code(data, size=300):
+    """
+    Generate a QR code from the given data
+    
+    Args:
+        data: String data to encode in QR
+        size: Size of the QR code in pixels (default: 300)
+        
+    Returns:
+        BytesIO object containing the QR code image
+    """
+    buffer = _write_qr_png(data, size, PNG_COMPRESS_LEVEL)
+    buffer.seek(0)
     return buffer
 
 
@@ -52,27 +201,81 @@ def generate_qr_code_base64(data, size=300):
     Returns:
         Base64 encoded string of the QR code image
     """
-    buffer = generate_qr_code(data, size)
-    img_base64 = base64.b64encode(buffer.read()).decode()
+    img_base64 = base64.b64encode(render_qr_png(data, size)).decode()
     return f"data:image/png;base64,{img_base64}"
 
 
-def generate_visitor_qr(visitor_code, visitor_name=None):
+def generate_qr_code_svg(data):
     """
-    Generate QR code specifically for visitor access
+    Generate a QR code as an SVG document
+    
+    Args:
+        data: String data to encode in QR
+        
+    Returns:
+        SVG document as bytes; it scales to any size
+    """
+    qr = qrcode.QRCode(
+        error_correction=ERROR_CORRECTION,
+        border=BORDER,
+        image_factory=qrcode.image.svg.SvgPathImage,
+    )
+    qr.add_data(data)
+    qr.best_fit()
+    qr.mask_pattern, _ = best_mask_pattern(qr)
+    qr.make(fit=False)
+    
+    buffer = BytesIO()
+    qr.make_image().save(buffer)
+    return buffer.getvalue()
+
+
+def render_qr(data, image_format='png', size=300):
+    """
+    Render a QR code as PNG or SVG
+    
+    Args:
+        data: String data to encode in QR
+        image_format: 'png' or 'svg'
+        size: Size of PNG images in pixels (default: 300)
+        
+    Returns:
+        Image file contents, as bytes or a memoryview
+    """
+    if image_format == 'svg':
+        return generate_qr_code_svg(data)
+    return render_qr_png(data, size)
+
+
+def visitor_qr_data(visitor_code, visitor_name=None):
+    """
+    Data encoded in a visitor's QR code
     
     Args:
         visitor_code: Unique visitor code
         visitor_name: Optional visitor name
         
     Returns:
-        BytesIO object containing the QR code image
+        String to encode
     """
     data = f"VISITOR:{visitor_code}"
     if visitor_name:
         data += f"|{visitor_name}"
+    return data
+
+
+def generate_visitor_qr(visitor_code, visitor_name=None):
+    """
+    Generate QR code specifically for visitor access
     
-    return generate_qr_code(data)
+    Args:
+        visitor_code: Unique visitor code
+        visitor_name: Optional visitor name
+        
+    Returns:
+        BytesIO object containing the QR code image
+    """
+    return generate_qr_code(visitor_qr_data(visitor_code, visitor_name))
 
 
 def generate_access_qr(code_type, code_value, metadata=None):
@@ -0,0 +1,95 @@
+"""
+Query plan inspection for Access Control System
+
+capture_queries() records the SQL a block of code runs, with its parameters;
+sequential_scans() runs EXPLAIN on a statement and reports the tables it
+reads in full. Used by `manage.py check_query_plans` to catch list filters
+that lost their index.
+"""
+import re
+from contextlib import contextmanager
+
+# SQLite: "SCAN table" reads the whole table and "SEARCH" seeks an index.
+# "SCAN table USING [COVERING] INDEX" walks a whole index: only a LIMIT can
+# stop it early, and only when the index already yields the ORDER BY
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?$')
+SQLITE_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+@contextmanager
+def capture_queries(connection):
+    """
+    Record the statements run on a connection
+
+    Yields:
+        List filled with (sql, params) tuples as statements run
+    """
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        yield queries
+
+
+def explain(connection, sql, params):
+    """
+    Query plan of a statement
+
+    Returns:
+        PostgreSQL: the JSON plan tree; SQLite: list of plan detail lines
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            return plan[0]['Plan'] if isinstance(plan, list) else plan
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def _postgresql_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from _postgresql_scans(child)
+
+
+def _empty_postgresql_tables(connection, prefixes):
+    # Partitions with no rows (e.g. months ahead) are cheapest to scan
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples <= 0 "
+            "AND relname LIKE ANY(%s)",
+            [[f'{prefix}%' for prefix in prefixes]]
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def sequential_scans(connection, sql, params, tables):
+    """
+    Tables a statement reads in full
+
+    Args:
+        connection: Database connection (PostgreSQL or SQLite)
+        sql, params: Statement as run by the connection
+        tables: Table names to check; partitions of these tables count as
+            the table itself, except empty ones on PostgreSQL
+
+    Returns:
+        Sorted list of the scanned table (or partition) names
+    """
+    plan = explain(connection, sql, params)
+    if connection.vendor == 'postgresql':
+        scanned = {name for name in _postgresql_scans(plan) if name.startswith(tuple(tables))}
+        scanned -= _empty_postgresql_tables(connection, tables)
+    else:
+        scanned = set()
+        sorted_after = SQLITE_SORT in plan
+        for detail in plan:
+            match = SQLITE_SCAN.match(detail)
+            if match and match.group(1) in tables and (not match.group(2) or sorted_after):
+                scanned.add(match.group(1))
+    return sorted(scanned)
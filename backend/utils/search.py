@@ -0,0 +1,184 @@
+"""
+Indexed text search for Access Control System
+
+Models list the fields to index in SEARCH_INDEX_FIELDS. Migrations create
+the index with create_search_index():
+
+- PostgreSQL: a trigram GIN index per column on UPPER(column), the
+  expression Django's icontains compiles to, so ?search= keeps its substring
+  semantics but no longer scans the table. Results are ranked by
+  word_similarity().
+- SQLite: an FTS5 table with the trigram tokenizer, kept in sync with the
+  model table by triggers. Results are ranked by bm25.
+
+IndexedSearchFilter replaces DRF's SearchFilter on the viewsets of those
+models. Search fields on related models, and terms shorter than three
+characters on SQLite, still use icontains.
+"""
+import operator
+from functools import reduce
+
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from rest_framework.filters import SearchFilter
+
+FTS_SUFFIX = '_fts'
+TRIGRAM_MIN_LENGTH = 3
+
+
+def _trigram_index_name(table, column):
+    return f'{table[:40]}_{column[:14]}_trgm'
+
+
+def _fts_sql(table, columns):
+    """Statements creating the FTS5 table and its sync triggers (idempotent)"""
+    fts = f'{table}{FTS_SUFFIX}'
+    names = ', '.join(f'"{column}"' for column in columns)
+    new = ', '.join(f'new."{column}"' for column in columns)
+    old = ', '.join(f'old."{column}"' for column in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert = f'INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{names}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN {delete} {insert} END',
+    ]
+
+
+def create_search_index(connection, model, fields):
+    """
+    Create the search index of a model
+
+    Args:
+        connection: Database connection
+        model: Model class (historical models from migrations work too)
+        fields: Names of the text fields to index
+    """
+    table = model._meta.db_table
+    columns = [model._meta.get_field(name).column for name in fields]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for column in columns:
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {_trigram_index_name(table, column)} '
+                    f'ON {table} USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+                )
+        elif connection.vendor == 'sqlite':
+            for statement in _fts_sql(table, columns):
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {table}{FTS_SUFFIX}({table}{FTS_SUFFIX}) VALUES ('rebuild')")
+
+
+def drop_search_index(connection, model, fields):
+    """Drop the search index created by create_search_index()"""
+    table = model._meta.db_table
+    columns = [model._meta.get_field(name).column for name in fields]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for column in columns:
+                cursor.execute(f'DROP INDEX IF EXISTS {_trigram_index_name(table, column)}')
+        elif connection.vendor == 'sqlite':
+            for suffix in ('_ai', '_ad', '_au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {table}{FTS_SUFFIX}{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {table}{FTS_SUFFIX}')
+
+
+def repair_search_indexes(sender, using='default', **kwargs):
+    """
+    post_migrate receiver restoring SQLite sync triggers
+
+    SQLite migrations that alter a table rebuild it, which drops its
+    triggers; the FTS table is then refilled from the model table.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    for model in sender.get_models():
+        if not getattr(model, 'SEARCH_INDEX_FIELDS', None):
+            continue
+        fts = f'{model._meta.db_table}{FTS_SUFFIX}'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [f'{fts}_a_']
+            )
+            complete = cursor.fetchone()[0] == 3
+        if not complete:
+            create_search_index(connection, model, model.SEARCH_INDEX_FIELDS)
+
+
+def _fts_match(term):
+    # One FTS5 phrase: matches the term as a substring, case-insensitively
+    return '"' + term.replace('"', '""') + '"'
+
+
+class IndexedSearchFilter(SearchFilter):
+    """
+    SearchFilter served by the model's search index and ranked by relevance
+
+    Place it after OrderingFilter: results are ordered by rank first, then by
+    the view's ordering. Falls back to SearchFilter when the model has no
+    SEARCH_INDEX_FIELDS or the database has no index for it.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        indexed = getattr(queryset.model, 'SEARCH_INDEX_FIELDS', ())
+        vendor = connections[queryset.db].vendor
+        if not search_fields or not search_terms or not indexed or vendor not in ('postgresql', 'sqlite'):
+            return super().filter_queryset(request, queryset, view)
+
+        fields = [field for field in search_fields if field in indexed]
+        others = [field for field in search_fields if field not in indexed]
+        if not fields or (vendor == 'sqlite' and min(map(len, search_terms)) < TRIGRAM_MIN_LENGTH):
+            return super().filter_queryset(request, queryset, view)
+
+        if vendor == 'postgresql':
+            queryset = self._filter_postgresql(queryset, fields, others, search_terms)
+        else:
+            queryset = self._filter_sqlite(queryset, fields, others, search_terms)
+        if self.must_call_distinct(queryset, search_fields):
+            queryset = queryset.distinct()
+        return queryset
+
+    def _others_match(self, others, term):
+        return [Q(**{f'{field}__icontains': term}) for field in others]
+
+    def _rank(self, queryset, rank):
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        return queryset.annotate(search_rank=rank).order_by(
+            F('search_rank').desc(nulls_last=True), *ordering
+        )
+
+    def _filter_postgresql(self, queryset, fields, others, search_terms):
+        # Imported here: django.contrib.postgres needs psycopg
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        for term in search_terms:
+            matches = [Q(**{f'{field}__icontains': term}) for field in fields]
+            queryset = queryset.filter(reduce(operator.or_, matches + self._others_match(others, term)))
+        text = ' '.join(search_terms)
+        similarities = [TrigramWordSimilarity(text, field) for field in fields]
+        rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+        return self._rank(queryset, rank)
+
+    def _filter_sqlite(self, queryset, fields, others, search_terms):
+        table = queryset.model._meta.db_table
+        fts = f'{table}{FTS_SUFFIX}'
+        scope = '{' + ' '.join(queryset.model._meta.get_field(field).column for field in fields) + '}'
+        for term in search_terms:
+            match = f'{scope} : {_fts_match(term)}'
+            indexed = Q(pk__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', [match]))
+            queryset = queryset.filter(reduce(operator.or_, [indexed] + self._others_match(others, term)))
+        match = f'{scope} : ' + ' OR '.join(_fts_match(term) for term in search_terms)
+        # bm25 rank is lower for better matches
+        rank = RawSQL(
+            f'(SELECT -rank FROM {fts} WHERE {fts} MATCH %s AND rowid = "{table}"."id")', [match]
+        )
+        return self._rank(queryset, rank)